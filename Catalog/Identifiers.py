@@ -2,14 +2,22 @@
 Database internal object identifiers for files, pages, and tuples.
 
 All identifiers implement structural equality.
+
+Identifiers are immutable, and use slots rather than a per-instance dictionary.
+Page and tuple identifiers also keep an integer key encoding all of their
+components, which is computed once and then used for equality and hashing.
+Large collections of tuple identifiers can be stored compactly as a TupleIdArray.
 """
 
 import struct
 
+from array           import array
+from collections.abc import Sequence
+
 class FileId:
   """
   A file identifier class, storing an unsigned short representing a file number.
-  
+
   We can use a file identifier to retrieve the full path of a file from
   the database catalog. File identifiers implement pack and unpack methods to
   support their storage on disk.
@@ -20,6 +28,8 @@ class FileId:
   True
   """
 
+  __slots__ = ('fileIndex',)
+
   binrepr = struct.Struct("H")
   size    = binrepr.size
 
@@ -27,7 +37,7 @@ class FileId:
     self.fileIndex = fileIndex
 
   def __eq__(self, other):
-    return self.fileIndex == other.fileIndex
+    return isinstance(other, FileId) and self.fileIndex == other.fileIndex
 
   def __hash__(self):
     return hash(self.fileIndex)
@@ -44,43 +54,72 @@ class FileId:
 
 class PageId:
   """
-  A page identifier class, storing a file identifier and an unsigned short
+  A page identifier class, storing a file identifier and an unsigned int
   representing a page number.
 
+  A page identifier's key is an integer holding the file number in its upper
+  bits and the page number in its lower 32 bits.
+
   >>> pId1 = PageId(FileId(5), 100)
   >>> pId2 = PageId.unpack(pId1.pack())
   >>> pId1 == pId2
   True
+
+  # Files may hold more than 65,535 pages.
+  >>> PageId.unpack(PageId(FileId(5), 100000).pack()).pageIndex
+  100000
+
+  >>> PageId.fromKey(pId1.key) == pId1
+  True
+  >>> pId1.key == (5 << 32) | 100
+  True
   """
 
-  binrepr = struct.Struct("H")
+  __slots__ = ('fileId', 'pageIndex', 'key')
+
+  binrepr = struct.Struct("I")
   size    = FileId.binrepr.size + binrepr.size
 
+  # A packed page identifier, as a single struct without alignment padding.
+  fullrepr  = struct.Struct("=HI")
+  indexBits = 8 * binrepr.size
+
   def __init__(self, fileId, pageIndex):
     self.fileId    = fileId
     self.pageIndex = pageIndex
+    self.key       = PageId.encode(fileId, pageIndex)
+
+  # Returns the integer key for a file identifier and page index.
+  # Page ids without a file identifier fall back to a tuple key.
+  @classmethod
+  def encode(cls, fileId, pageIndex):
+    if fileId is None:
+      return (None, pageIndex)
+    return (fileId.fileIndex << cls.indexBits) | pageIndex
+
+  @classmethod
+  def fromKey(cls, key):
+    return cls(FileId(key >> cls.indexBits), key & ((1 << cls.indexBits) - 1))
 
   def __eq__(self, other):
-    return self.fileId == other.fileId and self.pageIndex == other.pageIndex
+    return isinstance(other, PageId) and self.key == other.key
 
   def __hash__(self):
-    return hash((self.fileId, self.pageIndex))
+    return hash(self.key)
 
   def pack(self):
     if self.fileId:
-      return self.fileId.pack() + PageId.binrepr.pack(self.pageIndex)
+      return PageId.fullrepr.pack(self.fileId.fileIndex, self.pageIndex)
 
   @classmethod
   def unpack(cls, buffer):
-    pageIdSize = PageId.binrepr.size
-    fileId     = FileId.unpack(buffer)
-    pageIndex  = PageId.binrepr.unpack_from(buffer, offset=FileId.size)[0]
-    return cls(fileId, pageIndex)
+    (fileIndex, pageIndex) = PageId.fullrepr.unpack_from(buffer)
+    return cls(FileId(fileIndex), pageIndex)
 
 
 class TupleId:
   """
-  A tuple identifier class, storing a page identifier and an unsigned short
+  A tuple identifier class, storing a page identifier and an unsigned int
   representing a tuple index.
 
   The tuple index may have a page-specific interpretation. For example for
@@ -89,37 +128,120 @@ class TupleId:
 
   The caller must ensure appropriate TupleIds are compared.
 
+  A tuple identifier's key is an integer holding its page identifier's key in
+  its upper bits and the tuple index in its lower 32 bits.
+
   >>> tId1 = TupleId(PageId(FileId(5), 100), 1000)
   >>> tId2 = TupleId.unpack(tId1.pack())
   >>> tId1 == tId2
   True
+
+  >>> tId3 = TupleId(PageId(FileId(5), 100000), 70000)
+  >>> TupleId.unpack(tId3.pack()) == tId3
+  True
+
+  >>> TupleId.fromKey(tId3.key) == tId3
+  True
   """
 
-  binrepr = struct.Struct("H")
+  __slots__ = ('pageId', 'tupleIndex', 'key')
+
+  binrepr = struct.Struct("I")
   size    = PageId.size + binrepr.size
 
+  # A packed tuple identifier, as a single struct without alignment padding.
+  fullrepr  = struct.Struct("=HII")
+  indexBits = 8 * binrepr.size
+
   def __init__(self, pageId, tupleIndex):
     self.pageId     = pageId
     self.tupleIndex = tupleIndex
+    self.key        = TupleId.encode(pageId, tupleIndex)
+
+  # Returns the integer key for a page identifier and tuple index.
+  # Tuple ids without a page identifier fall back to a tuple key.
+  @classmethod
+  def encode(cls, pageId, tupleIndex):
+    if pageId is None or isinstance(pageId.key, tuple):
+      return (pageId, tupleIndex)
+    return (pageId.key << cls.indexBits) | tupleIndex
+
+  @classmethod
+  def fromKey(cls, key):
+    return cls(PageId.fromKey(key >> cls.indexBits), key & ((1 << cls.indexBits) - 1))
 
   def __eq__(self, other):
-    return self.pageId == other.pageId and self.tupleIndex == other.tupleIndex
+    return isinstance(other, TupleId) and self.key == other.key
 
   def __hash__(self):
-    return hash((self.pageId, self.tupleIndex))
+    return hash(self.key)
 
   def pack(self):
     if self.pageId:
-      return self.pageId.pack() + TupleId.binrepr.pack(self.tupleIndex)
+      return TupleId.fullrepr.pack(self.pageId.fileId.fileIndex, self.pageId.pageIndex, self.tupleIndex)
 
   @classmethod
   def unpack(cls, buffer):
-    tupleIdSize = TupleId.binrepr.size
-    pageId      = PageId.unpack(buffer)
-    tupleIndex  = TupleId.binrepr.unpack_from(buffer, offset=PageId.size)[0]
-    return cls(pageId,tupleIndex)
+    (fileIndex, pageIndex, tupleIndex) = TupleId.fullrepr.unpack_from(buffer)
+    return cls(PageId(FileId(fileIndex), pageIndex), tupleIndex)
+
+
+class TupleIdArray(Sequence):
+  """
+  A compact sequence of tuple identifiers.
+
+  Tuple identifiers are stored as machine integers rather than as Python objects,
+  with page keys in an array of unsigned long longs, and tuple indexes in an array
+  of unsigned ints. Accessing an element constructs its TupleId.
+
+  >>> tIds = TupleIdArray()
+  >>> for i in range(1000):
+  ...   tIds.append(TupleId(PageId(FileId(2), i // 100), i % 100))
+  ...
+  >>> len(tIds)
+  1000
+  >>> tIds[250] == TupleId(PageId(FileId(2), 2), 50)
+  True
+  >>> tIds[-1].pageId.pageIndex
+  9
+  >>> TupleId(PageId(FileId(2), 3), 0) in tIds
+  True
+  >>> [t.tupleIndex for t in tIds[10:13]]
+  [10, 11, 12]
+
+  # Tuple id arrays support random sampling, as any sequence.
+  >>> import random
+  >>> len(set(random.sample(tIds, 10)))
+  10
+  """
+
+  def __init__(self, tupleIds=None):
+    self.pageKeys     = array('Q')
+    self.tupleIndexes = array('I')
+    if tupleIds is not None:
+      self.extend(tupleIds)
+
+  def __len__(self):
+    return len(self.tupleIndexes)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      result = TupleIdArray()
+      result.pageKeys     = self.pageKeys[index]
+      result.tupleIndexes = self.tupleIndexes[index]
+      return result
+
+    return TupleId(PageId.fromKey(self.pageKeys[index]), self.tupleIndexes[index])
+
+  def append(self, tupleId):
+    self.pageKeys.append(tupleId.pageId.key)
+    self.tupleIndexes.append(tupleId.tupleIndex)
+
+  def extend(self, tupleIds):
+    for tupleId in tupleIds:
+      self.append(tupleId)
 
 
 if __name__ == "__main__":
     import doctest
-    doctest.testmod()
\ No newline at end of file
+    doctest.testmod()
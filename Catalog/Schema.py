@@ -1,6 +1,6 @@
 import json, re
 from collections import namedtuple
-from struct import Struct
+from struct import Struct, calcsize
 
 class Types:
   """
@@ -169,15 +169,71 @@ class DBSchema:
   >>> d = schema.default()
   >>> d.id == 0 and d.dob == (chr(0) * 10) and d.salary == 0
   True
+
+  # Field layout within a packed tuple, as (offset, size) pairs.
+  >>> schema.fieldLayout()
+  [(0, 4), (4, 10), (16, 4)]
+
+  Schemas may choose the physical layout of their packed tuples. The default
+  'native' layout stores fields in declaration order with native alignment,
+  padding fields as needed. The 'packed' layout uses standard sizes with no
+  padding, while the 'reordered' layout keeps native alignment but stores fields
+  in decreasing order of alignment, which also avoids padding between fields.
+  Instances are always created and unpacked with fields in declaration order.
+
+  >>> fields = [('key', 'int'), ('status', 'char(1)'), ('price', 'double'), ('qty', 'int')]
+  >>> [DBSchema('orders', fields, layout=l).size for l in ['native', 'packed', 'reordered']]
+  [20, 17, 17]
+
+  >>> reordered = DBSchema('orders', fields, layout='reordered')
+  >>> o1 = reordered.instantiate(1, 'F', 10.5, 3)
+  >>> reordered.unpack(reordered.pack(o1)) == o1
+  True
+  >>> reordered.fieldLayout()
+  [(8, 4), (16, 1), (0, 8), (12, 4)]
+
+  >>> DBSchema.unpackSchema(reordered.packSchema()).layout
+  'reordered'
   """
-  
-  def __init__(self, name, fieldsAndTypes):
-    self.name = name
+
+  # Record layouts, as a struct format prefix and whether fields are
+  # reordered by decreasing alignment.
+  layouts = {
+      'native'    : ('',  False),
+      'packed'    : ('=', False),
+      'reordered' : ('',  True)
+    }
+
+  defaultLayout = 'native'
+
+  # Schema constructor.
+  #
+  # Keyword arguments:
+  # layout : the physical tuple layout, one of the keys of 'layouts'.
+  def __init__(self, name, fieldsAndTypes, **kwargs):
+    self.name   = name
+    self.layout = kwargs.get("layout", DBSchema.defaultLayout)
+    if self.layout not in DBSchema.layouts:
+      raise ValueError("Unknown schema layout: " + str(self.layout))
+
     if self.name and fieldsAndTypes:
       self.fields  = [x[0] for x in fieldsAndTypes]
       self.types   = [x[1] for x in fieldsAndTypes]
       self.clazz   = namedtuple(self.name, self.fields)
-      self.binrepr = Struct(''.join([Types.formatType(x) for x in self.types]))
+      self.formats = [Types.formatType(x) for x in self.types]
+
+      # Physical field order, as indexes of the declared fields.
+      (self.prefix, reorder) = DBSchema.layouts[self.layout]
+      self.order = list(range(len(self.fields)))
+      if reorder:
+        self.order.sort(key=lambda i: -calcsize(self.formats[i][-1]))
+
+      # Position of each declared field in the physical order, if fields are reordered.
+      self.positions = None
+      if self.order != sorted(self.order):
+        self.positions = [self.order.index(i) for i in range(len(self.fields))]
+
+      self.binrepr = Struct(self.prefix + ''.join([self.formats[i] for i in self.order]))
       self.size    = self.binrepr.size
     else:
       raise ValueError("Invalid attributes when constructing a schema")
@@ -186,6 +242,18 @@ class DBSchema:
     if self.fields and self.types:
       return list(zip(self.fields, self.types))
 
+  # Returns a list of (offset, size) pairs, one per field in declaration order,
+  # describing where each field is stored within a packed tuple (including
+  # alignment padding).
+  def fieldLayout(self):
+    physical = [self.formats[i] for i in self.order]
+    layout   = [None] * len(self.formats)
+    for (position, i) in enumerate(self.order):
+      fieldSize = calcsize(self.prefix + physical[position])
+      fieldEnd  = calcsize(self.prefix + ''.join(physical[:position+1]))
+      layout[i] = (fieldEnd - fieldSize, fieldSize)
+    return layout
+
   def default(self):
     if self.clazz:
       return self.clazz(*map(Types.defaultValue, self.types))
@@ -198,23 +266,35 @@ class DBSchema:
     if self.binrepr:
       values = [Types.formatValue(instance[i], self.types[i])
                   for i in range(len(instance))]
+      if self.positions:
+        values = [values[i] for i in self.order]
       return self.binrepr.pack(*values)
 
   def unpack(self, buffer):
     if self.clazz and self.binrepr:
+      values = self.binrepr.unpack(buffer)
+      if self.positions:
+        values = [values[p] for p in self.positions]
       values = [Types.formatValue(v, self.types[i], False)
-                  for i, v in enumerate(self.binrepr.unpack(buffer))]
+                  for i, v in enumerate(values)]
       return self.clazz._make(values)
 
+  # Schemas with the default layout omit it from their description,
+  # keeping the format of existing schema descriptions.
   def packSchema(self):
     if self.name and self.fields and self.types:
-      return json.dumps((self.name, self.schema())).encode()
+      desc = (self.name, self.schema())
+      if self.layout != DBSchema.defaultLayout:
+        desc += (self.layout,)
+      return json.dumps(desc).encode()
 
   @classmethod
   def unpackSchema(cls, buffer):
     args = json.loads(buffer.decode())
     if len(args) == 2:
       return cls(args[0], args[1])
+    elif len(args) == 3:
+      return cls(args[0], args[1], layout=args[2])
 
 if __name__ == "__main__":
     import doctest
@@ -1,13 +1,31 @@
-import io, math, struct
+import io, math, mmap, struct, weakref, zlib
 
 from collections import OrderedDict
 from struct      import Struct
 
 from Catalog.Identifiers import PageId, FileId, TupleId
 from Catalog.Schema      import DBSchema
+from Storage.Page        import Page
 
 import Storage.FileManager
 
+class FrameMemory(mmap.mmap):
+  """
+  Memory for buffer pool frames, as an anonymous memory map.
+
+  Memory maps start on a boundary of the system's memory page size, so frames whose
+  size is a multiple of it are aligned as required for direct I/O. As with io.BytesIO,
+  the memory's contents are accessed through getbuffer().
+
+  >>> memory = FrameMemory(-1, 4 * mmap.PAGESIZE)
+  >>> len(memory.getbuffer()) == 4 * mmap.PAGESIZE
+  True
+  """
+
+  def getbuffer(self):
+    return memoryview(self)
+
+
 class BufferPool:
   """
   A buffer pool implementation.
@@ -23,11 +41,87 @@ class BufferPool:
   >>> len(bp.pool.getbuffer()) == bp.poolSize
   True
 
+  # A buffer pool may keep evicted pages compressed in memory, in a second
+  # cache tier with its own byte budget. Misses in the page frames are then
+  # served from the compressed tier before reading from disk.
+  >>> import shutil
+  >>> from Storage.Page import Page
+  >>> fm.close()
+  >>> bp = BufferPool(poolSize=4*bp.pageSize, compressedCacheSize=1 << 20)
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> fm.createRelation(schema.name, schema, pageClass=Page)
+  >>> (fId, f) = fm.relationFile(schema.name)
+  >>> for tup in [schema.pack(schema.instantiate(i, 2*i+20)) for i in range(10000)]:
+  ...    _ = f.insertTuple(tup)
+  ...
+  >>> f.numPages() > bp.numPages()
+  True
+
+  # Scanning a relation larger than the page frames hits in the compressed tier.
+  >>> bp.resetStats()
+  >>> [schema.unpack(tup).id for tup in f.tuples()] == list(range(10000))
+  True
+  >>> stats = bp.stats()
+  >>> stats['compressedHits'] > 0 and stats['diskReads'] == 0
+  True
+  >>> bp.compressedSize() <= bp.compressedCacheSize
+  True
+
+  # Pages are read from disk directly into their frame, and wrap the frame.
+  >>> bp.discardCompressedPage(f.pageId(0)); bp.resetStats()
+  >>> p = bp.getPage(f.pageId(0))
+  >>> bp.stats()['diskReads']
+  1
+  >>> offset = bp.pageDict[p.pageId]
+  >>> bp.pool.getbuffer()[offset + 100] = 255
+  >>> p.getbuffer()[100]
+  255
+
+  # Flushing a page writes only its changed byte ranges and its header, when its tuple
+  # operations report them. Pages with many changes are written whole.
+  >>> bp.clear(); f.pagesWritten = f.bytesWritten = 0
+  >>> tId = TupleId(f.pageId(1), 3)
+  >>> _ = f.updateTuple(tId, schema.pack(schema.instantiate(3, 99)))
+  >>> bp.flushPage(tId.pageId)
+  >>> (f.pagesWritten, f.bytesWritten)
+  (1, 40)
+  >>> for i in range(f.pageClass().headerClass.unpack(bp.pageFromBuffer(tId.pageId)).numTuples()):
+  ...   _ = f.updateTuple(TupleId(tId.pageId, i), schema.pack(schema.instantiate(i, 99)))
+  >>> bp.flushPage(tId.pageId)
+  >>> (f.pagesWritten, f.bytesWritten - 40 == f.pageSize())
+  (2, True)
+
+  # Discarding a page also drops its compressed image. Pages of a truncated file
+  # are therefore not served from the compressed tier once they are allocated again.
+  >>> _ = sum(1 for _ in f.tuples()); bp.compressedSize() > 0
+  True
+  >>> f.truncate(2)
+  >>> for i in range(5):
+  ...   _ = f.insertTuple(schema.pack(schema.instantiate(i, 20)))
+  >>> sum(1 for _ in f.tuples()) == f.numTuples()
+  True
+
+  ## Clean up the doctest
+  >>> fm.close()
+  >>> shutil.rmtree(Storage.FileManager.FileManager.defaultDataDir)
   """
 
   # Default to a 10 MB buffer pool.
   defaultPoolSize = 10 * (1 << 20)
 
+  # The compressed cache tier is disabled by default.
+  defaultCompressedCacheSize = 0
+
+  # Favor compression speed for the compressed cache tier.
+  compressionLevel = 1
+
+  # Flushing writes only a page's changed byte ranges, merging ranges up to 512 bytes
+  # apart, unless the page has more than 8 ranges or a quarter of it has changed.
+  partialWriteGap    = 512
+  maxPartialWrites   = 8
+  maxPartialFraction = 0.25
+
   # Buffer pool constructor.
   #
   # REIMPLEMENT this as desired.
@@ -35,10 +129,18 @@ class BufferPool:
   # Constructors keyword arguments, with defaults if not present:
   # pageSize       : the page size to be used with this buffer pool
   # poolSize       : the size of the buffer pool
+  # compressedCacheSize : the byte budget of the compressed cache tier, or 0 to disable it
   def __init__(self, **kwargs):
     self.pageSize     = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
     self.poolSize     = kwargs.get("poolSize", BufferPool.defaultPoolSize)
-    self.pool         = io.BytesIO(b'\x00' * self.poolSize)
+    self.pool         = FrameMemory(-1, self.poolSize)
+
+    # Compressed images of evicted pages, in LRU order.
+    self.compressedCacheSize = kwargs.get("compressedCacheSize", BufferPool.defaultCompressedCacheSize)
+    self.compressedPages     = OrderedDict()
+    self.compressedBytes     = 0
+
+    self.resetStats()
 
 
     ####################################################################################
@@ -49,10 +151,32 @@ class BufferPool:
 
     self.pageDict = OrderedDict()
 
+    # Pages returned by getPage wrap their frame in the pool, rather than copying it.
+    # We track these pages per frame, so that they can be detached from the frame
+    # before it is reused for another page.
+    self.framePages = {}
+
+    # An optional write-ahead log of page changes, and for each page changed since it
+    # was last flushed, the LSNs of its oldest (i.e., its recovery LSN) and latest
+    # changes, and its image as of the latest change.
+    self.wal         = None
+    self.loggedPages = {}
+
+    # For each page whose frame matched its disk image when read or last flushed, the
+    # byte ranges changed since then, or None if its changes are unknown or too large
+    # for a partial write.
+    self.pageChanges = {}
+
+    # For each file, the pages updated in the pool since they were last flushed.
+    self.dirtyFiles  = {}
+
 
   def setFileManager(self, fileMgr):
     self.fileMgr = fileMgr
 
+  def setWriteAheadLog(self, wal):
+    self.wal = wal
+
   # Basic statistics
 
   def numPages(self):
@@ -74,6 +198,32 @@ class BufferPool:
   def usedSpace(self):
     return self.size() - self.freeSpace()
 
+  # Returns the bytes held by the compressed cache tier.
+  def compressedSize(self):
+    return self.compressedBytes
+
+  def resetStats(self):
+    self.poolHits       = 0
+    self.compressedHits = 0
+    self.diskReads      = 0
+
+  # Returns hit counts and hit rates for each cache tier.
+  # The compressed tier's hit rate is relative to the misses in the page frames.
+  def stats(self):
+    poolMisses = self.compressedHits + self.diskReads
+    requests   = self.poolHits + poolMisses
+    return {
+        'poolHits'          : self.poolHits,
+        'poolMisses'        : poolMisses,
+        'poolHitRate'       : self.poolHits / requests if requests else 0.0,
+        'compressedHits'    : self.compressedHits,
+        'compressedMisses'  : self.diskReads,
+        'compressedHitRate' : self.compressedHits / poolMisses if poolMisses else 0.0,
+        'diskReads'         : self.diskReads,
+        'compressedPages'   : len(self.compressedPages),
+        'compressedBytes'   : self.compressedBytes
+      }
+
   # helper methods
   def pageFromBuffer(self, pageId):
     if not self.hasPage(pageId):
@@ -86,7 +236,9 @@ class BufferPool:
 
     return pageBuffer
 
-  def updateBuffer(self, pageId, pageBuffer):
+  # Copies a page's contents into its frame. Callers may give the byte ranges changed
+  # (e.g., by Page.changedRanges()), so that only these are logged and flushed.
+  def updateBuffer(self, pageId, pageBuffer, changes=None):
     if self.hasPage(pageId):
       offset = self.pageDict[pageId]
       self.pageDict.pop(pageId)
@@ -95,12 +247,78 @@ class BufferPool:
     else:
       self.evictPage()
       offset = self.freeList.pop(0)
-      
+
+    # The new page contents supersede any compressed image.
+    self.discardCompressedPage(pageId)
     self.pageDict[pageId] = offset
 
     view = self.pool.getbuffer()
     view[offset : offset + self.pageSize] = pageBuffer
 
+    self.trackChanges(pageId, changes)
+    self.dirtyFiles.setdefault(pageId.fileId, set()).add(pageId)
+    if self.wal is not None:
+      self.logPage(pageId, view[offset : offset + self.pageSize], changes)
+
+  # Adds byte ranges to a page's changes since it was read or flushed, falling back
+  # to whole page writes once the changes are unknown or too large.
+  def trackChanges(self, pageId, changes):
+    ranges = self.pageChanges.get(pageId, None)
+    if ranges is None or changes is None:
+      self.pageChanges[pageId] = None
+      return
+
+    ranges = Page.mergeRanges(ranges + list(changes), BufferPool.partialWriteGap)
+    if len(ranges) > BufferPool.maxPartialWrites \
+       or sum(end - start for (start, end) in ranges) > BufferPool.maxPartialFraction * self.pageSize:
+      ranges = None
+    self.pageChanges[pageId] = ranges
+
+  # Logs the changes to a page's frame. The first change since the page was last flushed
+  # logs the whole page, and later changes only the ranges of bytes differing from the
+  # page's last logged image, within the given changed ranges if any.
+  def logPage(self, pageId, frame, changes=None):
+    logged = self.loggedPages.get(pageId, None)
+    if logged is None:
+      image = bytearray(frame)
+      lsn   = self.wal.append(pageId, 0, image)
+      self.loggedPages[pageId] = (lsn, lsn, image)
+      return
+
+    (recoveryLSN, lsn, image) = logged
+    for (start, end) in self.wal.changedRanges(image, frame, changes):
+      image[start:end] = frame[start:end]
+      lsn = self.wal.append(pageId, start, image[start:end])
+    self.loggedPages[pageId] = (recoveryLSN, lsn, image)
+
+  # Logs the truncation of a file to the given number of pages, if there is a log. As for
+  # a page write, the record is committed before the file is truncated on disk.
+  def logTruncation(self, fileId, pageCount):
+    if self.wal is not None:
+      self.wal.commit(self.wal.appendTruncation(fileId, pageCount))
+
+  # Returns the dirty page table, mapping each page with logged changes since it was
+  # last flushed to its recovery LSN.
+  def dirtyPages(self):
+    return dict((pageId, logged[0]) for (pageId, logged) in self.loggedPages.items())
+
+  # Returns the recovery LSN of a page, or None if it has no unflushed logged changes.
+  def recoveryLSN(self, pageId):
+    logged = self.loggedPages.get(pageId, None)
+    return logged[0] if logged else None
+
+  # Returns whether the pool holds updates to any of a file's pages that have not been flushed.
+  def hasDirtyPages(self, fileId):
+    return bool(self.dirtyFiles.get(fileId, None))
+
+  # Removes a page from its file's updated pages.
+  def cleanPage(self, pageId):
+    pages = self.dirtyFiles.get(pageId.fileId, None)
+    if pages is not None:
+      pages.discard(pageId)
+      if not pages:
+        del self.dirtyFiles[pageId.fileId]
+
   # Buffer pool operations
 
   def hasPage(self, pageId):
@@ -109,13 +327,14 @@ class BufferPool:
   
   def getPage(self, pageId):
     if self.hasPage(pageId):
+      self.poolHits += 1
       pageBuffer = self.pageFromBuffer(pageId)
-      self.updateBuffer(pageId, pageBuffer)
+      self.pageDict.move_to_end(pageId)
 
-      rFile = self.fileMgr.fileMap.get(pageId.fileId, None)
+      rFile = self.fileMgr.storageFile(pageId.fileId)
       page = rFile.pageClass().unpack(pageId, pageBuffer)
 
-      return page
+      return self.trackPage(self.pageDict[pageId], page)
  
     if len(self.freeList) == 0:
       #evict
@@ -126,34 +345,101 @@ class BufferPool:
     view = self.pool.getbuffer()
     pageBuffer = view[offset : offset + self.pageSize]
 
-    page = self.fileMgr.readPage(pageId, pageBuffer)
-    # self.updateBuffer(pageId, pagebuffer)
-
-    self.pageDict[pageId] = offset 
-    view[offset : offset + self.pageSize] = page.pack()
+    self.pageDict[pageId] = offset
 
-    # self.pageDict[pageId] = offset
-    # view[offset : offset + self.pageSize] = pageBuffer
+    compressedPage = self.compressedPages.pop(pageId, None)
+    if compressedPage is not None:
+      self.compressedHits  += 1
+      self.compressedBytes -= len(compressedPage)
+      view[offset : offset + self.pageSize] = zlib.decompress(compressedPage)
+      self.pageChanges[pageId] = []
 
+      rFile = self.fileMgr.storageFile(pageId.fileId)
+      return self.trackPage(offset, rFile.pageClass().unpack(pageId, pageBuffer))
 
-    return page
-    # raise NotImplementedError
+    # The file reads the page directly into its frame, and the page wraps the frame.
+    # Pages formatted on first read are not yet on disk, and must be written whole.
+    self.diskReads += 1
+    page = self.fileMgr.readPage(pageId, pageBuffer)
+    self.pageChanges[pageId] = [] if page.changes is not None else None
+    return self.trackPage(offset, page)
 
   # Removes a page from the page map, returning it to the free 
   # page list without flushing the page to the disk.
+  # Any compressed image of the page is also dropped, so that discarded pages
+  # (e.g., of truncated or removed files) are not served from the compressed tier.
   def discardPage(self, pageId):
-    offset = self.pageDict.pop(pageId)
-    self.freeList.append(offset)
+    self.discardCompressedPage(pageId)
+    self.loggedPages.pop(pageId, None)
+    self.pageChanges.pop(pageId, None)
+    self.cleanPage(pageId)
+
+    offset = self.pageDict.pop(pageId, None)
+    if offset is not None:
+      self.detachPages(offset)
+      self.freeList.append(offset)
     # raise NotImplementedError
 
+  # Frame tracking operations
+
+  # Records a page wrapping the frame at the given offset, and returns the page.
+  def trackPage(self, offset, page):
+    pages = self.framePages.get(offset, None)
+    if pages is None:
+      pages = self.framePages[offset] = weakref.WeakSet()
+    pages.add(page)
+    return page
+
+  # Gives any live pages wrapping the frame at the given offset a private copy of
+  # their contents, since the frame is about to be reused.
+  def detachPages(self, offset):
+    pages = self.framePages.pop(offset, None)
+    if pages:
+      for page in list(pages):
+        page.detach()
+
+  # Compressed cache tier operations
+
+  # Adds the (clean) image of an evicted page to the compressed tier,
+  # evicting the least recently added images beyond the tier's byte budget.
+  def compressPage(self, pageId, pageBuffer):
+    compressedPage = zlib.compress(pageBuffer, BufferPool.compressionLevel)
+    if len(compressedPage) > self.compressedCacheSize:
+      return
+
+    self.discardCompressedPage(pageId)
+    self.compressedPages[pageId] = compressedPage
+    self.compressedBytes += len(compressedPage)
+
+    while self.compressedBytes > self.compressedCacheSize:
+      (_, evicted) = self.compressedPages.popitem(last=False)
+      self.compressedBytes -= len(evicted)
+
+  def discardCompressedPage(self, pageId):
+    compressedPage = self.compressedPages.pop(pageId, None)
+    if compressedPage is not None:
+      self.compressedBytes -= len(compressedPage)
+
   def flushPage(self, pageId):
 
-    rFile = self.fileMgr.fileMap.get(pageId.fileId, None)
+    rFile = self.fileMgr.storageFile(pageId.fileId)
     pageBuffer = self.pageFromBuffer(pageId)
     page = rFile.pageClass().unpack(pageId, pageBuffer)
 
+    # The page's logged changes must be durable before the page is written.
+    logged = self.loggedPages.pop(pageId, None)
+    if logged is not None:
+      self.wal.commit(logged[1])
+
+    # Pages without known changed ranges (e.g., those changed in place) are written whole.
     if page.header.isDirty():
-      rFile.writePage(page)
+      ranges = self.pageChanges.get(pageId, None)
+      if ranges:
+        rFile.writePageRanges(page, ranges)
+      else:
+        rFile.writePage(page)
+      self.pageChanges[pageId] = []
+    self.cleanPage(pageId)
     # raise NotImplementedError
 
   # Evict using LRU policy. 
@@ -166,13 +452,21 @@ class BufferPool:
     tup = self.pageDict.popitem(last=False)
     pageId = tup[0]  # should be the same as it just was
     offset = tup[1]
+    self.pageChanges.pop(pageId, None)
+
+    # The page is clean after flushing, so its image can be kept in the compressed tier.
+    if self.compressedCacheSize > 0:
+      self.compressPage(pageId, self.pool.getbuffer()[offset : offset + self.pageSize])
+
+    self.detachPages(offset)
     self.freeList.append(offset)
     return offset
     # raise NotImplementedError
 
-  # Flushes all dirty pages
+  # Flushes all dirty pages.
+  # Flushing may open a storage file, whose restore uses the buffer pool.
   def clear(self):
-    for pId in self.pageDict.keys():
+    for pId in list(self.pageDict.keys()):
       self.flushPage(pId)
 
     # raise NotImplementedError
@@ -0,0 +1,189 @@
+import time
+
+class Checkpointer:
+  """
+  Fuzzy checkpoints of a buffer pool's dirty pages, bounding the write-ahead log
+  that recovery must replay.
+
+  A checkpoint does not stop tuple operations while it flushes the pool. It begins by
+  recording the dirty page table: each page with logged changes since it was last
+  flushed, and the LSN of its oldest such change (its recovery LSN). The checkpoint
+  then flushes those pages incrementally, a few pages per step, with tuple operations
+  continuing between steps. Pages flushed (e.g., evicted) in the meantime are skipped.
+  Once all pages in the table are flushed, the storage files are synced, and the
+  recovery start point advances to the oldest recovery LSN of the pages dirty at that
+  time. Log segments holding only earlier records are discarded.
+
+  Checkpoints begin once 'checkpointLogSize' bytes have been logged since the last one
+  began, and each step flushes at most 'checkpointPages' pages. The storage engine takes
+  a step on every commit, so that each commit stalls for at most that many page writes
+  (plus syncing the files when a checkpoint completes), and recovery replays about twice
+  checkpointLogSize bytes of log, plus one log segment, at most.
+
+  >>> import os, shutil
+  >>> from Catalog.Schema import DBSchema
+  >>> from Storage.Page import Page
+  >>> from Storage.StorageEngine import StorageEngine
+  >>> from Storage.FileManager import FileManager
+  >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
+  >>> storage = StorageEngine(wal=True, walSegmentSize=1 << 16, checkpointLogSize=1 << 16, checkpointPages=2)
+  >>> storage.createRelation(schema.name, schema, pageClass=Page)
+  >>> for i in range(5000):
+  ...   _ = storage.insertTuple(schema.name, schema.pack(schema.instantiate(i, 2*i+20)))
+  ...   if i % 10 == 0:
+  ...     storage.commit()
+
+  # Checkpoints completed while tuples were inserted, flushing a few pages per step.
+  # The log holds only the segments following the recovery start point.
+  >>> stats = storage.checkpointer.stats()
+  >>> stats['checkpoints'] > 0 and stats['maxStepPages'] <= 2
+  True
+  >>> storage.wal.segments[0] <= stats['startLSN'] < storage.wal.nextLSN
+  True
+  >>> storage.wal.size() < storage.wal.stats()['bytes']
+  True
+
+  # A checkpoint may also be run to completion, leaving no dirty pages to recover.
+  >>> storage.checkpoint()
+  >>> (storage.bufferPool.dirtyPages(), storage.wal.segments[0] <= storage.checkpointer.startLSN)
+  ({}, True)
+
+  # After a crash, recovery replays only the log since the checkpoint.
+  >>> for i in range(20):
+  ...   _ = storage.insertTuple(schema.name, schema.pack(schema.instantiate(5000 + i, 0)))
+  >>> storage.commit()
+  >>> os.close(storage.wal.fd)
+  >>> storage = StorageEngine(wal=True)
+  >>> (storage.recoveryStats['pages'], storage.recoveryStats['records'] < 100)
+  (1, True)
+  >>> storage.fileMgr.relationFile(schema.name)[1].numTuples()
+  5020
+
+  >>> storage.close()
+  >>> shutil.rmtree(FileManager.defaultDataDir)
+  """
+
+  # Begin a checkpoint after every 64 MB of log.
+  defaultCheckpointLogSize = 64 << 20
+
+  # Flush up to 16 pages per checkpoint step.
+  defaultCheckpointPages = 16
+
+  # Checkpointer constructor.
+  #
+  # Constructor keyword arguments:
+  # bufferPool        : the buffer pool whose pages are checkpointed.
+  # fileMgr           : the file manager whose storage files are synced.
+  # wal               : the write-ahead log of the buffer pool's page changes.
+  # checkpointLogSize : the number of bytes logged after which a checkpoint begins.
+  # checkpointPages   : the maximum number of pages flushed per checkpoint step.
+  # durable           : whether completed checkpoints sync the storage files and the log.
+  #                     Otherwise, checkpoints only write pages, and bound the log's size.
+  def __init__(self, **kwargs):
+    self.bufferPool        = kwargs.get("bufferPool", None)
+    self.fileMgr           = kwargs.get("fileMgr", None)
+    self.wal               = kwargs.get("wal", None)
+    self.checkpointLogSize = kwargs.get("checkpointLogSize", Checkpointer.defaultCheckpointLogSize)
+    self.checkpointPages   = kwargs.get("checkpointPages", Checkpointer.defaultCheckpointPages)
+    self.durable           = kwargs.get("durable", True)
+
+    if self.bufferPool is None or self.fileMgr is None or self.wal is None:
+      raise ValueError("A checkpointer requires a buffer pool, a file manager and a write-ahead log")
+
+    # The dirty pages remaining to flush in the current checkpoint, with their recovery
+    # LSNs, ordered newest first. This is None when no checkpoint is in progress.
+    self.pendingPages = None
+
+    # The log position when the last checkpoint began, and the recovery start point
+    # established by the last completed checkpoint.
+    self.beginBytes = self.wal.bytesLogged
+    self.beginTime  = None
+    self.startLSN   = self.wal.segments[0]
+
+    # Checkpoint statistics.
+    self.checkpoints    = 0
+    self.steps          = 0
+    self.pagesFlushed   = 0
+    self.maxStepPages   = 0
+    self.maxStall       = 0.0
+    self.lastDuration   = 0.0
+
+  def isActive(self):
+    return self.pendingPages is not None
+
+  # Begins a checkpoint by recording the dirty page table, after committing the log
+  # so that flushing the table's pages does not wait for log syncs.
+  def begin(self):
+    self.wal.commit()
+    dirtyPages = self.bufferPool.dirtyPages()
+    self.pendingPages = sorted(dirtyPages.items(), key=lambda entry: entry[1], reverse=True)
+    self.beginBytes   = self.wal.bytesLogged
+    self.beginTime    = time.perf_counter()
+
+  # Takes a checkpoint step, beginning a checkpoint if enough has been logged since the
+  # last one began. A step flushes up to the given number of pages (by default,
+  # 'checkpointPages'), oldest changes first, and completes the checkpoint once no
+  # pages remain.
+  def step(self, maxPages=None):
+    if not self.isActive():
+      if self.wal.bytesLogged - self.beginBytes < self.checkpointLogSize:
+        return
+      self.begin()
+
+    maxPages = self.checkpointPages if maxPages is None else maxPages
+    start    = time.perf_counter()
+    flushed  = 0
+    while self.pendingPages and flushed < maxPages:
+      (pageId, recoveryLSN) = self.pendingPages.pop()
+
+      # Skip pages flushed since the checkpoint began, even if changed again since.
+      if self.bufferPool.recoveryLSN(pageId) == recoveryLSN:
+        self.bufferPool.flushPage(pageId)
+        flushed += 1
+
+    if not self.pendingPages:
+      self.complete()
+
+    self.steps        += 1
+    self.pagesFlushed += flushed
+    self.maxStepPages  = max(self.maxStepPages, flushed)
+    self.maxStall      = max(self.maxStall, time.perf_counter() - start)
+
+  # Completes a checkpoint once its pages are flushed, syncing the storage files and
+  # discarding the log before the new recovery start point. Without dirty pages, no
+  # records are needed for recovery, and the whole log is discarded.
+  def complete(self):
+    if self.durable:
+      self.fileMgr.sync()
+      self.wal.commit(sync=True)
+    dirtyPages = self.bufferPool.dirtyPages()
+    self.startLSN = min(dirtyPages.values()) if dirtyPages else self.wal.nextLSN
+    self.wal.truncate(self.startLSN if dirtyPages else None)
+
+    self.pendingPages  = None
+    self.checkpoints  += 1
+    self.lastDuration  = time.perf_counter() - self.beginTime
+
+  # Runs a checkpoint to completion, completing any checkpoint in progress first.
+  def run(self):
+    if self.isActive():
+      self.step(len(self.pendingPages))
+    self.begin()
+    self.step(len(self.pendingPages))
+
+  def stats(self):
+    return {
+        'checkpoints'  : self.checkpoints,
+        'steps'        : self.steps,
+        'pagesFlushed' : self.pagesFlushed,
+        'maxStepPages' : self.maxStepPages,
+        'maxStall'     : self.maxStall,
+        'lastDuration' : self.lastDuration,
+        'startLSN'     : self.startLSN,
+        'logSize'      : self.wal.size()
+      }
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,346 @@
+import math
+
+from Catalog.Identifiers import TupleId
+from Catalog.Schema      import DBSchema, Types
+from Storage.Page        import PageHeader, Page
+from Storage.File        import StorageFile
+
+class ColumnarFile(StorageFile):
+  """
+  A columnar storage file, storing each field of a relation in its own sequence of pages.
+
+  Tuples are horizontally partitioned into row groups of a fixed number of rows.
+  Within a row group, every column is stored as a run of contiguous pages holding
+  only that column's values, followed by the pages of the next column. The first
+  column of every row group is a hidden validity column of one byte per row,
+  marking whether the row is live or has been deleted.
+
+  Column pages are regular contiguous pages (i.e., the Page class) whose tuple
+  size is the width of the column, so they are cached and flushed by the buffer
+  pool like any other page.
+
+  A tuple identifier for a columnar file refers to the first page of its row
+  group, and to the row's index within the row group. The pages of a row group
+  are allocated lazily as rows are appended to it, so the last row group in a
+  file may be sparse.
+
+  Row-oriented access through tuples() stitches columns back into packed tuples,
+  while columns() reads only the pages of the requested fields.
+
+  >>> import shutil, Storage.BufferPool, Storage.FileManager
+  >>> schema = DBSchema('employee', [('id', 'int'), ('name', 'char(10)'), ('age', 'int')])
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+
+  >>> fm.createRelation(schema.name, schema, fileClass=ColumnarFile)
+  >>> (fId, f) = fm.relationFile(schema.name)
+  >>> isinstance(f, ColumnarFile)
+  True
+
+  # Each row group holds as many rows as fit in a single page of the validity column.
+  >>> f.rowGroupSize == f.pageSize() - PageHeader.size
+  True
+
+  # Populate the relation
+  >>> tIds = [f.insertTuple(schema.pack(schema.instantiate(i, 'e'+str(i), 2*i+20))) for i in range(20)]
+  >>> f.numTuples()
+  20
+
+  # Tuple ids refer to the row group and a row within it.
+  >>> (tIds[5].pageId.pageIndex, tIds[5].tupleIndex)
+  (0, 5)
+
+  >>> e5 = schema.unpack(f.getTuple(tIds[5]))
+  >>> (e5.id, e5.name.rstrip(chr(0)), e5.age)
+  (5, 'e5', 30)
+
+  # Test tuple iterator
+  >>> [schema.unpack(tup).id for tup in f.tuples()] == list(range(20))
+  True
+
+  # Scans may resume from a page index, skipping row groups before it.
+  >>> len(list(f.tuples(start=0))), len(list(f.tuples(start=1))), len(list(f.tupleBatches(start=1)))
+  (20, 0, 0)
+
+  # Test column scan
+  >>> [v for v in f.columns(['age', 'id'])][:3]
+  [(20, 0), (22, 1), (24, 2)]
+
+  # Test updates and deletes
+  >>> f.updateTuple(tIds[0], schema.pack(schema.instantiate(0, 'e0', 99))) == tIds[0]
+  True
+  >>> f.deleteTuple(tIds[1])
+  >>> f.numTuples()
+  19
+  >>> [v[0] for v in f.columns(['age'])][:3]
+  [99, 24, 26]
+
+  # Reopen the file through the file manager checkpoint.
+  >>> fm.close()
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> (fId, f) = fm.relationFile(schema.name)
+  >>> isinstance(f, ColumnarFile) and f.numTuples() == 19
+  True
+  >>> [schema.unpack(tup).id for tup in f.tuples()] == [0] + list(range(2, 20))
+  True
+  >>> [(pId.pageIndex, rows[:3]) for (pId, _, rows) in f.tupleBatches()]
+  [(0, [0, 2, 3])]
+
+  # Truncation removes whole row groups.
+  >>> for i in range(20, f.rowGroupSize + 10):
+  ...   _ = f.insertTuple(schema.pack(schema.instantiate(i, 'e'+str(i), 20)))
+  >>> (f.numRowGroups(), f.numTuples() == f.rowGroupSize + 9)
+  (2, True)
+  >>> numPages = f.numPages()
+  >>> f.truncate(f.rowGroupPages + 1)
+  >>> (f.numPages() == numPages, f.numRowGroups(), f.numTuples() == f.rowGroupSize + 9)
+  (True, 2, True)
+  >>> f.truncate(1)
+  >>> (f.numPages() == f.rowGroupPages, f.numRowGroups(), f.numTuples() == f.rowGroupSize - 1)
+  (True, 1, True)
+  >>> sum(1 for _ in f.tuples()) == f.rowGroupSize - 1
+  True
+
+  ## Clean up the doctest
+  >>> fm.close()
+  >>> shutil.rmtree(Storage.FileManager.FileManager.defaultDataDir)
+  """
+
+  validByte   = b'\x01'
+  invalidByte = b'\x00'
+
+  # Columnar file constructor.
+  #
+  # Takes the same keyword arguments as a StorageFile. Column pages are
+  # always contiguous pages, so any 'pageClass' argument is ignored.
+  def __init__(self, **kwargs):
+    kwargs["pageClass"] = Page
+    super().__init__(**kwargs)
+    if kwargs.get("mode", None) == "create":
+      self.initializeLayout()
+      self.numRows    = 0
+
+  # Computes the row group layout from the file's schema and page size.
+  def initializeLayout(self):
+    schema = self.schema()
+
+    # Physical columns, including the validity column, as single-field schemas.
+    self.columnSchemas = [DBSchema(schema.name + '_valid', [('valid', 'byte')])]
+    self.columnSchemas.extend([DBSchema(schema.name + '_' + f, [(f, t)]) for (f, t) in schema.schema()])
+
+    # Column positions within a packed tuple, for the non-validity columns.
+    self.columnLayout  = schema.fieldLayout()
+
+    pageDataSize       = self.pageSize() - PageHeader.sizeFor(self.pageSize())
+    self.rowsPerPage   = [pageDataSize // s.size for s in self.columnSchemas]
+    self.rowGroupSize  = min(self.rowsPerPage[0], (1 << (8 * TupleId.binrepr.size)) - 1)
+
+    # Page offsets of each column's page run within a row group.
+    self.columnPages   = [math.ceil(self.rowGroupSize / r) for r in self.rowsPerPage]
+    self.columnOffsets = [sum(self.columnPages[:i]) for i in range(len(self.columnPages))]
+    self.rowGroupPages = sum(self.columnPages)
+
+  # Recomputes the row and tuple counts from the validity column of each row group.
+  def restore(self):
+    self.initializeLayout()
+    self.numRows    = 0
+    self.tupleCount = 0
+
+    numGroups = math.ceil(self.numPages() / self.rowGroupPages)
+    for group in range(numGroups):
+      pageBuffer = bytearray(self.pageSize())
+      page       = self.readPage(self.pageId(group * self.rowGroupPages), pageBuffer)
+      validity   = self.columnBytes(page)
+      self.numRows    += len(validity)
+      self.tupleCount += len(validity) - validity.count(ColumnarFile.invalidByte)
+
+  # Layout helpers
+
+  # Returns the page index of the first page of a row group.
+  def rowGroupStart(self, rowGroup):
+    return rowGroup * self.rowGroupPages
+
+  # Returns the page id and in-page index holding a row's value for a physical column.
+  def valueLocation(self, rowGroup, row, columnIndex):
+    pageIndex = self.rowGroupStart(rowGroup) + self.columnOffsets[columnIndex] \
+                  + row // self.rowsPerPage[columnIndex]
+    return (self.pageId(pageIndex), row % self.rowsPerPage[columnIndex])
+
+  # Returns the row group and row of a tuple id.
+  def rowOf(self, tupleId):
+    return (tupleId.pageId.pageIndex // self.rowGroupPages, tupleId.tupleIndex)
+
+  # Returns the number of rows stored in a row group.
+  def rowGroupRows(self, rowGroup):
+    return min(self.rowGroupSize, self.numRows - rowGroup * self.rowGroupSize)
+
+  def numRowGroups(self):
+    return math.ceil(self.numRows / self.rowGroupSize)
+
+  # Returns the first row group starting at or after the given page index.
+  def firstRowGroup(self, start):
+    return math.ceil(start / self.rowGroupPages)
+
+  # Returns the packed values held in a column page.
+  def columnBytes(self, page):
+    start = page.header.size
+    return bytes(page.getbuffer()[start:page.header.freeSpaceOffset])
+
+  # Returns the packed values of a physical column for an entire row group,
+  # reading the column's pages through the buffer pool.
+  def readColumn(self, rowGroup, columnIndex):
+    numPages = math.ceil(self.rowGroupRows(rowGroup) / self.rowsPerPage[columnIndex])
+    start    = self.rowGroupStart(rowGroup) + self.columnOffsets[columnIndex]
+    return b''.join([self.columnBytes(self.bufferPool.getPage(self.pageId(start + i)))
+                       for i in range(numPages)])
+
+  # Writes a formatted, empty column page to the file.
+  def allocateColumnPage(self, pageId, columnIndex):
+    page = self.header.pageClass(pageId=pageId, buffer=bytes(self.pageSize()),
+                                 schema=self.columnSchemas[columnIndex])
+    self.writePage(page)
+
+  # Updates a single value through the buffer pool.
+  def putValue(self, rowGroup, row, columnIndex, valueData):
+    (pId, index) = self.valueLocation(rowGroup, row, columnIndex)
+    page = self.bufferPool.getPage(pId)
+    page.putTuple(TupleId(pId, index), valueData)
+    self.bufferPool.updateBuffer(pId, page.pack())
+
+  # Returns the bytes of each non-validity column for a packed tuple.
+  def splitTuple(self, tupleData):
+    return [tupleData[offset:offset+size] for (offset, size) in self.columnLayout]
+
+
+  # Page operations
+
+  # Returns the page id of the row group currently accepting rows.
+  def availablePage(self):
+    return self.pageId(self.rowGroupStart(self.numRows // self.rowGroupSize))
+
+  # Row groups are allocated implicitly by appending rows.
+  def allocatePage(self):
+    raise ValueError("Columnar files allocate pages by row group when inserting tuples")
+
+  # Removes whole row groups, from the first row group starting at or after the given page index.
+  def truncate(self, pageCount):
+    rowGroup = self.firstRowGroup(pageCount)
+    super().truncate(min(self.numPages(), self.rowGroupStart(rowGroup)))
+    self.numRows = min(self.numRows, rowGroup * self.rowGroupSize)
+
+  # Returns the number of live rows in the row groups from the given page index onwards.
+  def truncatedTuples(self, pageCount):
+    validity = b''.join([self.readColumn(rowGroup, 0)
+                           for rowGroup in range(self.firstRowGroup(pageCount), self.numRowGroups())])
+    return len(validity) - validity.count(ColumnarFile.invalidByte)
+
+
+  # Tuple operations
+
+  # Returns the packed tuple for a tuple id, or None if it has been deleted.
+  def getTuple(self, tupleId):
+    (rowGroup, row) = self.rowOf(tupleId)
+    if row >= self.rowGroupRows(rowGroup):
+      return None
+
+    values = []
+    for columnIndex in range(len(self.columnSchemas)):
+      (pId, index) = self.valueLocation(rowGroup, row, columnIndex)
+      values.append(self.bufferPool.getPage(pId).getTuple(TupleId(pId, index)))
+
+    if values[0] == ColumnarFile.validByte:
+      return self.stitch(values[1:])
+
+  # Appends a tuple to the last row group, allocating column pages as they are reached.
+  def insertTuple(self, tupleData):
+    rowGroup = self.numRows // self.rowGroupSize
+    row      = self.numRows % self.rowGroupSize
+    values   = [ColumnarFile.validByte] + self.splitTuple(tupleData)
+
+    for columnIndex in range(len(self.columnSchemas)):
+      (pId, index) = self.valueLocation(rowGroup, row, columnIndex)
+      if index == 0:
+        self.allocateColumnPage(pId, columnIndex)
+
+      page = self.bufferPool.getPage(pId)
+      page.insertTuple(values[columnIndex])
+      self.bufferPool.updateBuffer(pId, page.pack())
+
+    self.numRows    += 1
+    self.tupleCount += 1
+    return TupleId(self.pageId(self.rowGroupStart(rowGroup)), row)
+
+  # Marks the tuple as deleted in the validity column.
+  def deleteTuple(self, tupleId):
+    if self.getTuple(tupleId) is not None:
+      (rowGroup, row) = self.rowOf(tupleId)
+      self.putValue(rowGroup, row, 0, ColumnarFile.invalidByte)
+      self.tupleCount -= 1
+
+  # Updates each column value of the tuple, returning the tuple's id.
+  def updateTuple(self, tupleId, tupleData):
+    (rowGroup, row) = self.rowOf(tupleId)
+    for (i, valueData) in enumerate(self.splitTuple(tupleData)):
+      self.putValue(rowGroup, row, i+1, valueData)
+    return tupleId
+
+
+  # Iterators
+
+  # Builds a packed tuple from its column values.
+  def stitch(self, values):
+    tupleData = bytearray(self.schema().size)
+    for ((offset, size), valueData) in zip(self.columnLayout, values):
+      tupleData[offset:offset+size] = valueData
+    return bytes(tupleData)
+
+  # Tuple iterator, stitching together all columns of each row group.
+  # As with other storage files, iteration may begin at any page index, starting
+  # with the first row group at or after that page.
+  def tuples(self, start=0):
+    for rowGroup in range(self.firstRowGroup(start), self.numRowGroups()):
+      columns  = [self.readColumn(rowGroup, i) for i in range(len(self.columnSchemas))]
+      validity = columns[0]
+      for row in range(len(validity)):
+        if validity[row:row+1] == ColumnarFile.validByte:
+          yield self.stitch([columns[i+1][row*size:(row+1)*size]
+                               for (i, (_, size)) in enumerate(self.columnLayout)])
+
+  # Batched tuple iterator, yielding the live rows of each row group as a single
+  # byte string, with the id of the row group's first page and the row indexes.
+  def tupleBatches(self, start=0):
+    for rowGroup in range(self.firstRowGroup(start), self.numRowGroups()):
+      columns  = [self.readColumn(rowGroup, i) for i in range(len(self.columnSchemas))]
+      validity = columns[0]
+      rows     = [row for row in range(len(validity)) if validity[row:row+1] == ColumnarFile.validByte]
+      if rows:
+        data = b''.join([self.stitch([columns[i+1][row*size:(row+1)*size]
+                                        for (i, (_, size)) in enumerate(self.columnLayout)])
+                           for row in rows])
+        yield (self.pageId(self.rowGroupStart(rowGroup)), data, rows)
+
+  # Column scan, yielding a tuple of the requested field values for each live tuple.
+  # Only the pages of the requested columns (and the validity column) are read.
+  def columns(self, fields):
+    schema  = self.schema()
+    indexes = [schema.fields.index(f) for f in fields]
+
+    for rowGroup in range(self.numRowGroups()):
+      validity = self.readColumn(rowGroup, 0)
+      values   = []
+      for i in indexes:
+        columnSchema = self.columnSchemas[i+1]
+        values.append([Types.formatValue(v[0], schema.types[i], False)
+                         for v in columnSchema.binrepr.iter_unpack(self.readColumn(rowGroup, i+1))])
+
+      for (row, rowValues) in enumerate(zip(*values)):
+        if validity[row:row+1] == ColumnarFile.validByte:
+          yield rowValues
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
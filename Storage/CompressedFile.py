@@ -0,0 +1,483 @@
+import lzma, os, struct, zlib
+from array import array
+
+from Catalog.Identifiers import PageId
+from Storage.File        import StorageFile
+
+class CompressedStorageFile(StorageFile):
+  """
+  A storage file that keeps each page compressed on disk.
+
+  Compressed storage files are intended for relations that are loaded once and
+  mostly scanned. Pages are compressed individually with a standard library codec
+  (zlib or lzma) and appended after the file header. An offset index maps each page
+  index to the position and length of its compressed image, so pages remain
+  individually addressable. Reading a page decompresses it into the page buffer
+  handed to the buffer pool.
+
+  Page images referenced by the index file are never overwritten: a rewritten page is
+  appended to the end of the page data, unless its current image was written since the
+  index was last written and the new image fits in its place. The space of replaced
+  images is reclaimed by compacting the file whenever its index is written, once the
+  page data is more than twice the size of the live page images.
+
+  On disk, the file contains the file header, as for any storage file, followed by the
+  compressed page images. The offset index is kept in a separate index file (with an
+  '.idx' suffix), holding:
+  i.   arrays of page offsets and lengths.
+  ii.  a trailer with the end of the page data, the page and tuple counts, the codec, and
+       whether the tuple count matches the indexed pages (i.e., whether the buffer pool
+       held no unflushed updates to the file's pages when the index was written).
+
+  The index file is replaced atomically whenever the file is flushed or synced, once the
+  page images it refers to are on disk. Since those images are never overwritten, the
+  index on disk always describes a consistent file, even after a crash. Pages appended
+  since the index was last written are then ignored, and are overwritten by later pages.
+  The tuple count is recomputed from the indexed pages if it does not match them.
+
+  Compaction copies the live page images to a new data file (with a '.compact' suffix),
+  and writes their index alongside it. The new data file is then renamed over the file,
+  followed by the new index file. A compaction interrupted by a crash is completed when
+  the file is reopened if the data file was renamed, and is otherwise discarded.
+
+  >>> import shutil, Storage.BufferPool, Storage.FileManager
+  >>> from Catalog.Schema import DBSchema
+  >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+
+  >>> fm.createRelation(schema.name, schema, fileClass=CompressedStorageFile, codec='lzma')
+  >>> (fId, f) = fm.relationFile(schema.name)
+  >>> f.codec
+  'lzma'
+
+  >>> for tup in [schema.pack(schema.instantiate(i, 2*i+20)) for i in range(2000)]:
+  ...    _ = f.insertTuple(tup)
+  ...
+
+  # Pages are compressed once flushed from the buffer pool.
+  >>> bp.clear()
+  >>> f.flush()
+  >>> f.numPages() > 1
+  True
+  >>> f.size() < f.numPages() * f.pageSize()
+  True
+
+  # Reading a page decompresses it.
+  >>> p = f.readPage(f.pageId(0), bytearray(f.pageSize()))
+  >>> p.header.numTuples() > 0
+  True
+  >>> f.bytesRead < f.pageSize()
+  True
+
+  # Pages rewritten since the index was written are overwritten in place, if they fit.
+  >>> dataEnd = f.dataEnd
+  >>> for i in range(3):
+  ...   f.writePage(f.readPage(f.pageId(0), bytearray(f.pageSize())))
+  >>> f.dataEnd - dataEnd == f.pageLengths[0]
+  True
+
+  # Replaced images are reclaimed by compaction as the index is written.
+  >>> for i in range(10):
+  ...   for pageIndex in range(f.numPages()):
+  ...     f.writePage(f.readPage(f.pageId(pageIndex), bytearray(f.pageSize())))
+  ...   f.flush()
+  >>> (f.dataEnd - f.headerSize() <= 2 * f.compressedSize() + f.pageSize(), f.size() == f.dataEnd)
+  (True, True)
+  >>> [schema.unpack(tup).id for tup in f.tuples()] == list(range(2000))
+  True
+
+  # Reopen the file through the file manager checkpoint.
+  >>> fm.close()
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> (fId, f) = fm.relationFile(schema.name)
+  >>> isinstance(f, CompressedStorageFile) and f.codec == 'lzma'
+  True
+  >>> [schema.unpack(tup).id for tup in f.tuples()] == list(range(2000))
+  True
+
+  # Pages written after the index was last synced are ignored when the file is
+  # reopened after a crash, which leaves the file as of its last sync.
+  >>> f.sync()
+  >>> for tup in [schema.pack(schema.instantiate(i, 20)) for i in range(2000, 3000)]:
+  ...    _ = f.insertTuple(tup)
+  ...
+  >>> bp.clear()
+  >>> g = CompressedStorageFile(bufferPool=bp, fileId=f.fileId, filePath=f.filePath, mode="update")
+  >>> (g.numTuples(), sum(1 for _ in g.directPages()) == g.numPages())
+  (2000, True)
+  >>> g.close()
+
+  # Tuple counts synced while the buffer pool holds unflushed updates to the file's
+  # pages are recomputed from the indexed pages.
+  >>> for tup in [schema.pack(schema.instantiate(i, 20)) for i in range(3000, 3010)]:
+  ...    _ = f.insertTuple(tup)
+  ...
+  >>> f.sync()
+  >>> g = CompressedStorageFile(bufferPool=Storage.BufferPool.BufferPool(), fileId=f.fileId,
+  ...                           filePath=f.filePath, mode="update")
+  >>> (f.numTuples(), g.numTuples())
+  (3010, 3000)
+  >>> g.close()
+
+  # Truncation removes pages from the offset index and from the page data.
+  >>> kept = f.readPageHeader(f.pageId(0)).numTuples()
+  >>> f.truncate(1)
+  >>> (f.numPages(), f.numTuples() == kept, sum(1 for _ in f.tuples()) == kept)
+  (1, True, True)
+  >>> g = CompressedStorageFile(bufferPool=Storage.BufferPool.BufferPool(), fileId=f.fileId,
+  ...                           filePath=f.filePath, mode="update")
+  >>> (g.numPages(), g.numTuples() == kept, g.size() == f.dataEnd)
+  (1, True, True)
+  >>> g.close()
+
+  # A compaction interrupted after its data file replaced the file is completed on reopening.
+  >>> (dataPath, indexPath) = f.compactPaths()
+  >>> _ = shutil.copyfile(f.indexPath(), indexPath)
+  >>> with open(f.indexPath(), 'wb') as index:
+  ...   _ = index.write(b'stale')
+  >>> g = CompressedStorageFile(bufferPool=Storage.BufferPool.BufferPool(), fileId=f.fileId,
+  ...                           filePath=f.filePath, mode="update")
+  >>> (g.numPages(), g.numTuples() == kept, os.path.exists(indexPath))
+  (1, True, False)
+  >>> g.close()
+
+  ## Clean up the doctest
+  >>> fm.close()
+  >>> shutil.rmtree(Storage.FileManager.FileManager.defaultDataDir)
+  """
+
+  defaultCodec = 'zlib'
+
+  # Codecs, with their persistent identifier and (compress, decompress) functions.
+  codecs = {
+      'zlib' : (1, zlib.compress, zlib.decompress),
+      'lzma' : (2, lzma.compress, lzma.decompress)
+    }
+
+  # Index file trailer: end of the page data, number of pages and tuples, codec
+  # identifier, flags and a magic string.
+  trailerrepr = struct.Struct("QQQBB3s")
+  magic       = b'CPF'
+
+  # Trailer flags.
+  cleanFlag   = 0x1
+
+  indexSuffix   = ".idx"
+  compactSuffix = ".compact"
+
+  # Files are compacted once their page data is this many times the size of their live
+  # page images, and holds at least a page's worth of replaced images.
+  compactionRatio = 2
+
+  # Compressed storage file constructor.
+  #
+  # Takes the same keyword arguments as a StorageFile, as well as:
+  # codec : the compression codec, one of the keys of 'codecs'. Only used on file creation.
+  def __init__(self, **kwargs):
+    self.codec       = kwargs.get("codec", CompressedStorageFile.defaultCodec)
+    self.pageOffsets = array('Q')
+    self.pageLengths = array('Q')
+
+    # The space available to each page's current image, and the offsets of the images
+    # referenced by the index file, which must not be overwritten.
+    self.pageSlots      = array('Q')
+    self.indexedOffsets = set()
+
+    # Whether the index has changed since it was last written, and whether it has been
+    # written without being synced since.
+    self.indexChanged  = True
+    self.indexUnsynced = False
+
+    if self.codec not in CompressedStorageFile.codecs:
+      raise ValueError("Unknown compression codec: " + str(self.codec))
+
+    # Compressed pages are variable-length, and cannot be addressed by segment.
+    if kwargs.get("segmentSize", None):
+      raise ValueError("Compressed storage files cannot be segmented")
+
+    self.filePath = kwargs.get("filePath", None)
+    if kwargs.get("mode", None) != "create":
+      self.recoverCompaction()
+
+    super().__init__(**kwargs)
+    if kwargs.get("mode", None) == "create":
+      self.dataEnd = self.header.size
+      self.flush()
+
+  def indexPath(self):
+    return self.filePath + CompressedStorageFile.indexSuffix
+
+  def compactPaths(self):
+    return (self.filePath + CompressedStorageFile.compactSuffix,
+            self.indexPath() + CompressedStorageFile.compactSuffix)
+
+  # Compressed storage files also remove their index file.
+  def filePaths(self):
+    return super().filePaths() + [self.indexPath()]
+
+  # Loads the offset index and counts from the index file.
+  def restore(self):
+    with open(self.indexPath(), 'rb') as f:
+      index = f.read()
+
+    trailerSize = self.trailerrepr.size
+    if len(index) < trailerSize:
+      raise ValueError("Invalid compressed storage file index")
+
+    (dataEnd, numPages, tupleCount, codecId, flags, magic) = self.trailerrepr.unpack(index[-trailerSize:])
+    indexSize = numPages * self.pageOffsets.itemsize
+    if magic != CompressedStorageFile.magic or len(index) != 2 * indexSize + trailerSize:
+      raise ValueError("Invalid compressed storage file index")
+
+    self.codec = [k for (k, v) in CompressedStorageFile.codecs.items() if v[0] == codecId][0]
+    self.pageOffsets.frombytes(index[:indexSize])
+    self.pageLengths.frombytes(index[indexSize:2 * indexSize])
+    self.pageSlots      = array('Q', self.pageLengths)
+    self.indexedOffsets = set(self.pageOffsets)
+    self.dataEnd      = dataEnd
+    self.tupleCount   = tupleCount
+    self.indexChanged = False
+    if flags & CompressedStorageFile.cleanFlag:
+      self.restoreFreePages()
+    else:
+      self.recount()
+
+  # Compressed relations are mostly appended to, so only the last page is considered for inserts.
+  def restoreFreePages(self):
+    if self.numPages() > 0:
+      lastPage = self.readPage(self.pageId(self.numPages() - 1), bytearray(self.pageSize()))
+      if lastPage.header.hasFreeTuple():
+        self.freePages.append(lastPage.pageId)
+
+  # Recounts tuples from the pages in the in-memory index, which may be newer than the index file.
+  def recount(self):
+    self.freePages    = []
+    self.tupleCount   = sum(h.numTuples() for (_, h) in self.headers())
+    self.indexChanged = True
+    self.restoreFreePages()
+    self.writeCounts()
+
+  # Replaces the index file with the current offset index and counts, compacting the
+  # file instead if it holds enough replaced images. The index is written to a temporary
+  # file, and renamed over the index file. If 'sync' is set (by default, if the file is
+  # durable), the page images are synced first, so that the index on disk only refers to
+  # images on disk, the new index is synced before the rename, and the rename is made
+  # durable by syncing the directory.
+  def writeIndex(self, sync=None):
+    sync = self.durable if sync is None else sync
+    if not (self.indexChanged or (sync and self.indexUnsynced)):
+      return
+
+    if self.needsCompaction():
+      self.compact(sync)
+      return
+
+    if sync:
+      self.syncData()
+    tmpPath = self.indexPath() + ".tmp"
+    self.writeIndexFile(tmpPath, sync)
+    os.replace(tmpPath, self.indexPath())
+    self.indexWritten(sync)
+
+  # Writes the offset index and counts to the given path, syncing it if 'sync' is set.
+  def writeIndexFile(self, path, sync):
+    (codecId, _, _) = CompressedStorageFile.codecs[self.codec]
+    flags   = 0 if self.bufferPool.hasDirtyPages(self.fileId) else CompressedStorageFile.cleanFlag
+    trailer = self.trailerrepr.pack(self.dataEnd, len(self.pageOffsets), self.tupleCount, codecId,
+                                    flags, CompressedStorageFile.magic)
+
+    with open(path, 'wb') as f:
+      f.write(self.pageOffsets.tobytes() + self.pageLengths.tobytes() + trailer)
+      f.flush()
+      if sync:
+        os.fsync(f.fileno())
+
+  # Records that the index file holds the current index, once renamed into place.
+  # The images it refers to may no longer be overwritten. With 'sync' set, the rename
+  # is made durable by syncing the directory.
+  def indexWritten(self, sync):
+    self.indexedOffsets = set(self.pageOffsets)
+    self.indexChanged   = False
+    self.indexUnsynced  = not sync
+    if sync:
+      self.syncDirectory()
+      self.syncs += 1
+
+  def syncDirectory(self):
+    dirFd = os.open(os.path.dirname(self.filePath) or ".", os.O_RDONLY)
+    try:
+      os.fsync(dirFd)
+    finally:
+      os.close(dirFd)
+
+  # Compaction
+
+  # Returns whether the page data holds enough replaced images to be compacted.
+  def needsCompaction(self):
+    liveSize = self.compressedSize()
+    dataSize = self.dataEnd - self.headerSize()
+    return dataSize - liveSize >= self.pageSize() \
+             and dataSize > CompressedStorageFile.compactionRatio * liveSize
+
+  # Rewrites the file with only its live page images, in page order, along with its index.
+  # The new data file and index are written (and synced, if 'sync' is set) beside the file,
+  # and renamed over the data file and index file in turn.
+  def compact(self, sync):
+    (dataPath, indexPath) = self.compactPaths()
+    fd      = self.descriptor()
+    offsets = array('Q')
+    with open(dataPath, 'wb') as f:
+      f.write(os.pread(fd, self.headerSize(), 0))
+      for (offset, length) in zip(self.pageOffsets, self.pageLengths):
+        offsets.append(f.tell())
+        f.write(os.pread(fd, length, offset))
+      f.flush()
+      if sync:
+        os.fsync(f.fileno())
+      self.dataEnd = f.tell()
+
+    self.pageOffsets = offsets
+    self.pageSlots   = array('Q', self.pageLengths)
+    self.writeIndexFile(indexPath, sync)
+
+    os.close(self.fd)
+    self.fd = None
+    os.replace(dataPath, self.filePath)
+    if sync:
+      self.syncDirectory()
+    os.replace(indexPath, self.indexPath())
+
+    self.unsynced = not sync
+    self.indexWritten(sync)
+
+  # Completes a compaction interrupted by a crash if its data file replaced the file,
+  # since its index file was then complete, and otherwise discards it.
+  def recoverCompaction(self):
+    (dataPath, indexPath) = self.compactPaths()
+    if os.path.exists(dataPath):
+      os.remove(dataPath)
+      if os.path.exists(indexPath):
+        os.remove(indexPath)
+    elif os.path.exists(indexPath):
+      os.replace(indexPath, self.indexPath())
+
+  def compress(self, data):
+    return CompressedStorageFile.codecs[self.codec][1](data)
+
+  def decompress(self, data):
+    return CompressedStorageFile.codecs[self.codec][2](data)
+
+  # File control
+  def flush(self):
+    self.writeIndex()
+    super().flush()
+
+  # Syncs the page images and the index, even if the file is not durable.
+  def sync(self):
+    self.writeIndex(sync=True)
+    super().sync()
+
+  def numPages(self):
+    return len(self.pageOffsets)
+
+  # Returns the bytes used on disk by compressed page images.
+  def compressedSize(self):
+    return sum(self.pageLengths)
+
+
+  # Page header operations
+
+  def readPageHeader(self, pageId):
+    return self.readPage(pageId, bytearray(self.pageSize())).header
+
+  # Rewrites the page with the given page's header.
+  def writePageHeader(self, page):
+    diskPage = self.readPage(page.pageId, bytearray(self.pageSize()))
+    diskPage.getbuffer()[0:page.header.size] = page.header.pack()
+    self.writePage(self.header.pageClass.unpack(page.pageId, bytearray(diskPage.getbuffer())))
+
+
+  # Page operations
+
+  # Pages beyond the indexed pages (e.g., pages appended after the index was last
+  # written, whose changes are replayed by crash recovery) are read as empty pages.
+  def readPage(self, pageId, pageBuffer):
+    pageIndex = pageId.pageIndex
+    if pageIndex >= self.numPages():
+      view = memoryview(pageBuffer)[:self.pageSize()]
+      view[:] = bytes(len(view))
+      return self.formatPage(pageId, view)
+
+    data = os.pread(self.descriptor(), self.pageLengths[pageIndex], self.pageOffsets[pageIndex])
+    self.pagesRead += 1
+    self.bytesRead += len(data)
+
+    view = memoryview(pageBuffer)[:self.pageSize()]
+    view[:] = self.decompress(data)
+    return self.header.pageClass.unpack(pageId, view)
+
+  # Pages written beyond the end of the file are preceded by empty pages.
+  # A page's image is overwritten in place if the index file does not refer to it,
+  # and the new image fits in its space. Otherwise, the new image is appended.
+  def writePage(self, page):
+    page.header.setDirty(False)
+    pageIndex = page.pageId.pageIndex
+    data      = self.compress(page.pack())
+
+    while pageIndex > self.numPages():
+      self.allocatePage()
+
+    inPlace = pageIndex < self.numPages() and self.pageOffsets[pageIndex] not in self.indexedOffsets \
+                and len(data) <= self.pageSlots[pageIndex]
+    if inPlace:
+      offset = self.pageOffsets[pageIndex]
+    else:
+      offset = self.dataEnd
+      self.dataEnd += len(data)
+
+    os.pwrite(self.descriptor(), data, offset)
+    self.unsynced     = True
+    self.indexChanged = True
+
+    if pageIndex < self.numPages():
+      self.pageOffsets[pageIndex] = offset
+      self.pageLengths[pageIndex] = len(data)
+      if not inPlace:
+        self.pageSlots[pageIndex] = len(data)
+    else:
+      self.pageOffsets.append(offset)
+      self.pageLengths.append(len(data))
+      self.pageSlots.append(len(data))
+
+  # Compressed page images are rewritten whole.
+  def writePageRanges(self, page, ranges):
+    self.writePage(page)
+
+  # Removes the truncated pages from the offset index, and cuts the page data after
+  # the remaining images. The index is written first, so that the index on disk never
+  # refers to removed data.
+  def truncatePages(self, pageCount):
+    del self.pageOffsets[pageCount:]
+    del self.pageLengths[pageCount:]
+    del self.pageSlots[pageCount:]
+    self.dataEnd      = max([o + l for (o, l) in zip(self.pageOffsets, self.pageLengths)], default=self.header.size)
+    self.indexChanged = True
+    self.writeIndex()
+    os.ftruncate(self.descriptor(), self.dataEnd)
+
+  # Adds a new page to the file by appending its compressed image.
+  def allocatePage(self):
+    pId  = PageId(self.fileId, self.numPages())
+    page = self.header.pageClass(pageId=pId, buffer=bytes(self.header.pageSize), schema=self.header.schema)
+    self.writePage(page)
+    self.freePages.append(pId)
+    return pId
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
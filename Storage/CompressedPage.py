@@ -0,0 +1,729 @@
+import struct
+
+from Catalog.Identifiers import TupleId
+from Storage.Page        import PageHeader, Page
+
+class CompressedPageHeader(PageHeader):
+  """
+  A page header for compressed pages, storing a column-wise layout where each
+  column may be encoded independently.
+
+  Each column of the page's tuples is stored in its own region of the page, with
+  one of the following encodings:
+  i.   plain      : one fixed-size value per tuple, as in a PAX page.
+  ii.  dictionary : a per-page dictionary of distinct values, and a one byte code per tuple.
+  iii. run-length : a list of (value, run length) pairs.
+
+  Each column's header entry records its position within a packed tuple, its size,
+  its encoding, its struct type code, the number and capacity of its dictionary
+  entries or runs, and the page offset of its region. The header also tracks the
+  number of tuples in the page and the number of tuples the current layout can hold.
+
+  Pages start with all columns plain-encoded. Encodings are chosen when the page
+  is reorganized (see CompressedPage.reorganize).
+
+  Wide headers, for pages larger than 64 KB, store the page capacity and region
+  offsets as unsigned ints. Run lengths, and thus the number of tuples per page,
+  remain limited to unsigned shorts.
+
+  >>> import io
+  >>> buffer = io.BytesIO(bytes(4096))
+  >>> ph     = CompressedPageHeader(buffer=buffer.getbuffer(), tupleSize=16,
+  ...                               columns=[(0, 4, b'i'), (4, 10, b's')])
+  >>> ph2    = CompressedPageHeader.unpack(buffer.getbuffer())
+  >>> ph == ph2
+  True
+
+  >>> ph.rowCapacity == (4096 - ph.headerSize()) // 14
+  True
+
+  >>> [ph.nextFreeTuple() for i in range(0, 3)]
+  [0, 1, 2]
+
+  >>> ph.numTuples()
+  3
+
+  >>> ph.isExhausted()
+  False
+
+  # Pages larger than 64 KB use a wide header.
+  >>> buffer2 = io.BytesIO(bytes(1 << 17))
+  >>> ph3     = CompressedPageHeader(buffer=buffer2.getbuffer(), tupleSize=1, columns=[(0, 1, b'b')])
+  >>> ph4     = CompressedPageHeader.unpack(buffer2.getbuffer())
+  >>> ph3.isWide() and ph3 == ph4 and ph4.rowCapacity == CompressedPageHeader.maxRows
+  True
+  """
+
+  # Column encodings
+  plainEncoding      = 0
+  dictionaryEncoding = 1
+  runLengthEncoding  = 2
+
+  # Flag bitmask, set when the page could not be reorganized to admit more tuples.
+  exhaustedMask = 0b10
+
+  prefixrepr = struct.Struct("cHHHHH")
+  columnrepr = struct.Struct("HHBcHHH")
+  countrepr  = struct.Struct("H")
+
+  # Wide header representations, for pages larger than 64 KB.
+  wideprefixrepr = struct.Struct("cHHIHH")
+  widecolumnrepr = struct.Struct("HHBcHHI")
+
+  # The maximum number of tuples in a page, as bounded by run lengths.
+  maxRows = (1 << (8 * countrepr.size)) - 1
+
+  def __init__(self, **kwargs):
+    buffer            = kwargs.get("buffer", None)
+    self.flags        = kwargs.get("flags", b'\x00')
+    self.tupleSize    = kwargs.get("tupleSize", None)
+    self.tupleCount   = kwargs.get("tupleCount", 0)
+    columns           = kwargs.get("columns", None)
+
+    if buffer is None:
+      raise ValueError("No backing buffer supplied for CompressedPageHeader")
+
+    if not columns:
+      raise ValueError("No column layout supplied for CompressedPageHeader")
+
+    self.pageCapacity = kwargs.get("pageCapacity", len(buffer))
+    self.setWide(PageHeader.wideCapacity(self.pageCapacity))
+
+    (prefixrepr, columnrepr) = CompressedPageHeader.headerreprs(self.isWide())
+    self.binrepr      = struct.Struct(prefixrepr.format + columnrepr.format * len(columns))
+    self.size         = self.binrepr.size
+
+    # Each column entry is a list: [offset, size, encoding, typeCode, entryCount, entryCapacity, regionStart]
+    # New headers may be given (offset, size, typeCode) triples, which are laid out plain-encoded.
+    self.columns      = [list(c) if len(c) > 3 else [c[0], c[1], CompressedPageHeader.plainEncoding, c[2], 0, 0, 0]
+                           for c in columns]
+    self.rowCapacity  = kwargs.get("rowCapacity", None)
+    if self.rowCapacity is None:
+      self.layoutPlain()
+
+    buffer[0:self.size] = self.pack()
+
+  # Initializes a layout with every column plain-encoded.
+  def layoutPlain(self):
+    self.rowCapacity = (self.pageCapacity - self.size) // sum(map(lambda c: c[1], self.columns))
+    self.rowCapacity = min(self.rowCapacity, CompressedPageHeader.maxRows)
+    start = self.size
+    for c in self.columns:
+      c[2:] = [CompressedPageHeader.plainEncoding, c[3], 0, 0, start]
+      start += c[1] * self.rowCapacity
+
+  def __eq__(self, other):
+    return (    self.flags == other.flags
+            and self.tupleSize == other.tupleSize
+            and self.pageCapacity == other.pageCapacity
+            and self.tupleCount == other.tupleCount
+            and self.rowCapacity == other.rowCapacity
+            and self.columns == other.columns )
+
+  def __hash__(self):
+    return hash((self.flags, self.tupleSize, self.pageCapacity, self.tupleCount,
+                 self.rowCapacity, tuple(map(tuple, self.columns))))
+
+  def headerSize(self):
+    return self.size
+
+  # Returns the header prefix and column entry representations for narrow or wide headers.
+  @classmethod
+  def headerreprs(cls, wide):
+    if wide:
+      return (cls.wideprefixrepr, cls.widecolumnrepr)
+    return (cls.prefixrepr, cls.columnrepr)
+
+  def isExhausted(self):
+    return self.flag(CompressedPageHeader.exhaustedMask)
+
+  def setExhausted(self, exhausted):
+    self.setFlag(CompressedPageHeader.exhaustedMask, exhausted)
+
+  def numTuples(self):
+    return self.tupleCount
+
+  # Returns the space used by the page's column regions.
+  def usedSpace(self):
+    used = 0
+    for (_, size, encoding, _, entryCount, _, _) in self.columns:
+      if encoding == CompressedPageHeader.plainEncoding:
+        used += size * self.tupleCount
+      elif encoding == CompressedPageHeader.dictionaryEncoding:
+        used += size * entryCount + self.tupleCount
+      else:
+        used += (size + CompressedPageHeader.countrepr.size) * entryCount
+    return used
+
+  def freeSpace(self):
+    return self.pageCapacity - (self.size + self.usedSpace())
+
+  # A full page may still admit tuples after reorganization, unless
+  # a previous reorganization attempt failed.
+  def hasFreeTuple(self):
+    return self.tupleCount < self.rowCapacity or not self.isExhausted()
+
+  def nextFreeTuple(self):
+    if self.tupleCount >= self.rowCapacity:
+      return None
+
+    index = self.tupleCount
+    self.tupleCount += 1
+    return index
+
+  def pack(self):
+    columnValues = [v for column in self.columns for v in column]
+    return self.binrepr.pack(
+              self.flags, self.tupleSize, self.tupleCount, self.pageCapacity,
+              self.rowCapacity, len(self.columns), *columnValues)
+
+  @classmethod
+  def unpack(cls, buffer):
+    (prefixrepr, columnrepr) = cls.headerreprs(PageHeader.wideBuffer(buffer))
+    values     = prefixrepr.unpack_from(buffer)
+    numColumns = values[5]
+    columns    = [columnrepr.unpack_from(buffer, prefixrepr.size + i * columnrepr.size)
+                    for i in range(numColumns)]
+
+    if len(values) == 6:
+      return cls(buffer=buffer, flags=values[0], tupleSize=values[1], tupleCount=values[2],
+                 pageCapacity=values[3], rowCapacity=values[4], columns=columns)
+
+
+class CompressedPage(Page):
+  """
+  A compressed page implementation, using lightweight per-column encodings.
+
+  Compressed pages provide the same tuple interface as contiguous pages. Tuples
+  are first stored plain-encoded in a column-wise layout. When the page fills up,
+  it is reorganized: character columns with few distinct values are dictionary-encoded,
+  and sorted columns with long runs of equal values are run-length encoded, after which
+  the page has room for further tuples. Subsequent tuples are appended directly in
+  encoded form as long as their values are already in the column's dictionary or
+  extend the last run (with spare dictionary entries and runs reserved at reorganization).
+
+  Columns are decoded in bulk (see getColumn), and equality predicates can be evaluated
+  directly on dictionary codes and runs without decoding every value (see matchColumn).
+
+  >>> from Catalog.Identifiers import FileId, PageId, TupleId
+  >>> from Catalog.Schema      import DBSchema
+  >>> from Storage.PaxPage     import PaxPage
+
+  # Test harness setup.
+  >>> schema = DBSchema('lineitem', [('orderkey', 'int'), ('shipmode', 'char(10)'), ('qty', 'int')])
+  >>> pId    = PageId(FileId(1), 100)
+  >>> p      = CompressedPage(pageId=pId, buffer=bytes(4096), schema=schema)
+  >>> modes  = ['AIR', 'MAIL', 'SHIP', 'TRUCK']
+  >>> tuples = [schema.pack(schema.instantiate(i // 7, modes[i % 4], i)) for i in range(1000)]
+
+  # Fill the page, and compare against an uncompressed PAX page.
+  >>> tIds = [tId for tId in map(p.insertTuple, tuples) if tId is not None]
+  >>> pax  = PaxPage(pageId=pId, buffer=bytes(4096), schema=schema)
+  >>> paxIds = [tId for tId in map(pax.insertTuple, tuples) if tId is not None]
+  >>> len(tIds) > 2 * len(paxIds)
+  True
+
+  >>> p.encodings() == [CompressedPageHeader.runLengthEncoding,
+  ...                   CompressedPageHeader.dictionaryEncoding,
+  ...                   CompressedPageHeader.plainEncoding]
+  True
+
+  # Tuples are retrieved in their packed form.
+  >>> e = schema.unpack(p.getTuple(tIds[10]))
+  >>> (e.orderkey, e.shipmode.rstrip(chr(0)), e.qty)
+  (1, 'SHIP', 10)
+
+  >>> [schema.unpack(tup).qty for tup in p] == list(range(len(tIds)))
+  True
+
+  # Bulk column decoding and predicates on encoded values.
+  >>> p.getColumn(0)[:8] == [struct.pack('i', k) for k in [0]*7 + [1]]
+  True
+  >>> p.matchColumn(1, b'TRUCK'.ljust(10, b'\\x00'))[:3]
+  [3, 7, 11]
+  >>> p.matchColumn(0, struct.pack('i', 2))
+  [14, 15, 16, 17, 18, 19, 20]
+  >>> p.matchColumn(1, b'RAIL'.ljust(10, b'\\x00'))
+  []
+
+  # Updates with already encoded values are done in place.
+  >>> p.putTuple(tIds[0], schema.pack(schema.instantiate(0, 'MAIL', 5000)))
+  >>> e = schema.unpack(p.getTuple(tIds[0]))
+  >>> (e.orderkey, e.shipmode.rstrip(chr(0)), e.qty)
+  (0, 'MAIL', 5000)
+
+  # Other updates re-encode the page, which may fail on a full page.
+  >>> p.putTuple(tIds[0], schema.pack(schema.instantiate(0, 'RAIL', 5000)))
+  Traceback (most recent call last):
+  ...
+  ValueError: Updated tuple does not fit in compressed page
+
+  >>> q = CompressedPage(pageId=pId, buffer=bytes(4096), schema=schema)
+  >>> qIds = [q.insertTuple(t) for t in tuples[:10]]
+  >>> q.putTuple(qIds[0], schema.pack(schema.instantiate(0, 'RAIL', 5000)))
+  >>> e = schema.unpack(q.getTuple(qIds[0]))
+  >>> (e.orderkey, e.shipmode.rstrip(chr(0)), e.qty)
+  (0, 'RAIL', 5000)
+
+  # Deletion compacts the page.
+  >>> numTuples = p.header.numTuples()
+  >>> p.deleteTuple(tIds[0])
+  >>> p.header.numTuples() == numTuples - 1
+  True
+  >>> [schema.unpack(tup).qty for tup in p][:3]
+  [1, 2, 3]
+
+  # Runs appended out of order cannot be run-length encoded again when the page is
+  # reorganized, so deletions keep the page's current encodings instead.
+  >>> r = CompressedPage(pageId=pId, buffer=bytes(4096), schema=schema)
+  >>> rowCapacity = r.header.rowCapacity
+  >>> rIds = [r.insertTuple(schema.pack(schema.instantiate(i // 50, 'AIR', i))) for i in range(rowCapacity + 1)]
+  >>> rIds += [r.insertTuple(schema.pack(schema.instantiate(k, 'AIR', 0))) for k in [5, 4, 3]]
+  >>> r.encodings()[0] == CompressedPageHeader.runLengthEncoding
+  True
+  >>> rTuples = list(r)
+  >>> r.deleteTuple(rIds[0])
+  >>> list(r) == rTuples[1:]
+  True
+
+  # Pages survive a round trip through their binary representation.
+  >>> p2 = CompressedPage.unpack(pId, bytearray(p.pack()))
+  >>> p2.header == p.header
+  True
+  >>> list(p2) == list(p)
+  True
+
+  # In a storage file, pages that could not be reorganized to admit a tuple keep
+  # their exhausted flag once written, and are not reorganized again when reread.
+  >>> import shutil
+  >>> from Storage.BufferPool  import BufferPool
+  >>> from Storage.FileManager import FileManager
+  >>> bp = BufferPool()
+  >>> fm = FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> fm.createRelation(schema.name, schema, pageClass=CompressedPage)
+  >>> (fId, f) = fm.relationFile(schema.name)
+  >>> for i in range(5000):
+  ...   _ = f.insertTuple(schema.pack(schema.instantiate(i // 7, modes[i % 4], i)))
+  >>> bp.clear(); bp.discardPage(f.pageId(0))
+  >>> f.readPage(f.pageId(0), bytearray(f.pageSize())).header.isExhausted()
+  True
+
+  # Updated tuples that no longer fit in their page are moved to another page.
+  >>> tId     = TupleId(f.pageId(0), 0)
+  >>> updated = schema.pack(schema.instantiate(0, 'RAIL', 5000))
+  >>> newId   = f.updateTuple(tId, updated)
+  >>> newId.pageId != tId.pageId and bp.getPage(newId.pageId).getTuple(newId) == updated
+  True
+  >>> (f.numTuples(), sorted(schema.unpack(t).qty for t in f.tuples())[-2:])
+  (5000, [4999, 5000])
+  >>> fm.close()
+  >>> shutil.rmtree(FileManager.defaultDataDir)
+  """
+
+  __slots__ = ()
+
+  headerClass = CompressedPageHeader
+
+  # Tuple operations may re-encode the page, and are written as whole pages.
+  tracksChanges = False
+
+  # Maximum number of dictionary entries, as codes are stored in a single byte.
+  maxDictionaryEntries = 256
+
+  # Header constructor override for compressed pages.
+  def initializeHeader(self, **kwargs):
+    schema = kwargs.get("schema", None)
+    if schema:
+      columns = [(offset, size, fmt[-1].encode()) for ((offset, size), fmt)
+                   in zip(schema.fieldLayout(), schema.formats)]
+      return CompressedPageHeader(buffer=self.getbuffer(), tupleSize=schema.size, columns=columns)
+    else:
+      raise ValueError("No schema provided when constructing a compressed page.")
+
+  # Iterator, decoding all columns in bulk.
+  def __iter__(self):
+    columns = [self.getColumn(i) for i in range(len(self.header.columns))]
+    return iter([self.stitch(values) for values in zip(*columns)])
+
+  # Returns the decoded tuples as a single byte string, with their tuple indexes.
+  def tupleBatch(self):
+    tuples = list(self)
+    return (b''.join(tuples), range(len(tuples)))
+
+  # Returns the encoding of each column.
+  def encodings(self):
+    return [c[2] for c in self.header.columns]
+
+  # Column region accessors
+
+  # Returns the dictionary entries or runs of a column.
+  def entries(self, columnIndex):
+    (_, size, encoding, _, entryCount, entryCapacity, start) = self.header.columns[columnIndex]
+    view = self.getbuffer()
+    if encoding == CompressedPageHeader.dictionaryEncoding:
+      return [bytes(view[start + i*size : start + (i+1)*size]) for i in range(entryCount)]
+
+    elif encoding == CompressedPageHeader.runLengthEncoding:
+      countStart = start + size * entryCapacity
+      counts = struct.unpack_from(str(entryCount) + 'H', view, countStart)
+      return [(bytes(view[start + i*size : start + (i+1)*size]), counts[i]) for i in range(entryCount)]
+
+  # Returns the page offset of a dictionary-encoded column's codes.
+  def codesStart(self, columnIndex):
+    (_, size, _, _, _, entryCapacity, start) = self.header.columns[columnIndex]
+    return start + size * entryCapacity
+
+  # Decodes all values of a column, returning a list of packed values.
+  def getColumn(self, columnIndex):
+    (_, size, encoding, _, _, _, start) = self.header.columns[columnIndex]
+    numTuples = self.header.numTuples()
+    view      = self.getbuffer()
+
+    if encoding == CompressedPageHeader.plainEncoding:
+      data = bytes(view[start : start + size * numTuples])
+      return [data[i*size:(i+1)*size] for i in range(numTuples)]
+
+    elif encoding == CompressedPageHeader.dictionaryEncoding:
+      dictionary = self.entries(columnIndex)
+      codesStart = self.codesStart(columnIndex)
+      return [dictionary[code] for code in view[codesStart : codesStart + numTuples]]
+
+    else:
+      values = []
+      for (value, count) in self.entries(columnIndex):
+        values.extend([value] * count)
+      return values
+
+  # Returns the indexes of tuples whose column value equals the given packed value.
+  # Dictionary-encoded columns are compared by code, and run-length encoded columns by run.
+  def matchColumn(self, columnIndex, valueData):
+    encoding  = self.header.columns[columnIndex][2]
+    numTuples = self.header.numTuples()
+
+    if encoding == CompressedPageHeader.dictionaryEncoding:
+      dictionary = self.entries(columnIndex)
+      if valueData not in dictionary:
+        return []
+      code       = dictionary.index(valueData)
+      codesStart = self.codesStart(columnIndex)
+      codes      = self.getbuffer()[codesStart : codesStart + numTuples]
+      return [i for (i, c) in enumerate(codes) if c == code]
+
+    elif encoding == CompressedPageHeader.runLengthEncoding:
+      matches = []
+      index   = 0
+      for (value, count) in self.entries(columnIndex):
+        if value == valueData:
+          matches.extend(range(index, index + count))
+        index += count
+      return matches
+
+    else:
+      return [i for (i, v) in enumerate(self.getColumn(columnIndex)) if v == valueData]
+
+  # Returns a single decoded value.
+  def getValue(self, columnIndex, tupleIndex):
+    (_, size, encoding, _, _, _, start) = self.header.columns[columnIndex]
+    view = self.getbuffer()
+
+    if encoding == CompressedPageHeader.plainEncoding:
+      return bytes(view[start + tupleIndex*size : start + (tupleIndex+1)*size])
+
+    elif encoding == CompressedPageHeader.dictionaryEncoding:
+      code = view[self.codesStart(columnIndex) + tupleIndex]
+      return bytes(view[start + code*size : start + (code+1)*size])
+
+    else:
+      index = 0
+      for (value, count) in self.entries(columnIndex):
+        index += count
+        if tupleIndex < index:
+          return value
+
+  # Attempts to store a value for the given tuple index without reorganizing the page.
+  # Returns whether the value could be stored. With 'check' set, only tests whether
+  # the value could be stored, without modifying the page.
+  def putValue(self, columnIndex, tupleIndex, valueData, check=False):
+    column = self.header.columns[columnIndex]
+    (_, size, encoding, _, entryCount, entryCapacity, start) = column
+    view = self.getbuffer()
+
+    if encoding == CompressedPageHeader.plainEncoding:
+      if not check:
+        view[start + tupleIndex*size : start + (tupleIndex+1)*size] = valueData
+      return True
+
+    elif encoding == CompressedPageHeader.dictionaryEncoding:
+      dictionary = self.entries(columnIndex)
+      if valueData in dictionary:
+        code = dictionary.index(valueData)
+      elif entryCount < entryCapacity:
+        code = entryCount
+        if not check:
+          view[start + code*size : start + (code+1)*size] = valueData
+          column[4] += 1
+      else:
+        return False
+
+      if not check:
+        view[self.codesStart(columnIndex) + tupleIndex] = code
+      return True
+
+    else:
+      # Only appends extending or adding a run are supported in place.
+      runs = self.entries(columnIndex)
+      if tupleIndex != self.header.numTuples():
+        return self.getValue(columnIndex, tupleIndex) == valueData
+
+      countStart = start + size * entryCapacity
+      if runs and runs[-1][0] == valueData:
+        if not check:
+          CompressedPageHeader.countrepr.pack_into(view, countStart + 2*(entryCount-1), runs[-1][1] + 1)
+        return True
+      elif entryCount < entryCapacity:
+        if not check:
+          view[start + entryCount*size : start + (entryCount+1)*size] = valueData
+          CompressedPageHeader.countrepr.pack_into(view, countStart + 2*entryCount, 1)
+          column[4] += 1
+        return True
+      else:
+        return False
+
+  # Tuple accessor methods
+
+  # Builds a packed tuple from its column values.
+  def stitch(self, values):
+    tupleData = bytearray(self.header.tupleSize)
+    for (column, valueData) in zip(self.header.columns, values):
+      tupleData[column[0]:column[0] + column[1]] = valueData
+    return bytes(tupleData)
+
+  # Returns the bytes of each column for a packed tuple.
+  def splitTuple(self, tupleData):
+    return [bytes(tupleData[c[0]:c[0] + c[1]]) for c in self.header.columns]
+
+  # Returns a byte string representing a packed tuple for the given tuple id.
+  def getTuple(self, tupleId):
+    tupleIndex = tupleId.tupleIndex
+    if tupleIndex < 0 or tupleIndex >= self.header.numTuples():
+      return None
+
+    return self.stitch([self.getValue(i, tupleIndex) for i in range(len(self.header.columns))])
+
+  # Updates the (packed) tuple at the given tuple id, reorganizing the page if
+  # the new values cannot be encoded in place.
+  def putTuple(self, tupleId, tupleData):
+    tupleIndex = tupleId.tupleIndex
+    values     = self.splitTuple(tupleData)
+    if not all([self.putValue(i, tupleIndex, v, check=True) for (i, v) in enumerate(values)]):
+      columns = [self.getColumn(i) for i in range(len(values))]
+      for (i, v) in enumerate(values):
+        columns[i][tupleIndex] = v
+      if not self.reorganize(columns):
+        raise ValueError("Updated tuple does not fit in compressed page")
+    else:
+      for (i, v) in enumerate(values):
+        self.putValue(i, tupleIndex, v)
+
+    self.setDirty(0b1)
+
+  # Adds a packed tuple to the page. Returns the tuple id of the newly added tuple,
+  # or None if the page cannot hold the tuple even after reorganization.
+  def insertTuple(self, tupleData):
+    values    = self.splitTuple(tupleData)
+    numTuples = self.header.numTuples()
+
+    fits = numTuples < self.header.rowCapacity \
+             and all([self.putValue(i, numTuples, v, check=True) for (i, v) in enumerate(values)])
+
+    if fits:
+      for (i, v) in enumerate(values):
+        self.putValue(i, numTuples, v)
+      self.header.nextFreeTuple()
+
+    elif self.header.isExhausted():
+      return None
+
+    else:
+      columns = [self.getColumn(i) + [v] for (i, v) in enumerate(values)]
+      if not self.reorganize(columns):
+        self.header.setExhausted(True)
+        self.setDirty(0b1)
+        return None
+
+    self.setDirty(0b1)
+    return TupleId(self.pageId, numTuples)
+
+  # Zeroes out the contents of the tuple at the given tuple id.
+  def clearTuple(self, tupleId):
+    self.putTuple(tupleId, bytes(self.header.tupleSize))
+
+  # Returns whether the (packed) tuple at the given tuple id can be updated, either
+  # in place or by reorganizing the page.
+  def canPutTuple(self, tupleId, tupleData):
+    tupleIndex = tupleId.tupleIndex
+    values     = self.splitTuple(tupleData)
+    if all([self.putValue(i, tupleIndex, v, check=True) for (i, v) in enumerate(values)]):
+      return True
+
+    columns = [self.getColumn(i) for i in range(len(values))]
+    for (i, v) in enumerate(values):
+      columns[i][tupleIndex] = v
+    choices = [self.chooseEncoding(c, v, False) for (c, v) in zip(self.header.columns, columns)]
+    return self.layoutCapacity(len(columns[0]), choices) is not None
+
+  # Removes the tuple at the given tuple id, shifting subsequent tuples.
+  # Removing a value never enlarges a column's dictionary or runs, so the page
+  # always fits its current encodings if it cannot be reorganized otherwise
+  # (e.g., with runs appended out of order).
+  def deleteTuple(self, tupleId):
+    tupleIndex = tupleId.tupleIndex
+    if tupleIndex < 0 or tupleIndex >= self.header.numTuples():
+      return
+
+    columns = [self.getColumn(i) for i in range(len(self.header.columns))]
+    for values in columns:
+      del values[tupleIndex]
+
+    if not self.reorganize(columns):
+      self.writeColumns(columns, self.currentEncodings(columns))
+    self.setDirty(0b1)
+
+
+  # Page reorganization
+
+  # Returns the (encoding, entries, entryCapacity) chosen for a column's values.
+  # Dictionary encoding is only considered for character columns, and run-length
+  # encoding only for sorted columns. With 'spare' set, spare dictionary entries
+  # and runs are reserved for future tuples.
+  def chooseEncoding(self, column, values, spare=True):
+    (_, size, _, typeCode, _, _, _) = column
+    numValues = len(values)
+    choices   = [(size * numValues, CompressedPageHeader.plainEncoding, None, 0)]
+
+    if numValues > 0 and typeCode == b's':
+      distinct = list(dict.fromkeys(values))
+      capacity = min(CompressedPage.maxDictionaryEntries, 2 * len(distinct) + 4 if spare else len(distinct))
+      if len(distinct) <= capacity:
+        choices.append((size * capacity + numValues, CompressedPageHeader.dictionaryEncoding, distinct, capacity))
+
+    if numValues > 0:
+      fmt = typeCode.decode() if typeCode != b's' else str(size) + 's'
+      decoded = [struct.unpack(fmt, v)[0] for v in values]
+      if all([decoded[i] <= decoded[i+1] for i in range(numValues - 1)]):
+        runs = []
+        for v in values:
+          if runs and runs[-1][0] == v:
+            runs[-1][1] += 1
+          else:
+            runs.append([v, 1])
+        capacity = 2 * len(runs) + 4 if spare else len(runs)
+        choices.append(((size + CompressedPageHeader.countrepr.size) * capacity,
+                        CompressedPageHeader.runLengthEncoding, runs, capacity))
+
+    return min(choices, key=lambda c: c[0])[1:]
+
+  # Returns the (encoding, entries, entryCapacity) of each column for the given
+  # column values, keeping each column's current encoding and capacity.
+  def currentEncodings(self, columns):
+    choices = []
+    for (column, values) in zip(self.header.columns, columns):
+      (encoding, capacity) = (column[2], column[5])
+      if encoding == CompressedPageHeader.dictionaryEncoding:
+        entries = list(dict.fromkeys(values))
+      elif encoding == CompressedPageHeader.runLengthEncoding:
+        entries = []
+        for v in values:
+          if entries and entries[-1][0] == v:
+            entries[-1][1] += 1
+          else:
+            entries.append([v, 1])
+      else:
+        entries = None
+      choices.append((encoding, entries, capacity))
+    return choices
+
+  # Rewrites the page with encodings chosen for the given column values, preferring
+  # a layout with spare dictionary entries and runs if one fits.
+  # Returns whether the values fit in the page, leaving the page unchanged if not.
+  def reorganize(self, columns):
+    return self.encodeColumns(columns, True) or self.encodeColumns(columns, False)
+
+  def encodeColumns(self, columns, spare):
+    choices = [self.chooseEncoding(c, v, spare) for (c, v) in zip(self.header.columns, columns)]
+    return self.writeColumns(columns, choices)
+
+  # Returns the number of tuples a layout with the given (encoding, entries, entryCapacity)
+  # choices can hold, or None if it cannot hold the given number of tuples.
+  def layoutCapacity(self, numTuples, choices):
+    header    = self.header
+    fixedSize = 0
+    rowSize   = 0
+    for (column, (encoding, _, capacity)) in zip(header.columns, choices):
+      size = column[1]
+      if encoding == CompressedPageHeader.plainEncoding:
+        rowSize   += size
+      elif encoding == CompressedPageHeader.dictionaryEncoding:
+        fixedSize += size * capacity
+        rowSize   += 1
+      else:
+        fixedSize += (size + CompressedPageHeader.countrepr.size) * capacity
+
+    available   = header.pageCapacity - header.size - fixedSize
+    rowCapacity = (available // rowSize) if rowSize > 0 else numTuples
+    rowCapacity = min(rowCapacity, CompressedPageHeader.maxRows)
+    if available < 0 or rowCapacity < numTuples:
+      return None
+    return rowCapacity
+
+  # Rewrites the page with the given encoding choices for the column values.
+  # Returns whether the values fit in the page, leaving the page unchanged if not.
+  def writeColumns(self, columns, choices):
+    header      = self.header
+    numTuples   = len(columns[0])
+    rowCapacity = self.layoutCapacity(numTuples, choices)
+    if rowCapacity is None:
+      return False
+
+    body  = bytearray(header.pageCapacity - header.size)
+    start = header.size
+    for (column, values, (encoding, entries, capacity)) in zip(header.columns, columns, choices):
+      size   = column[1]
+      offset = start - header.size
+      if encoding == CompressedPageHeader.plainEncoding:
+        body[offset : offset + size * numTuples] = b''.join(values)
+        regionSize = size * rowCapacity
+        entryCount = 0
+
+      elif encoding == CompressedPageHeader.dictionaryEncoding:
+        codes = dict([(v, i) for (i, v) in enumerate(entries)])
+        body[offset : offset + size * len(entries)] = b''.join(entries)
+        codesOffset = offset + size * capacity
+        body[codesOffset : codesOffset + numTuples] = bytes([codes[v] for v in values])
+        regionSize = size * capacity + rowCapacity
+        entryCount = len(entries)
+
+      else:
+        body[offset : offset + size * len(entries)] = b''.join([r[0] for r in entries])
+        countsOffset = offset + size * capacity
+        struct.pack_into(str(len(entries)) + 'H', body, countsOffset, *[r[1] for r in entries])
+        regionSize = (size + CompressedPageHeader.countrepr.size) * capacity
+        entryCount = len(entries)
+
+      column[2:] = [encoding, column[3], entryCount, capacity, start]
+      start += regionSize
+
+    header.tupleCount  = numTuples
+    header.rowCapacity = rowCapacity
+    header.setExhausted(False)
+
+    view = self.getbuffer()
+    view[header.size:] = body
+    view[0:header.size] = header.pack()
+    return True
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,186 @@
+import ctypes, io, mmap, os
+
+from Storage.File import StorageFile
+
+class DirectStorageFile(StorageFile):
+  """
+  A storage file that transfers pages with direct I/O (i.e., O_DIRECT), bypassing
+  the operating system's page cache. Pages of a direct storage file are therefore
+  cached once, in the buffer pool, rather than in both the buffer pool and the
+  page cache.
+
+  Direct I/O requires file offsets, transfer lengths and memory addresses to be
+  aligned. Direct storage files:
+  i.   require a page size that is a multiple of the alignment (the memory page size).
+  ii.  store their first page at the first aligned offset after the file header.
+  iii. transfer pages held in aligned memory, such as buffer pool frames, directly,
+       and other transfers through a temporary aligned buffer.
+
+  The file header is read and written through a regular file descriptor. If the
+  file system does not support direct I/O, pages are also transferred through the
+  regular descriptor. Segmented direct storage files keep a direct I/O descriptor
+  per segment.
+
+  >>> import shutil, Storage.BufferPool, Storage.FileManager
+  >>> from Catalog.Schema import DBSchema
+  >>> from Storage.Page   import Page
+  >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
+
+  # Use the smallest page size allowed on this host, and enough tuples for about ten pages.
+  >>> pageSize  = DirectStorageFile.alignment
+  >>> numTuples = 10 * pageSize // schema.size
+  >>> bp = Storage.BufferPool.BufferPool(pageSize=pageSize, poolSize=4*pageSize)
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, pageSize=pageSize)
+  >>> bp.setFileManager(fm)
+
+  >>> fm.createRelation(schema.name, schema, fileClass=DirectStorageFile, pageClass=Page)
+  >>> (fId, f) = fm.relationFile(schema.name)
+  >>> f.headerSize() % DirectStorageFile.alignment
+  0
+
+  # Populate the relation through a buffer pool smaller than the relation.
+  >>> for tup in [schema.pack(schema.instantiate(i, 2*i+20)) for i in range(numTuples)]:
+  ...    _ = f.insertTuple(tup)
+  ...
+  >>> f.numPages() > bp.numPages()
+  True
+  >>> [schema.unpack(tup).id for tup in f.tuples()] == list(range(numTuples))
+  True
+
+  # Reopen the file through the file manager checkpoint.
+  >>> fm.close()
+  >>> bp = Storage.BufferPool.BufferPool(pageSize=pageSize, poolSize=4*pageSize)
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, pageSize=pageSize)
+  >>> bp.setFileManager(fm)
+  >>> (fId, f) = fm.relationFile(schema.name)
+  >>> isinstance(f, DirectStorageFile) and f.numTuples() == numTuples
+  True
+  >>> [schema.unpack(tup).id for tup in f.tuples()][-3:] == list(range(numTuples - 3, numTuples))
+  True
+
+  # Segments are also transferred with direct I/O.
+  >>> fm.createRelation('department', schema, fileClass=DirectStorageFile, pageClass=Page, segmentSize=2*pageSize)
+  >>> (_, d) = fm.relationFile('department')
+  >>> for tup in [schema.pack(schema.instantiate(i, 20)) for i in range(numTuples)]:
+  ...    _ = d.insertTuple(tup)
+  ...
+  >>> d.numSegments() > 1 and sum(1 for _ in d.tuples()) == numTuples
+  True
+
+  # Page sizes must be a multiple of the alignment.
+  >>> try:
+  ...   DirectStorageFile(bufferPool=bp, pageSize=1000, mode="create")
+  ... except ValueError as e:
+  ...   str(e) == "Direct storage files require a page size that is a multiple of " + str(pageSize)
+  True
+
+  ## Clean up the doctest
+  >>> fm.close()
+  >>> shutil.rmtree(Storage.FileManager.FileManager.defaultDataDir)
+  """
+
+  alignment = mmap.PAGESIZE
+
+  # Direct storage file constructor.
+  #
+  # Takes the same keyword arguments as a StorageFile.
+  def __init__(self, **kwargs):
+    pageSize = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
+    if kwargs.get("mode", None) == "create" and pageSize % DirectStorageFile.alignment != 0:
+      raise ValueError("Direct storage files require a page size that is a multiple of "
+                       + str(DirectStorageFile.alignment))
+
+    self.directFds = {}
+    super().__init__(**kwargs)
+
+  # Returns the direct I/O descriptor of a segment, opening it on first use.
+  # Returns None if direct I/O is unavailable.
+  def directDescriptor(self, segment=0):
+    directFd = self.directFds.get(segment, None)
+    if directFd is None and hasattr(os, "O_DIRECT"):
+      self.segmentDescriptor(segment)
+      try:
+        directFd = os.open(self.segmentPath(segment), os.O_RDWR | os.O_DIRECT)
+      except OSError:
+        directFd = -1
+      self.directFds[segment] = directFd
+    return directFd if directFd != -1 else None
+
+  def closeSegment(self, segment):
+    super().closeSegment(segment)
+    directFd = self.directFds.pop(segment, None)
+    if directFd is not None and directFd != -1:
+      os.close(directFd)
+
+  def close(self):
+    super().close()
+    self.closeSegment(0)
+
+  # Pages start at the first aligned offset after the file header.
+  def headerSize(self):
+    return DirectStorageFile.roundUp(self.header.size)
+
+  @classmethod
+  def roundUp(cls, n):
+    return -(-n // cls.alignment) * cls.alignment
+
+  # Returns whether a transfer of the given buffer at the given offset may use direct I/O.
+  @classmethod
+  def isAligned(cls, view, offset):
+    if offset % cls.alignment != 0 or len(view) % cls.alignment != 0 or view.readonly:
+      return False
+    return ctypes.addressof(ctypes.c_char.from_buffer(view)) % cls.alignment == 0
+
+  # Returns an aligned buffer covering the given byte range, and the offset of its start.
+  @classmethod
+  def bounceBuffer(cls, offset, length):
+    start = offset - offset % cls.alignment
+    return (start, memoryview(mmap.mmap(-1, cls.roundUp(offset + length) - start)))
+
+  # Partial page writes (including the page header) are widened to whole aligned blocks,
+  # so that ranges of pages in aligned frames are written directly, rather than read and rewritten.
+  def writePageRanges(self, page, ranges):
+    alignment = DirectStorageFile.alignment
+    blocks    = [(start - start % alignment, min(self.roundUp(end), self.pageSize()))
+                 for (start, end) in page.headerRanges() + list(ranges)]
+    super().writePageRanges(page, blocks)
+
+  # Positional I/O primitives
+
+  def readAt(self, buffer, offset, segment=0):
+    fd = self.directDescriptor(segment)
+    if fd is None:
+      return super().readAt(buffer, offset, segment)
+
+    view = memoryview(buffer).cast('B')
+    if self.isAligned(view, offset):
+      return os.preadv(fd, [view], offset)
+
+    (start, bounce) = self.bounceBuffer(offset, len(view))
+    skip      = offset - start
+    bytesRead = max(0, min(len(view), os.preadv(fd, [bounce], start) - skip))
+    view[:bytesRead] = bounce[skip:skip + bytesRead]
+    return bytesRead
+
+  # Unaligned writes read, update and rewrite the aligned blocks holding the data.
+  def writeAt(self, data, offset, segment=0):
+    fd = self.directDescriptor(segment)
+    if fd is None:
+      return super().writeAt(data, offset, segment)
+
+    self.unsynced = True
+    view = memoryview(data).cast('B')
+    if self.isAligned(view, offset):
+      return os.pwrite(fd, view, offset)
+
+    (start, bounce) = self.bounceBuffer(offset, len(view))
+    skip = offset - start
+    os.preadv(fd, [bounce], start)
+    bounce[skip:skip + len(view)] = view
+    os.pwrite(fd, bounce, start)
+    return len(view)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
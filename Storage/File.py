@@ -5,6 +5,7 @@ from Catalog.Identifiers import PageId, FileId, TupleId
 from Catalog.Schema      import DBSchema
 from Storage.Page        import PageHeader, Page
 from Storage.SlottedPage import SlottedPageHeader, SlottedPage
+from Storage.Formats     import pageFormats
 
 import heapq
 
@@ -15,10 +16,23 @@ class FileHeader:
 
   Our file header object also keeps its own binary representation per instance
   rather than at the class level, since each file may have a variable length schema.
-  The binary representation is a struct, with three components in its format string:
-  i.   header length
-  ii.  page size
-  iii. a JSON-serialized schema (from DBSchema.packSchema)
+
+  The binary representation is versioned. The current format (version 2) is a struct
+  with the following components in its format string:
+  i.    a magic string identifying versioned file headers, and the format version
+  ii.   header length and page size, as unsigned ints
+  iii.  the lengths of the page class and schema fields
+  iv.   the number of pages and tuples in the file, as of its last flush
+  v.    the number of pages per segment file, or 0 for unsegmented files
+  vi.   the page format id of the page class (from Storage.Formats), or 0 if unregistered
+  vii.  a flags byte, whose lowest bit records whether the counts match the file's pages
+  viii. a pickled page class, for unregistered page classes only
+  ix.   a JSON-serialized schema (from DBSchema.packSchema)
+
+  Version 1 headers have no magic string or version, store the header length and page
+  size as unsigned shorts (limiting pages to 64 KB), always store a pickled page class,
+  and have no page and tuple counts, segment size or flags. Files with version 1 headers can
+  still be read, and keep their header format when rewritten.
 
   >>> schema = DBSchema('employee', [('id', 'int'), ('dob', 'char(10)'), ('salary', 'int')])
   >>> fh = FileHeader(pageSize=io.DEFAULT_BUFFER_SIZE, pageClass=SlottedPage, schema=schema)
@@ -30,6 +44,39 @@ class FileHeader:
   >>> fh.schema.schema() == fh2.schema.schema()
   True
 
+  >>> (fh.version, fh2.version)
+  (2, 2)
+
+  # Registered page classes are stored by format id, without pickling.
+  >>> (fh.pageFormat, fh2.pageClass is SlottedPage)
+  (2, True)
+
+  # Page and tuple counts are kept in the header.
+  >>> fh.pageCount = 12; fh.tupleCount = 345
+  >>> fh5 = FileHeader.unpack(fh.pack())
+  >>> (fh5.pageCount, fh5.tupleCount, fh5.size == fh.size)
+  (12, 345, True)
+
+  # Headers record whether their counts are valid, i.e., whether the file was closed cleanly.
+  >>> fh.clean = False
+  >>> (fh5.clean, FileHeader.unpack(fh.pack()).clean)
+  (True, False)
+
+  # Version 2 headers support pages larger than 64 KB.
+  >>> fh3 = FileHeader.unpack(FileHeader(pageSize=1 << 17, pageClass=SlottedPage, schema=schema).pack())
+  >>> fh3.pageSize
+  131072
+
+  # Version 1 headers remain readable, without page and tuple counts or segment sizes.
+  >>> fh4 = FileHeader.unpack(FileHeader(pageSize=4096, pageClass=SlottedPage, schema=schema, version=1).pack())
+  >>> (fh4.version, fh4.pageSize, fh4.pageClass is SlottedPage, fh4.pageCount, fh4.segmentPages, fh4.clean)
+  (1, 4096, True, None, None, None)
+
+  # Segment sizes are kept in the header.
+  >>> fh7 = FileHeader.unpack(FileHeader(pageSize=4096, pageClass=SlottedPage, schema=schema, segmentPages=256).pack())
+  >>> (fh7.segmentPages, fh2.segmentPages)
+  (256, 0)
+
   ## Test the file header's ability to be written to, and read from a Python file object.
   >>> f1 = open('test.header', 'wb')
   >>> fh.toFile(f1)
@@ -41,10 +88,28 @@ class FileHeader:
       and fh.pageClass == fh3.pageClass \
       and fh.schema.schema() == fh3.schema.schema()
   True
+  >>> f2.close()
 
   >>> os.remove('test.header')
   """
 
+  magic          = b'DBFH'
+  currentVersion = 2
+
+  # Fixed-size fields of each header version, preceding the page class and schema.
+  # The positions of the header length, of the page count, of the segment size, of the
+  # page format id and of the flags (for versions that store them) within these fields
+  # are also recorded.
+  prefixFormats  = { 1: "HHHH", 2: "4sHIIHHQQIHB" }
+  lengthFields   = { 1: 0, 2: 2 }
+  countFields    = { 2: 6 }
+  segmentFields  = { 2: 8 }
+  formatFields   = { 2: 9 }
+  flagFields     = { 2: 10 }
+
+  # Header flags.
+  cleanFlag      = 0x1
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None) 
     if other:
@@ -54,51 +119,126 @@ class FileHeader:
       pageSize    = kwargs.get("pageSize", None)
       pageClass   = kwargs.get("pageClass", None)
       schema      = kwargs.get("schema", None)
+      version     = kwargs.get("version", FileHeader.currentVersion)
+      pageCount   = kwargs.get("pageCount", None)
+      tupleCount  = kwargs.get("tupleCount", None)
+      segmentPages = kwargs.get("segmentPages", None)
+      clean       = kwargs.get("clean", True)
+
+      if version not in FileHeader.prefixFormats:
+        raise ValueError("Unsupported file header version: " + str(version))
 
       if pageSize and pageClass and schema:
-        pageClassLen   = len(pickle.dumps(pageClass))
+        self.version    = version
+        self.pageFormat = (pageFormats.formatId(pageClass) or 0) if version in FileHeader.formatFields else None
+        self.pageClass  = pageClass
+        pageClassLen   = len(self.packPageClass())
         schemaDescLen  = len(schema.packSchema())
-        self.binrepr   = Struct("HHHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
+        self.binrepr   = Struct(FileHeader.prefixFormats[version]+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
         self.size      = self.binrepr.size
         self.pageSize  = pageSize
-        self.pageClass = pageClass
         self.schema    = schema
+        self.pageCount  = pageCount
+        self.tupleCount = tupleCount
+        self.segmentPages = (segmentPages or 0) if self.hasSegments() else None
+        self.clean      = clean if version in FileHeader.flagFields else None
 
       else:
         raise ValueError("Invalid file header constructor arguments")
 
   def fromOther(self, other):
+    self.version   = other.version
     self.binrepr   = other.binrepr
     self.size      = other.size
     self.pageSize  = other.pageSize
     self.pageClass = other.pageClass
+    self.pageFormat = other.pageFormat
     self.schema    = other.schema
+    self.pageCount  = other.pageCount
+    self.tupleCount = other.tupleCount
+    self.segmentPages = other.segmentPages
+    self.clean     = other.clean
+
+  # Returns whether this header stores the file's page and tuple counts.
+  def hasCounts(self):
+    return self.version in FileHeader.countFields
+
+  # Returns whether this header stores the file's segment size.
+  def hasSegments(self):
+    return self.version in FileHeader.segmentFields
+
+  # Returns the pickled page class, which is empty for registered page formats.
+  def packPageClass(self):
+    return b'' if self.pageFormat else pickle.dumps(self.pageClass)
 
   def pack(self):
     if self.binrepr and self.pageSize and self.schema:
-      packedPageClass = pickle.dumps(self.pageClass)
+      packedPageClass = self.packPageClass()
       packedSchema    = self.schema.packSchema()
-      return self.binrepr.pack(self.size, self.pageSize, \
-              len(packedPageClass), len(packedSchema), \
-              packedPageClass, packedSchema)
+      values = [self.size, self.pageSize, \
+                len(packedPageClass), len(packedSchema)]
+
+      if self.hasCounts():
+        values += [self.pageCount or 0, self.tupleCount or 0]
+
+      if self.hasSegments():
+        values += [self.segmentPages]
+
+      if self.version in FileHeader.formatFields:
+        values += [self.pageFormat]
+
+      if self.version in FileHeader.flagFields:
+        values += [FileHeader.cleanFlag if self.clean else 0]
+
+      values += [packedPageClass, packedSchema]
+
+      if self.version > 1:
+        values = [FileHeader.magic, self.version] + values
+      return self.binrepr.pack(*values)
+
+  # Returns the header format version of the binary representation held in the buffer.
+  @classmethod
+  def formatVersion(cls, buffer):
+    prefix = Struct("4sH")
+    if len(buffer) >= prefix.size:
+      (magic, version) = prefix.unpack_from(buffer)
+      if magic == cls.magic:
+        if version in cls.prefixFormats:
+          return version
+        raise ValueError("Unsupported file header version: " + str(version))
+    return 1
 
   @classmethod
   def binrepr(cls, buffer):
-    lenStruct = Struct("HHHH")
-    (headerLen, _, pageClassLen, schemaDescLen) = lenStruct.unpack_from(buffer)
-    if headerLen > 0 and pageClassLen > 0 and schemaDescLen > 0:
-      return Struct("HHHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
+    version   = cls.formatVersion(buffer)
+    lenStruct = Struct(cls.prefixFormats[version])
+    start     = cls.lengthFields[version]
+    lengths   = lenStruct.unpack_from(buffer)[start:start+4]
+    (headerLen, _, pageClassLen, schemaDescLen) = lengths
+    hasPageClass = pageClassLen > 0 or version in cls.formatFields
+    if headerLen > 0 and hasPageClass and schemaDescLen > 0:
+      return Struct(cls.prefixFormats[version]+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
     else:
       raise ValueError("Invalid header length read from storage file header")
 
   @classmethod
   def unpack(cls, buffer):
-    brepr  = cls.binrepr(buffer)
-    values = brepr.unpack_from(buffer)
-    if len(values) == 6:
-      pageClass = pickle.loads(values[4])
-      schema    = DBSchema.unpackSchema(values[5])
-      return FileHeader(pageSize=values[1], pageClass=pageClass, schema=schema)
+    version = cls.formatVersion(buffer)
+    brepr   = cls.binrepr(buffer)
+    values  = brepr.unpack_from(buffer)
+    counts  = (None, None)
+    if version in cls.countFields:
+      counts = values[cls.countFields[version]:cls.countFields[version]+2]
+
+    segmentPages = values[cls.segmentFields[version]] if version in cls.segmentFields else None
+
+    pageFormat = values[cls.formatFields[version]] if version in cls.formatFields else None
+    clean      = bool(values[cls.flagFields[version]] & cls.cleanFlag) if version in cls.flagFields else None
+    pageClass  = pageFormats.formatClass(pageFormat) if pageFormat else pickle.loads(values[-2])
+    schema    = DBSchema.unpackSchema(values[-1])
+    return FileHeader(pageSize=values[cls.lengthFields[version]+1], pageClass=pageClass, schema=schema,
+                      version=version, pageCount=counts[0], tupleCount=counts[1],
+                      segmentPages=segmentPages, clean=clean)
 
   def toFile(self, f):
     pos = f.tell()
@@ -111,16 +251,38 @@ class FileHeader:
   def fromFile(cls, f):
     pos = f.tell()
     if pos == 0:
-      lenStruct = Struct("H")
-      headerLen = lenStruct.unpack_from(f.peek(lenStruct.size))[0]
-      if headerLen > 0:
-        buffer = f.read(headerLen)
-        return FileHeader.unpack(buffer)
-      else:
-        raise ValueError("Invalid header length read from storage file header")
+      headerLen = cls.headerLength(f.read(cls.maxPrefixSize()))
+      f.seek(0)
+      return FileHeader.unpack(f.read(headerLen))
     else:
       raise ValueError("Cannot read file header, file positioned beyond its start.")
 
+  # Writes the file header at the start of the file with the given descriptor.
+  def toDescriptor(self, fd):
+    os.pwrite(fd, self.pack(), 0)
+
+  # Reads a file header from the start of the file with the given descriptor.
+  @classmethod
+  def fromDescriptor(cls, fd):
+    headerLen = cls.headerLength(os.pread(fd, cls.maxPrefixSize(), 0))
+    return FileHeader.unpack(os.pread(fd, headerLen, 0))
+
+  # Returns the size of the largest fixed-size prefix of any header version.
+  @classmethod
+  def maxPrefixSize(cls):
+    return max(Struct(fmt).size for fmt in cls.prefixFormats.values())
+
+  # Returns the header length recorded in a buffer holding the start of a header.
+  @classmethod
+  def headerLength(cls, prefix):
+    version   = cls.formatVersion(prefix)
+    lenStruct = Struct(cls.prefixFormats[version])
+    headerLen = lenStruct.unpack_from(prefix)[cls.lengthFields[version]]
+    if headerLen > 0:
+      return headerLen
+    else:
+      raise ValueError("Invalid header length read from storage file header")
+
 
 
 class StorageFile:
@@ -131,13 +293,32 @@ class StorageFile:
   to a file object as metadata.
 
   This implementation supports a readPage() and writePage() method, enabling I/O
-  for specific pages to the backing file. Allocation of new pages is handled by the
-  underlying file system (i.e. simply write the desired page, and the file system 
-  will grow the backing file by the desired amount).
+  for specific pages to the backing file. All I/O is positional (i.e., with pread
+  and pwrite on the file's descriptor), so storage files have no shared file
+  position. Writing a page beyond the end of the file grows the backing file as needed.
 
   Storage files may also serialize their metadata using the pack() and unpack(),
   allowing their metadata to be written to disk when persisting the database catalog.
 
+  The number of pages and tuples in the file are maintained in memory, so that
+  numPages() and numTuples() do not inspect the file. Both counts are saved in the
+  file header whenever the file is flushed. The header also records whether the counts
+  match the pages on disk: it is marked unclean (and synced) before the first page write
+  after the counts are saved, so that a file reopened after a crash recounts its tuples.
+
+  Files grow by extents of several pages at a time, preallocated on disk (with
+  posix_fallocate, where available). The page count saved in the file header is a
+  high-water mark of initialized pages. Pages within an extent are unformatted (i.e.,
+  zeroed) until used, and are formatted when first read.
+
+  Large relations may be split across segment files holding a fixed number of pages
+  each, addressed transparently by page index. The first segment is the file at the
+  storage file's path, and holds the file header. Later segments are stored alongside
+  it, with the segment number appended to the path (e.g., '0.rel.1'), or are placed
+  round-robin across a list of segment directories to stripe the file's pages across
+  disks. Every segment reserves space for the file header, so pages lie at the same
+  offsets in each segment.
+
   >>> import shutil, Storage.BufferPool, Storage.FileManager
   >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
   >>> bp = Storage.BufferPool.BufferPool()
@@ -186,7 +367,7 @@ class StorageFile:
   >>> f.numPages() == 2
   True
 
-  >>> f.size() == (f.headerSize() + f.pageSize() * 2)
+  >>> f.size() == (f.headerSize() + f.pageSize() * f.extentPages)
   True
 
   # Read pages in reverse order testing offset and page index.
@@ -205,6 +386,13 @@ class StorageFile:
   >>> f.pageOffset(pIn.pageId) == f.header.size
   True
 
+  # Reads have no shared file position, so several threads may read pages at once.
+  >>> from concurrent.futures import ThreadPoolExecutor
+  >>> with ThreadPoolExecutor(4) as executor:
+  ...   pages = list(executor.map(lambda i: f.readPage(f.pageId(i % 2), bytearray(f.pageSize())), range(100)))
+  >>> all(p.pageId.pageIndex == i % 2 and p.header.numTuples() == 10 for (i, p) in enumerate(pages))
+  True
+
   # Test page header iterator
   >>> [p[1].usedSpace() for p in f.headers()]
   [80, 80]
@@ -217,15 +405,119 @@ class StorageFile:
   >>> [schema.unpack(tup).id for tup in f.tuples()] == list(range(20))
   True
 
+  # Iterators may start at any page, and scans of the same file may be nested.
+  >>> [p[0].pageIndex for p in f.pages(1)]
+  [1]
+  >>> sum(1 for t1 in f.tuples() for t2 in f.tuples(1))
+  200
+
+  # Test batched tuple iterator
+  >>> [(pId.pageIndex, len(data) // schema.size, len(slots)) for (pId, data, slots) in f.tupleBatches()]
+  [(0, 10, 10), (1, 10, 10)]
+  >>> [v[0] for (_, data, _) in f.tupleBatches() for v in schema.binrepr.iter_unpack(data)] == list(range(20))
+  True
+
+  # Test column scan
+  >>> [v[0] for v in f.columns(['age'])][:3]
+  [20, 22, 24]
+
   # Check buffer pool utilization
   >>> (bp.numPages() - bp.numFreePages()) == 2
   True
 
+  # Tuple counts are maintained as tuples are inserted and deleted.
+  >>> fm.createRelation('department', schema)
+  >>> (_, d) = fm.relationFile('department')
+  >>> tIds = [d.insertTuple(schema.pack(schema.instantiate(i, 20))) for i in range(1000)]
+  >>> d.deleteTuple(tIds[5])
+  >>> d.deleteTuple(tIds[5])
+  >>> (d.numPages(), d.numTuples())
+  (2, 999)
+
+  # Counts persist across a reopen of the file.
+  >>> fm.close()
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> (_, d) = fm.relationFile('department')
+  >>> (d.numPages(), d.numTuples(), d.header.pageCount)
+  (2, 999, 2)
+
+  # Allocated pages are formatted lazily, within the preallocated extent.
+  >>> d.allocatedPages == d.extentPages
+  True
+  >>> d.readPageHeader(d.allocatePage()).numTuples()
+  0
+  >>> d.numPages()
+  3
+
+  # Page headers are read without reading the remainder of the page.
+  >>> d.readPageHeader(d.pageId(1)).numTuples() == 999 - d.readPageHeader(d.pageId(0)).numTuples()
+  True
+  >>> bytesRead = d.bytesRead
+  >>> _ = d.readPageHeader(d.pageId(0))
+  >>> d.bytesRead - bytesRead == d.pageHeaderSize() < d.pageSize()
+  True
+
+  # Writing pages after the counts are saved marks the header as unclean, so that
+  # reopening the file without saving its counts again (e.g., after a crash) recounts them.
+  >>> d.deleteTuple(tIds[7])
+  >>> bp.clear()
+  >>> (d.header.pageCount, d.header.tupleCount, FileHeader.fromDescriptor(d.descriptor()).clean)
+  (2, 999, False)
+  >>> e = StorageFile(bufferPool=bp, fileId=d.fileId, filePath=d.filePath, mode="update")
+  >>> e.numTuples()
+  998
+  >>> e.close()
+
+  # Segmented files hold a fixed number of pages per segment file.
+  >>> fm.createRelation('project', schema, pageClass=Page, segmentSize=2 * f.pageSize(), extentPages=4)
+  >>> (_, s) = fm.relationFile('project')
+  >>> tIds = [s.insertTuple(schema.pack(schema.instantiate(i, 20))) for i in range(5000)]
+  >>> (s.numPages(), s.numSegments(), [os.path.basename(p) for p in s.segmentPaths()])
+  (5, 3, ['2.rel', '2.rel.1', '2.rel.2'])
+  >>> (s.pageSegment(s.pageId(1)), s.pageSegment(s.pageId(2)), s.pageOffset(s.pageId(3)) == s.pageOffset(s.pageId(1)))
+  (0, 1, True)
+
+  # Segments may be read in parallel, e.g., by separate workers.
+  >>> bp.clear()
+  >>> def segmentTuples(segment):
+  ...   return sum(s.readPage(s.pageId(i), bytearray(s.pageSize())).header.numTuples() for i in s.segmentRange(segment))
+  >>> with ThreadPoolExecutor(3) as executor:
+  ...   sum(executor.map(segmentTuples, range(s.numSegments())))
+  5000
+
+  # Segmented files persist their segment size, and are reopened with all segments.
+  >>> fm.close()
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> (_, s) = fm.relationFile('project')
+  >>> (s.header.segmentPages, s.numPages(), s.numTuples(), s.numSegments())
+  (2, 5, 5000, 3)
+  >>> [schema.unpack(tup).id for tup in s.tuples(4)][-1]
+  4999
+
+  # Truncation removes trailing segments.
+  >>> s.truncate(2)
+  >>> (s.numPages(), s.numSegments(), os.path.exists(s.segmentPath(1)))
+  (2, 1, False)
+  >>> s.numTuples() == sum(pageHeader.numTuples() for (_, pageHeader) in s.headers())
+  True
+  >>> s.size() == s.headerSize() + 2 * s.pageSize()
+  True
+
   ## Clean up the doctest
+  >>> fm.close()
   >>> shutil.rmtree(Storage.FileManager.FileManager.defaultDataDir)
   """
 
-  # Change this to the Page class if you want contiguous page storage in the file.
+  # The number of pages preallocated whenever a file grows.
+  defaultExtentPages = 64
+
+  # Change this to the Page class if you want contiguous page storage in the file,
+  # or to the PaxPage class for column-wise (PAX) storage within each page.
+  # Individual relations may also override this via the 'pageClass' argument.
   defaultPageClass = SlottedPage
 
   # StorageFile constructor.
@@ -237,6 +529,17 @@ class StorageFile:
   # fileId       : a PageId instance identifying this page.
   # filePath     : a PageHeader instance.
   # mode         : the file open mode. Can be one of 'create', 'update', 'truncate'.
+  # extentPages  : the number of pages preallocated whenever the file grows.
+  # segmentSize  : the size in bytes of each segment file, or None for an unsegmented file.
+  #                Only used on file creation.
+  # segmentDirs  : the directories holding the file's segments, in round-robin order
+  #                starting with the first segment's directory. Defaults to the directory
+  #                of the file path.
+  # fileCache    : a cache of open files (e.g., a file manager), notified whenever the file
+  #                uses its descriptors, and which may close the file while it is not in use.
+  # durable      : whether writes that keep the file consistent after a crash of the operating
+  #                system (e.g., the header's unclean mark) are synced as they are made. Otherwise,
+  #                the file is only synced by sync().
   # Also, any keyword arguments needed to construct a FileHeader.
   def __init__(self, **kwargs):
     self.bufferPool = kwargs.get("bufferPool", None)
@@ -247,10 +550,16 @@ class StorageFile:
     pageClass      = kwargs.get("pageClass", StorageFile.defaultPageClass)
     schema         = kwargs.get("schema", None)
     mode           = kwargs.get("mode", None)
+    segmentSize    = kwargs.get("segmentSize", None)
 
     self.fileId    = kwargs.get("fileId", None)
     self.filePath  = kwargs.get("filePath", None)
 
+    self.extentPages = kwargs.get("extentPages", StorageFile.defaultExtentPages)
+    self.segmentDirs = kwargs.get("segmentDirs", None)
+    self.fileCache   = kwargs.get("fileCache", None)
+    self.durable     = kwargs.get("durable", True)
+
     # will have to read in files for "update" mode
     # possibly use getother method
 
@@ -261,40 +570,43 @@ class StorageFile:
     # otherwise it should be created from scratch.
     self.freePages = []
 
-    if mode == "create":
-      self.header    = FileHeader(pageSize=pageSize,pageClass=pageClass,schema=schema)
-      self.file = open(self.filePath, "wb+")
-      self.header.toFile(self.file)
-      #self.file.close()
-    else:
-      # self.header = FileHeader(other=)
-      # read from file and pass to other
+    # Page and tuple counts, maintained in memory and saved to the file header on flush.
+    self.pageCount  = 0
+    self.tupleCount = 0
 
-      self.file = open(self.filePath, "rb+")
-      other = FileHeader.fromFile(self.file)
-      self.header = FileHeader(other=other)
+    # The number of pages for which the file has space, including unformatted pages.
+    self.allocatedPages = 0
+
+    # Descriptors of the file's segments beyond the first, opened on first use.
+    self.segmentFds = {}
+
+    # I/O statistics, counting page reads and writes, and the bytes read from and written to disk.
+    self.pagesRead    = 0
+    self.bytesRead    = 0
+    self.pagesWritten = 0
+    self.bytesWritten = 0
 
-      self.file.seek(0)
-      data = bytearray(self.file.read())
+    # Whether the file has been written to since it was last synced to disk, and the
+    # number of syncs issued for its segments.
+    self.unsynced = mode == "create"
+    self.syncs    = 0
 
-      x = self.header.size
-      pageCounter = 0
-      while (x + self.header.pageSize) <= len(data):
-        pagebuffer = data[x :  x + self.header.pageSize]
-        pId = PageId(self.fileId, pageCounter)
-        page = pageClass.unpack(pId, pagebuffer)
-        self.freePages.append(page)
-        pageCounter += 1
-        x += self.header.pageSize
+    if mode == "create":
+      segmentPages = segmentSize // pageSize if segmentSize else 0
+      if segmentSize and segmentPages == 0:
+        raise ValueError("Segment size must hold at least one page")
 
-      # for p in self.pages():
-      #   if p.header.hasFreeTuple():
-      #     self.freePages.append(p)
+      self.header    = FileHeader(pageSize=pageSize,pageClass=pageClass,schema=schema,segmentPages=segmentPages)
+      self.fd = os.open(self.filePath, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+      self.header.toDescriptor(self.descriptor())
+    else:
+      self.fd = os.open(self.filePath, os.O_RDWR)
+      other = FileHeader.fromDescriptor(self.descriptor())
+      self.header = FileHeader(other=other)
 
-      # self.header.toFile(self.file)
-      # self.file.close()
-      # raise NotImplementedError
-      # pass
+      self.allocatedPages = self.existingPages()
+      self.pageCount      = self.initializedPages()
+      self.restore()
 
     ######################################################################################
     # DESIGN QUESTION: what data structure do you use to keep track of the free pages?
@@ -302,14 +614,238 @@ class StorageFile:
     
     # raise NotImplementedError
 
+  # Returns the number of pages for which an existing file's segments have space.
+  def existingPages(self):
+    pageCount = self.segmentCapacity(os.fstat(self.descriptor()).st_size)
+    if self.isSegmented():
+      segment = 1
+      while os.path.exists(self.segmentPath(segment)):
+        segmentPages = self.segmentCapacity(os.path.getsize(self.segmentPath(segment)))
+        pageCount    = segment * self.header.segmentPages + segmentPages
+        segment     += 1
+    return pageCount
+
+  # Returns the number of pages held by a segment file of the given size.
+  def segmentCapacity(self, segmentSize):
+    pageCount = max(0, segmentSize - self.headerSize()) // self.pageSize()
+    return min(pageCount, self.header.segmentPages) if self.isSegmented() else pageCount
+
+  # Returns the number of initialized pages in an existing file.
+  # This is the high-water mark saved in the file header, for headers with counts. Pages
+  # beyond the mark may have been written since the header was saved, so any formatted
+  # pages beyond it are also included.
+  def initializedPages(self):
+    if not self.header.hasCounts():
+      return self.allocatedPages
+
+    pageCount = min(self.header.pageCount, self.allocatedPages)
+    for pageIndex in range(pageCount, self.allocatedPages):
+      pId = self.pageId(pageIndex)
+      headerBuffer = bytearray(self.pageHeaderSize())
+      self.readAt(headerBuffer, self.pageOffset(pId), self.pageSegment(pId))
+      if not self.isUnformatted(headerBuffer):
+        pageCount = pageIndex + 1
+    return pageCount
+
+  # Rebuilds in-memory file state (i.e., the free page list and counts) from the
+  # contents of an existing file. Subclasses with other page layouts override this.
+  #
+  # The tuple count saved in the file header is used if the file was closed cleanly
+  # and the header's page count matches the file's size, and is otherwise recomputed
+  # from the page headers.
+  def restore(self):
+    savedCounts     = self.header.hasCounts() and self.header.clean \
+                        and self.header.pageCount == self.pageCount
+    self.tupleCount = self.header.tupleCount if savedCounts else 0
+
+    for (pId, pageHeader) in self.headers():
+      if pageHeader.hasFreeTuple():
+        self.freePages.append(pId)
+      if not savedCounts:
+        self.tupleCount += pageHeader.numTuples()
+
+  # Rebuilds in-memory file state after pages have been written without going through
+  # the file's tuple operations (e.g., by crash recovery), ignoring the saved counts.
+  def recount(self):
+    self.freePages = []
+    if self.header.hasCounts():
+      self.header.pageCount = None
+    self.restore()
+    self.writeCounts()
+
+  # Writes the file header with the current page and tuple counts.
+  # Files with older header formats have no counts to save.
+  #
+  # The header is marked clean only if the buffer pool holds no unflushed changes to
+  # the file's pages, since the counts then match the pages on disk. The header is not
+  # rewritten if it already holds these counts.
+  def writeCounts(self):
+    if self.header.hasCounts():
+      counts = (self.numPages(), self.numTuples(), not self.bufferPool.hasDirtyPages(self.fileId))
+      if counts != (self.header.pageCount, self.header.tupleCount, self.header.clean):
+        (self.header.pageCount, self.header.tupleCount, self.header.clean) = counts
+        self.header.toDescriptor(self.descriptor())
+        self.unsynced = True
+
+  # Marks the file header as unclean before the first change to the file's pages on
+  # disk since its counts were saved, so that the file is recounted if it is reopened
+  # without its counts being saved again (e.g., after a crash). For durable files, the
+  # mark is synced before any pages change, since the clean header may already be on disk.
+  def markUnclean(self):
+    if self.header.clean:
+      self.header.clean = False
+      self.header.toDescriptor(self.descriptor())
+      if self.durable:
+        getattr(os, "fdatasync", os.fsync)(self.descriptor())
+        self.syncs += 1
+      else:
+        self.unsynced = True
+
   # File control
   def flush(self):
-    self.file.flush()
-    #pass
-
+    self.writeCounts()
+
+  # Forces the file's writes to disk, including its counts. The pages are synced before
+  # the counts are saved and synced, so that the header on disk never counts pages that
+  # are not on disk.
+  def sync(self):
+    self.syncData()
+    self.flush()
+    self.syncData()
+
+  # Syncs each of the file's segments, if written since they were last synced. Segments
+  # are synced with fdatasync where available, which also syncs their size, but not other
+  # metadata such as timestamps.
+  def syncData(self):
+    if self.unsynced:
+      for segment in range(self.numSegments()):
+        getattr(os, "fdatasync", os.fsync)(self.segmentDescriptor(segment))
+        self.syncs += 1
+      self.unsynced = False
+
+  # Closes the file's descriptors, after saving its counts. The file remains usable,
+  # and its descriptors are reopened on next use.
   def close(self):
-    if not self.file.closed:
-      self.file.close()
+    if self.fd is not None:
+      self.flush()
+      for segment in list(self.segmentFds):
+        self.closeSegment(segment)
+      os.close(self.fd)
+      self.fd = None
+
+  # Grows the file by an extent of unformatted pages.
+  # Extents do not span segments, and are cut short at the end of a segment.
+  def extend(self):
+    pId    = self.pageId(self.allocatedPages)
+    pages  = self.extentPages
+    if self.isSegmented():
+      pages = min(pages, self.header.segmentPages - pId.pageIndex % self.header.segmentPages)
+
+    fd     = self.segmentDescriptor(self.pageSegment(pId))
+    offset = self.pageOffset(pId)
+    length = pages * self.pageSize()
+    try:
+      os.posix_fallocate(fd, offset, length)
+    except (AttributeError, OSError):
+      os.ftruncate(fd, offset + length)
+    self.allocatedPages += pages
+    self.unsynced        = True
+
+  # Removes all pages from the given page index onwards (e.g., after the trailing
+  # pages of a relation have been emptied), discarding them from the buffer pool.
+  # Whole segments beyond the remaining pages are removed. The truncation is logged
+  # in any write-ahead log, so that recovery does not restore the removed pages.
+  def truncate(self, pageCount):
+    self.bufferPool.logTruncation(self.fileId, pageCount)
+    self.markUnclean()
+    self.tupleCount -= self.truncatedTuples(pageCount)
+    for pageIndex in range(pageCount, self.numPages()):
+      self.bufferPool.discardPage(self.pageId(pageIndex))
+
+    self.freePages = [pId for pId in self.freePages if pId.pageIndex < pageCount]
+    self.truncatePages(pageCount)
+    self.writeCounts()
+
+  # Returns the number of tuples held in the pages from the given page index onwards.
+  def truncatedTuples(self, pageCount):
+    return sum(pageHeader.numTuples() for (_, pageHeader) in self.headers(pageCount))
+
+  # Removes the pages from the given page index onwards from disk.
+  def truncatePages(self, pageCount):
+    segments = max(1, -(-pageCount // self.header.segmentPages)) if self.isSegmented() else 1
+    for segment in range(segments, self.numSegments()):
+      self.closeSegment(segment)
+      os.remove(self.segmentPath(segment))
+
+    lastPages = pageCount - (segments - 1) * (self.header.segmentPages or 0)
+    os.ftruncate(self.segmentDescriptor(segments - 1), self.headerSize() + lastPages * self.pageSize())
+
+    self.pageCount      = pageCount
+    self.allocatedPages = pageCount
+
+
+  # Segment helpers
+
+  # Returns whether the file is split into segment files.
+  def isSegmented(self):
+    return bool(self.header.segmentPages)
+
+  def numSegments(self):
+    if not self.isSegmented():
+      return 1
+    return max(1, -(-self.allocatedPages // self.header.segmentPages))
+
+  def segmentPath(self, segment):
+    if segment == 0:
+      return self.filePath
+    elif self.segmentDirs:
+      segmentDir = self.segmentDirs[segment % len(self.segmentDirs)]
+      return os.path.join(segmentDir, os.path.basename(self.filePath) + "." + str(segment))
+    return self.filePath + "." + str(segment)
+
+  def segmentPaths(self):
+    return [self.segmentPath(segment) for segment in range(self.numSegments())]
+
+  # Returns the paths of all files holding the storage file's contents.
+  def filePaths(self):
+    return self.segmentPaths()
+
+  # Returns the segment holding the given page id.
+  def pageSegment(self, pageId):
+    return pageId.pageIndex // self.header.segmentPages if self.isSegmented() else 0
+
+  # Returns the page indexes held by a segment.
+  def segmentRange(self, segment):
+    if not self.isSegmented():
+      return range(self.numPages())
+    start = segment * self.header.segmentPages
+    return range(min(start, self.numPages()), min(start + self.header.segmentPages, self.numPages()))
+
+  # Returns the descriptor of the file's first segment, holding the file header.
+  def descriptor(self):
+    return self.segmentDescriptor(0)
+
+  # Returns the descriptor of a segment, opening (and creating) the segment file on first use.
+  # Any file cache is notified of the use, and the file is reopened if it has been closed.
+  def segmentDescriptor(self, segment):
+    if self.fd is None:
+      self.fd = os.open(self.filePath, os.O_RDWR)
+    if self.fileCache is not None:
+      self.fileCache.touch(self)
+
+    if segment == 0:
+      return self.fd
+
+    fd = self.segmentFds.get(segment, None)
+    if fd is None:
+      fd = os.open(self.segmentPath(segment), os.O_RDWR | os.O_CREAT, 0o644)
+      self.segmentFds[segment] = fd
+    return fd
+
+  def closeSegment(self, segment):
+    fd = self.segmentFds.pop(segment, None)
+    if fd is not None:
+      os.close(fd)
 
   # Storage file helpers
   def pageId(self, pageIndex):
@@ -324,163 +860,143 @@ class StorageFile:
   def pageClass(self):
     return self.header.pageClass
 
+  # Returns the total size of the file's segments.
   def size(self):
-    return os.path.getsize(self.filePath)
+    return sum(self.segmentSize(segment) for segment in range(self.numSegments()))
+
+  def segmentSize(self, segment):
+    fd = self.fd if segment == 0 else self.segmentFds.get(segment, None)
+    return os.fstat(fd).st_size if fd is not None else os.path.getsize(self.segmentPath(segment))
 
   def headerSize(self):
     return self.header.size
     # raise NotImplementedError
 
   def numPages(self):
-    #return (os.path.getsize(self.filePath) - self.header.size) // self.pageSize()
-    self.file.seek(0,2) # should seek to the end
-    fileSize = self.file.tell() # returns current position
-    return (fileSize - self.header.size) // self.pageSize()
-    # raise NotImplementedError
-
-  # Returns the offset in the file corresponding to the given page id.
+    return self.pageCount
+
+  # Returns the size of the page headers in this file, which is fixed
+  # by the page class, page size and schema.
+  def pageHeaderSize(self):
+    if not hasattr(self, "pageHeaderBytes"):
+      page = self.header.pageClass(pageId=self.pageId(0), buffer=bytes(self.pageSize()), schema=self.schema())
+      self.pageHeaderBytes = page.header.size
+    return self.pageHeaderBytes
+
+  # Positional I/O primitives for page data, reading into a buffer or writing
+  # a buffer at an offset in a segment. Subclasses may override these to change
+  # how pages are transferred (e.g., with direct I/O).
+  def readAt(self, buffer, offset, segment=0):
+    return os.preadv(self.segmentDescriptor(segment), [buffer], offset)
+
+  def writeAt(self, data, offset, segment=0):
+    self.unsynced = True
+    return os.pwrite(self.segmentDescriptor(segment), data, offset)
+
+  # Returns the offset in the page's segment corresponding to the given page id.
   # Notice this assumes the header is written before the first page,
   # and is not part of the first page itself.
   def pageOffset(self, pageId):
-    return self.headerSize() + self.pageSize() * pageId.pageIndex
+    pageIndex = pageId.pageIndex
+    if self.isSegmented():
+      pageIndex %= self.header.segmentPages
+    return self.headerSize() + self.pageSize() * pageIndex
 
   # Returns whether the given page id is valid for this file.
   def validPageId(self, pageId):
     return pageId.fileId == self.fileId and pageId.pageIndex < self.numPages()
 
 
-  # Page header operations
+  # Unformatted page operations
 
-  # Reads a page header from disk.
-  def readPageHeader(self, pageId):
-    #heapfile = open(self.filePath, "rb")
-    #data = bytearray(heapfile.read())
-    #heapfile.close()
-    #self.file.seek(0)
-    #data = bytearray(self.file.read())
+  # Returns whether the buffer holds an unformatted page, whose header bytes are all zero.
+  def isUnformatted(self, buffer):
+    headerBytes = bytes(memoryview(buffer)[:self.pageHeaderSize()])
+    return headerBytes.count(0) == len(headerBytes)
 
-    fileIndex = self.pageOffset(pageId)
+  # Formats an empty page in the given buffer.
+  def formatPage(self, pageId, buffer):
+    return self.header.pageClass(pageId=pageId, buffer=buffer, schema=self.schema())
 
-    self.file.seek(fileIndex)
-    pagebuffer = bytearray(self.file.read(self.pageSize()))
 
-    #buffer = data[fileIndex:fileIndex + self.pageSize()]
-    # pageHeader = self.header.pageClass.headerClass.unpack(buffer=buffer)
+  # Page header operations
 
+  # Reads a page header from disk, reading only the header's bytes.
+  def readPageHeader(self, pageId):
+    fileIndex = self.pageOffset(pageId)
 
-    pageHeader = (self.header.pageClass.unpack(pageId=pageId, buffer=pagebuffer)).header
-    # tf = open("tuples.txt", "w")
-    # tf.write(str(pageHeader.numTuples()))
-    # tf.close()
+    headerBuffer = bytearray(self.pageHeaderSize())
+    self.bytesRead += self.readAt(headerBuffer, fileIndex, self.pageSegment(pageId))
 
-    return pageHeader
+    if self.isUnformatted(headerBuffer):
+      return self.formatPage(pageId, bytearray(self.pageSize())).header
+    return self.header.pageClass.headerClass.unpack(headerBuffer)
 
   # Writes a page header to disk.
   # The page must already exist, that is we cannot extend the file with only a page header.
   def writePageHeader(self, page):
-    
-    # have to check that page exists
-
-    #heapfile = open(self.filePath, "rb")
-    #data = bytearray(heapfile.read())
-    #heapfile.close()
-
-    #self.file.seek(0)
-    #data = bytearray(self.file.read())
-
-    fileIndex = self.pageOffset(page.pageId)
-
-    # splices from start of page to size of page header (page header bytes
-    #  will always be in front right?) 
-    #data[fileIndex : fileIndex + page.header.size] = page.header.pack()
-
-    #heapfile = open(self.filePath, "wb")
-    #heapfile.write(data)
-    #heapfile.close()
-  
-    self.file.seek(fileIndex)
-    self.file.write(page.header.pack())
-
-    # implemented but not tested
-    # raise NotImplementedError
+    self.markUnclean()
+    self.writeAt(page.header.pack(), self.pageOffset(page.pageId), self.pageSegment(page.pageId))
 
 
   # Page operations
 
+  # Reads a page from disk directly into the given page buffer (e.g., a buffer
+  # pool frame), returning a page that wraps the buffer without copying it.
   def readPage(self, pageId, pageBuffer):
-    #heapfile = open(self.filePath, "rb")
-    #data = bytearray(heapfile.read())
-    #heapfile.close()
-
-    # if self.bufferPool.hasPage(pageId):
-    #   pageBuffer = self.bufferPool.pageFromBuffer(pageId)
-    #   self.bufferPool.updateBuffer(pageId, pageBuffer)
-    #   return self.header.pageClass.unpack(pageId, pageBuffer)
-
-    #self.file.seek(0)
-    #data = bytearray(self.file.read())
+    view = memoryview(pageBuffer)[:self.pageSize()]
+    bytesRead = self.readAt(view, self.pageOffset(pageId), self.pageSegment(pageId))
+    if bytesRead < len(view):
+      view[bytesRead:] = bytes(len(view) - bytesRead)
 
-    fileIndex = self.pageOffset(pageId) 
-    #pageBuffer = data[fileIndex:fileIndex + self.header.pageSize]
-    self.file.seek(fileIndex)
-    pageBuffer = bytearray(self.file.read(self.header.pageSize))
+    self.pagesRead += 1
+    self.bytesRead += bytesRead
 
-    # self.bufferPool.updateBuffer(pageId, pageBuffer)
-
-    return self.header.pageClass.unpack(pageId, pageBuffer)
-    # raise NotImplementedError
+    if self.isUnformatted(view):
+      return self.formatPage(pageId, view)
+    return self.header.pageClass.unpack(pageId, view)
 
   def writePage(self, page):
-    # tf = open("numtuples.txt", "w")
-    # tf.write(str(page.header.numTuples()))
-    # tf.close()
-
-    # if self.bufferPool.hasPage(page.pageId):
-    #   # pageBuffer = self.bufferPool.pageFromBuffer(pageId)
-    #   self.bufferPool.updateBuffer(page.pageId, page.pack())
-    #   return
+    self.markUnclean()
     page.header.setDirty(False)
-    fileIndex = self.pageOffset(page.pageId)
-
-    #heapfile = open(self.filePath, "rb")
-    #data = bytearray(heapfile.read())
-    #heapfile.close()
-    #self.file.seek(0)
-    #data = bytearray(self.file.read())
-    self.file.seek(fileIndex)
-
-    self.file.write(page.pack())
-    #data[fileIndex : fileIndex + self.header.pageSize] = page.pack()
+    self.pageCount      = max(self.pageCount, page.pageId.pageIndex + 1)
+    self.allocatedPages = max(self.allocatedPages, self.pageCount)
+    self.writeAt(page.pack(), self.pageOffset(page.pageId), self.pageSegment(page.pageId))
 
-    #self.file.seek(0)
-    #self.file.write(data)
+    self.pagesWritten += 1
+    self.bytesWritten += self.pageSize()
 
-    # self.bufferPool.updateBuffer(page.pageId, page.pack())
-    # raise NotImplementedError
+  # Writes only the given byte ranges of a page (e.g., its changed tuples), and its header.
+  # The remainder of the page on disk must already match the page.
+  def writePageRanges(self, page, ranges):
+    self.markUnclean()
+    page.header.setDirty(False)
+    view    = page.pack()
+    offset  = self.pageOffset(page.pageId)
+    segment = self.pageSegment(page.pageId)
+    for (start, end) in page.mergeRanges(page.headerRanges() + list(ranges)):
+      self.writeAt(view[start:end], offset + start, segment)
+      self.bytesWritten += end - start
+    self.pagesWritten += 1
 
   # Adds a new page to the file by writing past its end.
+  # Pages are added within the file's preallocated extents, growing the file by
+  # another extent when needed. New pages are formatted lazily, when first read.
   def allocatePage(self):
-    pId = PageId(self.fileId, self.numPages())
-
-    page = self.header.pageClass(pageId=pId, buffer=bytes(self.header.pageSize), schema=self.header.schema)
-
-    #heapfile = open(self.filePath, "ab+")
-    #heapfile.write(page.pack())
-    #heapfile.close()
-    self.file.seek(0, 2) #should seek to the end of the file
-    self.file.write(page.pack())
-    self.freePages.append(page)
+    pId = self.pageId(self.pageCount)
+    if self.pageCount >= self.allocatedPages:
+      self.extend()
 
+    self.pageCount += 1
+    self.freePages.append(pId)
     return pId
 
-    # raise NotImplementedError
-
   # Returns the page id of the first page with available space.
   def availablePage(self):
     if len(self.freePages) == 0:
       pId = self.allocatePage()
     else:
-      pId = self.freePages[0].pageId
+      pId = self.freePages[0]
     return pId
     # raise NotImplementedError
 
@@ -488,10 +1004,7 @@ class StorageFile:
   # Tuple operations
 
   def numTuples(self):
-    count = 0
-    for h in self.headers():
-      count += h[1].numTuples()
-    return count
+    return self.tupleCount
 
   # Inserts the given tuple to the first available page.
   def insertTuple(self, tupleData):
@@ -507,14 +1020,27 @@ class StorageFile:
 
     pId = self.availablePage()
     page = self.bufferPool.getPage(pId)
-
-    tId = TupleId(pId, page.header.numTuples())
-    page.insertTuple(tupleData)
+    tId = page.insertTuple(tupleData)
+
+    # Pages may reject a tuple even when reporting free space (e.g., compressed
+    # pages that cannot encode the tuple's values), so move on to another page.
+    # The rejecting page may have recorded that it is full in its header, which
+    # is kept so that later inserts need not try the page again once it is reread.
+    while tId is None:
+      if page.header.numTuples() == 0:
+        raise ValueError("Tuple could not be inserted into an empty page")
+      if page.header.isDirty():
+        self.bufferPool.updateBuffer(pId, page.pack(), page.changedRanges())
+      del self.freePages[0]
+      pId = self.availablePage()
+      page = self.bufferPool.getPage(pId)
+      tId = page.insertTuple(tupleData)
 
     if page.header.hasFreeTuple() == False:
       del self.freePages[0]
     # raise NotImplementedError
-    self.bufferPool.updateBuffer(pId, page.pack())
+    self.bufferPool.updateBuffer(pId, page.pack(), page.changedRanges())
+    self.tupleCount += 1
     return tId
 
   # Removes the tuple by its id, tracking if the page is now free
@@ -523,121 +1049,78 @@ class StorageFile:
     page = self.bufferPool.getPage(pId)
 
     if page.header.hasFreeTuple() == False:
-      self.freePages.append(page)
+      self.freePages.append(pId)
 
+    numTuples = page.header.numTuples()
     page.deleteTuple(tupleId)
-    self.bufferPool.updateBuffer(pId, page.pack())
+    self.tupleCount -= numTuples - page.header.numTuples()
+    self.bufferPool.updateBuffer(pId, page.pack(), page.changedRanges())
     # raise NotImplementedError
 
-  # Updates the tuple by id
+  # Updates the tuple by id, returning the tuple's id. Tuples that no longer fit
+  # in their page are deleted and inserted again, and get a new id.
   def updateTuple(self, tupleId, tupleData):
     pId = tupleId.pageId
     page = self.bufferPool.getPage(pId)
+    if not page.canPutTuple(tupleId, tupleData):
+      self.deleteTuple(tupleId)
+      return self.insertTuple(tupleData)
+
     page.putTuple(tupleId, tupleData)
-    self.bufferPool.updateBuffer(pId, page.pack())
+    self.bufferPool.updateBuffer(pId, page.pack(), page.changedRanges())
+    return tupleId
     # raise NotImplementedError
 
 
   # Iterators
+  #
+  # Iterators are generators over the pages present when iteration starts,
+  # and may begin at any page index. Each keeps its own state, so several
+  # scans of the same file may run at once.
+
   # Page header iterator
-  def headers(self):
-    return self.FileHeaderIterator(self)
-  
+  def headers(self, start=0):
+    for pageIndex in range(start, self.numPages()):
+      pId = self.pageId(pageIndex)
+      if self.bufferPool.hasPage(pId):
+        yield (pId, self.bufferPool.getPage(pId).header)
+      else:
+        yield (pId, self.readPageHeader(pId))
+
   # Page iterator, using the buffer pool
-  def pages(self):
-    return self.FilePageIterator(self)
+  def pages(self, start=0):
+    for pageIndex in range(start, self.numPages()):
+      pId = self.pageId(pageIndex)
+      yield (pId, self.bufferPool.getPage(pId))
 
   # Unbuffered page iterator.
   # Use with care, direct pages are not authoritative if the page is present in the buffer pool.
-  def directPages(self):
-    return self.FileDirectPageIterator(self)
+  def directPages(self, start=0):
+    for pageIndex in range(start, self.numPages()):
+      pId = self.pageId(pageIndex)
+      yield (pId, self.readPage(pId, bytearray(self.pageSize())))
 
   # Tuple iterator
-  def tuples(self):
-    return self.FileTupleIterator(self)
-
-
-  # Iterator class implementations
-  class FileHeaderIterator:
-    def __init__(self, storageFile):
-      self.currentPageIdx = 0
-      self.storageFile    = storageFile
-
-    def __iter__(self):
-      return self
-
-    def __next__(self):
-      pId = self.storageFile.pageId(self.currentPageIdx)
-      if self.storageFile.validPageId(pId):
-        self.currentPageIdx += 1
-        if self.storageFile.bufferPool.hasPage(pId):
-          return (pId, self.storageFile.bufferPool.getPage(pId).header)
-        else:
-          return (pId, self.storageFile.readPageHeader(pId))
-      else:
-        raise StopIteration
-
-  class FilePageIterator:
-    def __init__(self, storageFile):
-      self.currentPageIdx = 0
-      self.storageFile    = storageFile
-
-    def __iter__(self):
-      return self
-
-    def __next__(self):
-      pId = self.storageFile.pageId(self.currentPageIdx)
-      if self.storageFile.validPageId(pId):
-        self.currentPageIdx += 1
-        return (pId, self.storageFile.bufferPool.getPage(pId))
-      else:
-        raise StopIteration
-
-  class FileDirectPageIterator:
-    def __init__(self, storageFile):
-      self.currentPageIdx = 0
-      self.storageFile    = storageFile
-      self.buffer         = bytearray(storageFile.pageSize())
-
-    def __iter__(self):
-      return self
-
-    def __next__(self):
-      pId = self.storageFile.pageId(self.currentPageIdx)
-      if self.storageFile.validPageId(pId):
-        self.currentPageIdx += 1
-        return (pId, self.storageFile.readPage(pId, self.buffer))
-      else:
-        raise StopIteration
-
-  class FileTupleIterator:
-    def __init__(self, storageFile):
-      self.storageFile     = storageFile
-      self.pageIterator    = storageFile.pages()
-      self.nextPage()
-
-    def __iter__(self):
-      return self
-
-    def __next__(self):
-      if self.pageIterator is not None:
-        while self.tupleIterator is not None:
-          try:
-            return next(self.tupleIterator)
-          except StopIteration:
-            self.nextPage()
-      
-      if self.pageIterator is None:
-        raise StopIteration
-
-    def nextPage(self):
-      try:
-        self.currentPage   = next(self.pageIterator)[1]
-      except StopIteration:
-        self.pageIterator  = None
-        self.tupleIterator = None
-      else:
-        self.tupleIterator = iter(self.currentPage)        
+  def tuples(self, start=0):
+    for (_, page) in self.pages(start):
+      yield from page
+
+  # Batched tuple iterator, yielding for each non-empty page its page id, its packed
+  # tuples as a single byte string, and the tuple index of each packed tuple.
+  def tupleBatches(self, start=0):
+    for (pId, page) in self.pages(start):
+      (data, indexes) = page.tupleBatch()
+      if indexes:
+        yield (pId, data, indexes)
+
+  # Column scan, yielding a tuple of the requested field values for each tuple.
+  # Row-oriented files must read entire tuples, so this projects each tuple in turn.
+  def columns(self, fields):
+    schema  = self.schema()
+    indexes = [schema.fields.index(f) for f in fields]
+    for tup in self.tuples():
+      values = schema.unpack(tup)
+      yield tuple(values[i] for i in indexes)
 
 
 if __name__ == "__main__":
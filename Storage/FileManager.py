@@ -1,8 +1,11 @@
 import io, json, os, os.path, pickle
 
+from collections import OrderedDict
+
 from Catalog.Schema      import DBSchema
 from Catalog.Identifiers import FileId
 from Storage.File        import StorageFile
+from Storage.Formats     import fileFormats
 
 class FileManager:
   """
@@ -12,6 +15,18 @@ class FileManager:
   relation name to a file identifier, and the second mapping a file
   identifier to the storage file object.
 
+  Storage files restored from a checkpoint are only opened on first access, so
+  that startup does not scale with the number of relations. The file manager also
+  bounds the number of open storage files, as an LRU cache closing the descriptors
+  of the least recently used files. Closed files reopen on their next use.
+
+  The file manager's catalog is saved as a snapshot (the checkpoint file), and an
+  append-only log of the relations added and removed since the snapshot. Each change
+  appends a single log record. The log is compacted into a new snapshot periodically
+  and when closing the file manager, with snapshots written to a temporary file and
+  atomically renamed into place. Restoring the catalog loads the snapshot and replays
+  the log records following it, ignoring any incomplete final record.
+
   >>> import Storage.BufferPool
   >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
   >>> bp = Storage.BufferPool.BufferPool()
@@ -38,14 +53,136 @@ class FileManager:
   >>> bp.setFileManager(fm)
   >>> list(fm.relations())
   ['employee']
+
+  # Restored files are opened on first access, and at most 'maxOpenFiles' files are open.
+  >>> import shutil
+  >>> fm.close(); shutil.rmtree(FileManager.defaultDataDir)
+  >>> fm = FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> for i in range(10):
+  ...   fm.createRelation('temp' + str(i), schema)
+  >>> fm.close()
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = FileManager(bufferPool=bp, maxOpenFiles=3)
+  >>> bp.setFileManager(fm)
+  >>> (len(fm.fileMap), fm.fileStats()['openFiles'])
+  (0, 0)
+  >>> for i in range(10):
+  ...   _ = fm.insertTuple('temp' + str(i), schema.pack(schema.instantiate(i, 20)))
+  >>> fm.fileStats()
+  {'openFiles': 3, 'filesOpened': 10, 'filesClosed': 7, 'fileSyncs': 0, 'logSyncs': 0}
+  >>> [schema.unpack(tup).id for i in range(10) for tup in fm.tuples('temp' + str(i))]
+  [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+  # Catalog changes are appended to the log, rather than rewriting the snapshot.
+  >>> fm.close(); shutil.rmtree(FileManager.defaultDataDir)
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> snapshotPath = os.path.join(fm.datadir, FileManager.checkpointFile)
+  >>> snapshotSize = os.path.getsize(snapshotPath)
+  >>> for i in range(200):
+  ...   fm.createRelation('temp' + str(i), schema)
+  >>> for i in range(100):
+  ...   fm.removeRelation('temp' + str(i))
+  >>> (fm.logRecords, os.path.getsize(snapshotPath) == snapshotSize)
+  (300, True)
+
+  # Without closing the file manager (e.g., after a crash), the catalog is restored
+  # from the snapshot and log. An incomplete final log record is ignored.
+  >>> with open(snapshotPath + FileManager.logSuffix, 'a') as log:
+  ...   _ = log.write('["add", 301, "tmp')
+  >>> fm2 = FileManager(bufferPool=Storage.BufferPool.BufferPool())
+  >>> (len(fm2.relations()), fm2.hasRelation('temp99'), fm2.hasRelation('temp100'), fm2.fileCounter)
+  (100, False, True, 200)
+
+  # The log is compacted into a new snapshot every 'checkpointInterval' records.
+  >>> fm.checkpointInterval = 50
+  >>> for i in range(60):
+  ...   fm.createRelation('more' + str(i), schema)
+  >>> fm.logRecords
+  9
+  >>> fm3 = FileManager(bufferPool=Storage.BufferPool.BufferPool())
+  >>> len(fm3.relations())
+  160
+
+  # Relations may be placed across several data directories (e.g., on separate disks).
+  >>> fm.close(); shutil.rmtree(FileManager.defaultDataDir)
+  >>> dirs = [os.path.join(FileManager.defaultDataDir, d) for d in ('disk0', 'disk1', 'disk2')]
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = FileManager(bufferPool=bp, datadirs=dirs)
+  >>> bp.setFileManager(fm)
+  >>> fm.datadirs == [os.path.normpath(d) for d in [FileManager.defaultDataDir] + dirs]
+  True
+
+  # Relations are placed round-robin by default, or in an explicit directory.
+  >>> for name in ('r0', 'r1', 'r2'):
+  ...   fm.createRelation(name, schema)
+  >>> fm.createRelation('r3', schema, datadir=dirs[0])
+  >>> [fm.relationDir(name) == d for (name, d) in zip(['r0', 'r1', 'r2', 'r3'], fm.datadirs[:3] + [dirs[0]])]
+  [True, True, True, True]
+
+  # The 'size' placement policy picks the directory holding the fewest bytes.
+  >>> (_, r1) = fm.relationFile('r1')
+  >>> for tup in [schema.pack(schema.instantiate(i, 20)) for i in range(1000)]:
+  ...   _ = r1.insertTuple(tup)
+  >>> fm.placement = 'size'
+  >>> fm.createRelation('r4', schema)
+  >>> fm.relationDir('r4') in (dirs[1], dirs[2])
+  True
+
+  # Striped relations spread their pages across all data directories, as segments.
+  >>> fm.createRelation('striped', schema, stripe=True, segmentSize=fm.pageSize)
+  >>> (_, s) = fm.relationFile('striped')
+  >>> for tup in [schema.pack(schema.instantiate(i, 20)) for i in range(5000)]:
+  ...   _ = s.insertTuple(tup)
+  >>> sorted(set(os.path.dirname(p) for p in s.segmentPaths())) == sorted(fm.datadirs)
+  True
+
+  # File classes are saved in the checkpoint by their file format id.
+  >>> FileManager.packClass(StorageFile)
+  1
+  >>> FileManager.unpackClass(FileManager.packClass(StorageFile)) is StorageFile
+  True
+
+  # Data directories and segment placement are restored from the checkpoint.
+  >>> fm.close()
+  >>> fm = FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> (_, s) = fm.relationFile('striped')
+  >>> (len(fm.datadirs), fm.placement, s.numTuples())
+  (4, 'size', 5000)
+  >>> fm.removeRelation('striped')
+  >>> any(os.path.exists(p) for p in s.segmentPaths())
+  False
+
+  ## Clean up the doctest
+  >>> fm.close()
+  >>> shutil.rmtree(FileManager.defaultDataDir)
   """
 
   defaultDataDir     = "data/"
   defaultFileClass   = StorageFile
 
+  # Relation placement policies across data directories, choosing either the next
+  # directory in turn, or the directory holding the fewest bytes.
+  placements         = ("roundRobin", "size")
+  defaultPlacement   = "roundRobin"
+
+  # The segment size of striped relations, if not given on creation.
+  defaultStripeSize  = 1 << 20
+
+  # The maximum number of storage files with open descriptors.
+  defaultMaxOpenFiles = 256
+
   checkpointEncoding = "latin1"
   checkpointFile     = "db.fm"
 
+  # The catalog log is stored alongside the checkpoint file, and compacted
+  # into a new checkpoint after this many records.
+  logSuffix          = ".log"
+  checkpointInterval = 1000
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
@@ -55,29 +192,67 @@ class FileManager:
       self.pageSize   = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
       self.bufferPool = kwargs.get("bufferPool", None)
       self.datadir    = kwargs.get("datadir", FileManager.defaultDataDir)
+      self.datadirs   = kwargs.get("datadirs", None) or [self.datadir]
+      self.placement  = kwargs.get("placement", FileManager.defaultPlacement)
+
+      # Whether the catalog snapshot, and the saved counts and indexes of storage files,
+      # are synced as they are written, rather than only by explicit syncs.
+      self.durable    = kwargs.get("durable", True)
+
+      # Storage files with open descriptors, in LRU order, and open/close counters.
+      self.maxOpenFiles = kwargs.get("maxOpenFiles", FileManager.defaultMaxOpenFiles)
+      self.openFiles    = OrderedDict()
+      self.filesOpened  = 0
+      self.filesClosed  = 0
+
+      # The catalog log's descriptor, opened on first use, and the number of records in the log.
+      # Log records are numbered in sequence, and the snapshot records the last record it includes.
+      self.logFd        = None
+      self.logRecords   = 0
+      self.logUnsynced  = False
+      self.logSyncs     = 0
+      self.catalogSeq   = kwargs.get("catalogSeq", 0)
+
+      # The checkpoint and the first relations are kept in the primary data directory.
+      self.datadirs = [os.path.normpath(d) for d in self.datadirs]
+      if os.path.normpath(self.datadir) not in self.datadirs:
+        self.datadirs = [os.path.normpath(self.datadir)] + self.datadirs
 
       if self.bufferPool is None:
         raise ValueError("No buffer pool found when initializing a file manager")
 
+      if self.placement not in FileManager.placements:
+        raise ValueError("Unknown relation placement policy: " + str(self.placement))
+
       checkpointFound = os.path.exists(os.path.join(self.datadir, FileManager.checkpointFile))
       restoring       = "restore" in kwargs
 
-      if not os.path.exists(self.datadir):
-        os.makedirs(self.datadir)
+      for datadir in self.datadirs:
+        if not os.path.exists(datadir):
+          os.makedirs(datadir)
 
       if restoring or not checkpointFound:
         self.fileClass     = kwargs.get("fileClass", FileManager.defaultFileClass)
         self.fileCounter   = kwargs.get("fileCounter", 0)
         self.relationFiles = kwargs.get("relationFiles", {})
         self.fileMap       = kwargs.get("fileMap", {})
-        
+
+        # Storage files from a checkpoint that have yet to be opened, as their
+        # path, file class and segment directories.
+        self.unopenedFiles = {}
+
         if restoring:
           self.relationFiles = dict([(i[0], FileId(i[1])) for i in kwargs["restore"][0]])
           for i in kwargs["restore"][1]:
             fId   = FileId(i[0])
             fPath = i[1]
-            self.fileMap[fId] = \
-              self.fileClass(bufferPool=self.bufferPool, fileId=fId, filePath=fPath, mode="update")
+            fClass = FileManager.unpackClass(i[2]) if len(i) > 2 else self.fileClass
+            fDirs  = i[3] if len(i) > 3 else None
+            self.unopenedFiles[fId] = (fPath, fClass, fDirs)
+
+        # Start a new data directory with a snapshot, which any log records follow.
+        else:
+          self.checkpoint()
 
       else:
         self.restore()
@@ -85,35 +260,195 @@ class FileManager:
   def fromOther(self, other):
     self.bufferPool    = other.bufferPool
     self.datadir       = other.datadir
+    self.datadirs      = other.datadirs
+    self.placement     = other.placement
     self.fileClass     = other.fileClass
     self.fileCounter   = other.fileCounter
     self.relationFiles = other.relationFiles
     self.fileMap       = other.fileMap
+    self.unopenedFiles = other.unopenedFiles
+    self.maxOpenFiles  = other.maxOpenFiles
+    self.durable       = other.durable
+    self.openFiles     = other.openFiles
+    self.filesOpened   = other.filesOpened
+    self.filesClosed   = other.filesClosed
+    self.logFd         = other.logFd
+    self.logRecords    = other.logRecords
+    self.logUnsynced   = other.logUnsynced
+    self.logSyncs      = other.logSyncs
+    self.catalogSeq    = other.catalogSeq
   
   # Closes and flushes all storage files in the file manager.
   # This includes flushing all pages held in the buffer pool.
-  def close(self):
+  # The final snapshot is synced if 'sync' is set (by default, if the file manager is durable).
+  def close(self, sync=None):
     if self.bufferPool:
       self.bufferPool.clear()
 
     if self.fileMap:
       for storageFile in self.fileMap.values():
-        storageFile.close()
+        self.closeFile(storageFile)
     
-    self.checkpoint()
-
-  # Save the file manager internals to the data directory.
-  def checkpoint(self):
-    fmPath = os.path.join(self.datadir, FileManager.checkpointFile)
-    with open(fmPath, 'w', encoding=FileManager.checkpointEncoding) as f:
+    self.checkpoint(sync)
+    if self.logFd is not None:
+      os.close(self.logFd)
+      self.logFd = None
+
+  # Forces the catalog log to disk.
+  def syncLog(self):
+    if self.logUnsynced:
+      os.fsync(self.logDescriptor())
+      self.logUnsynced = False
+      self.logSyncs   += 1
+
+  # Syncs a directory, making the creation, renaming and removal of its files durable.
+  @classmethod
+  def syncDirectory(cls, path):
+    dirFd = os.open(path, os.O_RDONLY)
+    try:
+      os.fsync(dirFd)
+    finally:
+      os.close(dirFd)
+
+  # Forces the catalog log and the writes of all storage files to disk. Each file saves
+  # its counts (and any other metadata, e.g., a compressed file's index) as it is synced.
+  def sync(self):
+    self.syncLog()
+    for storageFile in self.fileMap.values():
+      storageFile.sync()
+
+  # Open file cache operations
+
+  # Records the use of a storage file's descriptors, closing the least
+  # recently used files beyond the open file limit.
+  def touch(self, storageFile):
+    fId = storageFile.fileId
+    if fId in self.openFiles:
+      self.openFiles.move_to_end(fId)
+      return
+
+    self.openFiles[fId] = storageFile
+    self.filesOpened   += 1
+    while len(self.openFiles) > self.maxOpenFiles:
+      self.closeFile(next(iter(self.openFiles.values())))
+
+  # Closes a storage file's descriptors, removing it from the open files.
+  # The file is detached from the cache while closing, since closing uses its descriptors.
+  def closeFile(self, storageFile):
+    storageFile.fileCache = None
+    storageFile.close()
+    storageFile.fileCache = self
+    if self.openFiles.pop(storageFile.fileId, None) is not None:
+      self.filesClosed += 1
+
+  def fileStats(self):
+    return {
+        'openFiles'   : len(self.openFiles),
+        'filesOpened' : self.filesOpened,
+        'filesClosed' : self.filesClosed,
+        'fileSyncs'   : sum(storageFile.syncs for storageFile in self.fileMap.values()),
+        'logSyncs'    : self.logSyncs
+      }
+
+  # Saves a snapshot of the file manager internals to the data directory, and empties the log.
+  # The snapshot is written to a temporary file that atomically replaces the previous snapshot,
+  # so that the previous snapshot and log remain intact until the new snapshot is complete.
+  # The rename is made durable by syncing the data directory before the log is emptied,
+  # if 'sync' is set (by default, if the file manager is durable).
+  def checkpoint(self, sync=None):
+    sync    = self.durable if sync is None else sync
+    fmPath  = os.path.join(self.datadir, FileManager.checkpointFile)
+    tmpPath = fmPath + ".tmp"
+    with open(tmpPath, 'w', encoding=FileManager.checkpointEncoding) as f:
       f.write(self.pack())
-
-  # Load relations from an existing data directory.
+      f.flush()
+      if sync:
+        os.fsync(f.fileno())
+    os.replace(tmpPath, fmPath)
+    if sync:
+      self.syncDirectory(self.datadir)
+
+    if self.logRecords > 0:
+      os.ftruncate(self.logDescriptor(), 0)
+      self.logRecords = 0
+    self.logUnsynced = False
+
+  # Load relations from an existing data directory, replaying the log following the snapshot.
   def restore(self):
     fmPath = os.path.join(self.datadir, FileManager.checkpointFile)
     with open(fmPath, 'r', encoding=FileManager.checkpointEncoding) as f:
       other = FileManager.unpack(self.bufferPool, f.read())
+      other.maxOpenFiles = self.maxOpenFiles
+      other.durable      = self.durable
       self.fromOther(other)
+    self.replayLog()
+
+  # Catalog log operations
+  #
+  # Log records are JSON lists, one per line, holding the kind of change and its sequence number:
+  # i.  ["add", seq, relId, fileIndex, filePath, fileClass, segmentDirs] for a new or added relation.
+  # ii. ["remove", seq, relId] for a removed or detached relation.
+
+  def logDescriptor(self):
+    if self.logFd is None:
+      logPath    = os.path.join(self.datadir, FileManager.checkpointFile + FileManager.logSuffix)
+      self.logFd = os.open(logPath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    return self.logFd
+
+  # Appends a catalog change to the log with a single write, compacting the log when full.
+  def logChange(self, kind, relId, *args):
+    self.catalogSeq += 1
+    record = json.dumps([kind, self.catalogSeq, relId] + list(args)) + "\n"
+    os.write(self.logDescriptor(), record.encode(FileManager.checkpointEncoding))
+    self.logRecords += 1
+    self.logUnsynced = True
+    if self.logRecords >= self.checkpointInterval:
+      self.checkpoint()
+
+  def logAddRelation(self, relId, fileId, storageFile):
+    self.logChange("add", relId, fileId.fileIndex, storageFile.filePath, \
+                   FileManager.packClass(type(storageFile)), storageFile.segmentDirs)
+
+  # Applies the log records following the snapshot. Replay stops at an incomplete record,
+  # as left by a crash while appending it, which is then removed from the log.
+  def replayLog(self):
+    logPath = os.path.join(self.datadir, FileManager.checkpointFile + FileManager.logSuffix)
+    if not os.path.exists(logPath):
+      return
+
+    logEnd = 0
+    with open(logPath, 'rb') as f:
+      for line in f:
+        if not line.endswith(b"\n"):
+          break
+        try:
+          record = json.loads(line.decode(FileManager.checkpointEncoding))
+        except ValueError:
+          break
+
+        logEnd          += len(line)
+        self.logRecords += 1
+
+        (kind, seq, relId) = record[:3]
+        if seq <= self.catalogSeq:
+          continue
+
+        if kind == "add":
+          (fileIndex, fPath, fClass, fDirs) = record[3:]
+          fId = FileId(fileIndex)
+          self.relationFiles[relId] = fId
+          self.unopenedFiles[fId]   = (fPath, FileManager.unpackClass(fClass), fDirs)
+          self.fileCounter          = max(self.fileCounter, fileIndex + 1)
+
+        elif kind == "remove":
+          fId = self.relationFiles.pop(relId, None)
+          self.fileMap.pop(fId, None)
+          self.unopenedFiles.pop(fId, None)
+
+        self.catalogSeq = seq
+
+    if logEnd < os.path.getsize(logPath):
+      os.truncate(logPath, logEnd)
 
   # Return the relation ids present in the file manager.
   def relations(self):
@@ -122,54 +457,117 @@ class FileManager:
   def hasRelation(self, relId):
     return relId in self.relationFiles
 
-  def createRelation(self, relId, schema):
+  # Returns the data directory holding the (first segment of the) relation's file.
+  def relationDir(self, relId):
+    (_, rFile) = self.relationFile(relId)
+    if rFile:
+      return os.path.dirname(rFile.filePath)
+
+  # Returns the data directory for a new relation, following the placement policy.
+  def placeRelation(self):
+    if self.placement == "size":
+      return min(self.datadirs, key=FileManager.directorySize)
+    return self.datadirs[self.fileCounter % len(self.datadirs)]
+
+  # Returns the bytes held by the files in a directory.
+  @classmethod
+  def directorySize(cls, datadir):
+    return sum(entry.stat().st_size for entry in os.scandir(datadir) if entry.is_file())
+
+  # Creates a storage file for a new relation.
+  # Keyword arguments:
+  # fileClass : the storage file class for the relation, defaulting to the file manager's.
+  # pageClass : the page class for the relation, defaulting to the file class' default.
+  # datadir   : the data directory for the relation, defaulting to the placement policy's choice.
+  # stripe    : whether to stripe the relation's pages across all data directories, as segments
+  #             placed round-robin starting from the relation's data directory.
+  # Any other keyword arguments are passed to the file class constructor.
+  def createRelation(self, relId, schema, **kwargs):
     if relId not in self.relationFiles:
+      datadir = os.path.normpath(kwargs.pop("datadir", None) or self.placeRelation())
+      if datadir not in self.datadirs:
+        raise ValueError("Unknown data directory: " + str(datadir))
+
+      if kwargs.pop("stripe", False):
+        start = self.datadirs.index(datadir)
+        kwargs["segmentDirs"] = self.datadirs[start:] + self.datadirs[:start]
+        kwargs.setdefault("segmentSize", FileManager.defaultStripeSize)
+
       fId = FileId(self.fileCounter)
-      path = os.path.join(self.datadir, str(self.fileCounter)+'.rel')
+      path = os.path.join(datadir, str(self.fileCounter)+'.rel')
+      fileClass = kwargs.pop("fileClass", self.fileClass)
+      pageClass = kwargs.pop("pageClass", fileClass.defaultPageClass)
       self.fileCounter += 1
       self.relationFiles[relId] = fId
       self.fileMap[fId] = \
-        self.fileClass(bufferPool=self.bufferPool, \
-                       pageSize=self.pageSize, fileId=fId, filePath=path, mode="create", schema=schema)
+        fileClass(bufferPool=self.bufferPool, pageSize=self.pageSize, pageClass=pageClass, \
+                  fileId=fId, filePath=path, mode="create", schema=schema, fileCache=self, \
+                  durable=self.durable, **kwargs)
 
-      self.checkpoint()
+      self.logAddRelation(relId, fId, self.fileMap[fId])
 
   def addRelation(self, relId, fileId, storageFile):
     if relId not in self.relationFiles and fileId not in self.fileMap:
       self.fileCounter          = max(self.fileCounter, fileId.fileIndex+1)
       self.relationFiles[relId] = fileId
       self.fileMap[fileId]      = storageFile
-      self.checkpoint()
+      storageFile.fileCache     = self
+      storageFile.durable       = self.durable
+      self.logAddRelation(relId, fileId, storageFile)
 
+  # The removal is logged before deleting the relation's files, so that a crash
+  # may leave unused files behind, but not a catalog entry for missing files.
   def removeRelation(self, relId):
     fId   = self.relationFiles.pop(relId, None)
-    rFile = self.fileMap.pop(fId, None) if fId else None
+    rFile = self.storageFile(fId) if fId else None
     if rFile:
-      rFile.close()
-      os.remove(rFile.filePath)
-      self.checkpoint()
+      self.fileMap.pop(fId)
+      self.logChange("remove", relId)
+      for pageIndex in range(rFile.numPages()):
+        self.bufferPool.discardPage(rFile.pageId(pageIndex))
+
+      self.closeFile(rFile)
+      for path in rFile.filePaths():
+        os.remove(path)
 
   # Removes a relation from the file manager without closing
   # and deleting the underlying storage file.
   def detachRelation(self, relId):
     fId   = self.relationFiles.pop(relId, None)
-    rFile = self.fileMap.pop(fId, None) if fId else None
+    rFile = self.storageFile(fId) if fId else None
     if rFile:
-      self.checkpoint()
+      self.fileMap.pop(fId)
+      self.openFiles.pop(fId, None)
+      rFile.fileCache = None
+      self.logChange("remove", relId)
 
   def relationFile(self, relId):
     fId = self.relationFiles.get(relId, None) if relId else None
-    return (fId, self.fileMap.get(fId, None)) if fId else (None, None)
+    return (fId, self.storageFile(fId)) if fId else (None, None)
+
+  # Returns the storage file for a file id, opening the file if needed.
+  # Files being opened are found among the open files (e.g., while restoring
+  # their state through the buffer pool).
+  def storageFile(self, fileId):
+    rFile = self.fileMap.get(fileId, None)
+    if rFile is None:
+      rFile = self.openFiles.get(fileId, None)
+    if rFile is None and fileId in self.unopenedFiles:
+      (fPath, fClass, fDirs) = self.unopenedFiles.pop(fileId)
+      rFile = fClass(bufferPool=self.bufferPool, fileId=fileId, filePath=fPath, mode="update", \
+                     segmentDirs=fDirs, fileCache=self, durable=self.durable)
+      self.fileMap[fileId] = rFile
+    return rFile
 
 
   # Page operations
   def readPage(self, pageId, pageBuffer):
-    rFile = self.fileMap.get(pageId.fileId, None) if pageId else None
+    rFile = self.storageFile(pageId.fileId) if pageId else None
     if rFile:
       return rFile.readPage(pageId, pageBuffer)
 
   def writePage(self, page):
-    rFile = self.fileMap.get(pageId.fileId, None) if page.pageId else None
+    rFile = self.storageFile(page.pageId.fileId) if page.pageId else None
     if rFile:
       return rFile.writePage(page)
 
@@ -183,21 +581,22 @@ class FileManager:
       return rFile.insertTuple(tupleData)
 
   def deleteTuple(self, tupleId):
-    rFile = self.fileMap.get(tupleId.pageId.fileIndex, None)
+    rFile = self.storageFile(tupleId.pageId.fileId)
     if rFile:
       rFile.deleteTuple(tupleId)
 
   def updateTuple(self, tupleId, tupleData):
-    rFile = self.fileMap.get(tupleId.pageId.fileIndex, None)
+    rFile = self.storageFile(tupleId.pageId.fileId)
     if rFile:
-      rFile.updateTuple(tupleId, tupleData)
+      return rFile.updateTuple(tupleId, tupleData)
 
 
-  # Tuple-based table scan
-  def tuples(self, relId):
+  # Tuple-based table scan.
+  # With 'batch' set, yields (page id, packed tuples, tuple indexes) for each page instead.
+  def tuples(self, relId, batch=False):
     (_, rFile) = self.relationFile(relId)
     if rFile:
-      return rFile.tuples()
+      return rFile.tupleBatches() if batch else rFile.tuples()
 
   # Page-based table scan
   def pages(self, relId):
@@ -205,22 +604,55 @@ class FileManager:
     if rFile:
       return rFile.pages()
 
+  # Column-based table scan, yielding the values of the given fields.
+  def columns(self, relId, fields):
+    (_, rFile) = self.relationFile(relId)
+    if rFile:
+      return rFile.columns(fields)
+
 
   # File manager serialization
+  # Each storage file is saved with its own class, since relations may use different file classes,
+  # and with its segment directories. The data directories and placement policy are saved last.
+  #
+  # File classes are saved by their file format id (from Storage.Formats), or pickled if unregistered.
+  @classmethod
+  def packClass(cls, clazz):
+    formatId = fileFormats.formatId(clazz)
+    if formatId:
+      return formatId
+    return pickle.dumps(clazz).decode(encoding=FileManager.checkpointEncoding)
+
+  @classmethod
+  def unpackClass(cls, packedClass):
+    if isinstance(packedClass, int):
+      return fileFormats.formatClass(packedClass)
+    return pickle.loads(packedClass.encode(encoding=FileManager.checkpointEncoding))
+
   def pack(self):
     if self.relationFiles is not None and self.fileMap is not None:
-      pfileClass     = pickle.dumps(self.fileClass).decode(encoding=FileManager.checkpointEncoding)
+      pfileClass     = FileManager.packClass(self.fileClass)
       prelationFiles = list(map(lambda entry: (entry[0], entry[1].fileIndex), self.relationFiles.items()))
-      pfileMap       = list(map(lambda entry: (entry[0].fileIndex, entry[1].filePath), self.fileMap.items()))
-      return json.dumps((self.datadir, pfileClass, self.fileCounter, prelationFiles, pfileMap))
+      pfileMap       = list(map(lambda entry: \
+                         (entry[0].fileIndex, entry[1].filePath, FileManager.packClass(type(entry[1])), \
+                          entry[1].segmentDirs), \
+                         self.fileMap.items()))
+      pfileMap      += [(fId.fileIndex, fPath, FileManager.packClass(fClass), fDirs) \
+                         for (fId, (fPath, fClass, fDirs)) in self.unopenedFiles.items()]
+      return json.dumps((self.datadir, pfileClass, self.fileCounter, prelationFiles, pfileMap, \
+                         self.datadirs, self.placement, self.catalogSeq))
 
   @classmethod
   def unpack(cls, bufferPool, strBuffer):
     args = json.loads(strBuffer)
-    if len(args) == 5:
-      unfileClass = pickle.loads(args[1].encode(encoding=FileManager.checkpointEncoding))
+    if len(args) in (5, 7, 8):
+      unfileClass = FileManager.unpackClass(args[1])
+      placement   = args[6] if len(args) >= 7 else FileManager.defaultPlacement
+      datadirs    = args[5] if len(args) >= 7 else None
+      catalogSeq  = args[7] if len(args) >= 8 else 0
       return cls(bufferPool=bufferPool, datadir=args[0], fileClass=unfileClass, \
-                 fileCounter=args[2], restore=(args[3], args[4]))
+                 fileCounter=args[2], restore=(args[3], args[4]), datadirs=datadirs, placement=placement, \
+                 catalogSeq=catalogSeq)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+import importlib
+
+class FormatRegistry:
+  """
+  A registry of storage formats (i.e., page or storage file classes), identified
+  by compact numeric ids that are stored on disk instead of the pickled classes.
+
+  Formats are registered by their qualified class name, and their module is only
+  imported on the first lookup of the format's class. Id 0 is reserved for
+  unregistered formats.
+
+  >>> registry = FormatRegistry('page')
+  >>> registry.register(1, 'Storage.Page.Page')
+  >>> from Storage.Page import Page
+  >>> (registry.formatId(Page), registry.formatClass(1) is Page)
+  (1, True)
+
+  # Unregistered classes have no format id.
+  >>> registry.formatId(FormatRegistry) is None
+  True
+
+  >>> registry.formatClass(2)
+  Traceback (most recent call last):
+  ...
+  ValueError: Unknown page format id: 2
+
+  >>> registry.register(1, 'Storage.SlottedPage.SlottedPage')
+  Traceback (most recent call last):
+  ...
+  ValueError: Duplicate page format id: 1
+
+  # The registries of page and storage file formats.
+  >>> from Storage.SlottedPage import SlottedPage
+  >>> pageFormats.formatClass(pageFormats.formatId(SlottedPage)) is SlottedPage
+  True
+  """
+
+  def __init__(self, kind):
+    self.kind    = kind
+    self.names   = {}
+    self.ids     = {}
+    self.classes = {}
+
+  # Registers a format id for the class with the given qualified name.
+  def register(self, formatId, className):
+    if formatId <= 0 or formatId in self.names:
+      raise ValueError("Duplicate " + self.kind + " format id: " + str(formatId))
+    self.names[formatId] = className
+    self.ids[className]  = formatId
+
+  # Returns the format id of a class, or None if the class is unregistered.
+  def formatId(self, clazz):
+    return self.ids.get(clazz.__module__ + "." + clazz.__qualname__, None)
+
+  # Returns the class of a format id, importing its module on first use.
+  def formatClass(self, formatId):
+    clazz = self.classes.get(formatId, None)
+    if clazz is None:
+      className = self.names.get(formatId, None)
+      if className is None:
+        raise ValueError("Unknown " + self.kind + " format id: " + str(formatId))
+
+      (moduleName, _, name) = className.rpartition(".")
+      clazz = getattr(importlib.import_module(moduleName), name)
+      self.classes[formatId] = clazz
+    return clazz
+
+
+# Page formats. Ids are stored in file headers, and must not be reused.
+pageFormats = FormatRegistry('page')
+pageFormats.register(1, 'Storage.Page.Page')
+pageFormats.register(2, 'Storage.SlottedPage.SlottedPage')
+pageFormats.register(3, 'Storage.PaxPage.PaxPage')
+pageFormats.register(4, 'Storage.CompressedPage.CompressedPage')
+
+# Storage file formats. Ids are stored in file manager checkpoints, and must not be reused.
+fileFormats = FormatRegistry('file')
+fileFormats.register(1, 'Storage.File.StorageFile')
+fileFormats.register(2, 'Storage.CompressedFile.CompressedStorageFile')
+fileFormats.register(3, 'Storage.ColumnarFile.ColumnarFile')
+fileFormats.register(4, 'Storage.DirectFile.DirectStorageFile')
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
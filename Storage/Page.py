@@ -1,4 +1,3 @@
-from io import BytesIO
 import copy, math, struct
 
 from Catalog.Identifiers import TupleId
@@ -103,6 +102,23 @@ class PageHeader:
 
   >>> ph.freeSpace() < ph.tupleSize
   True
+
+  ## Wide page header tests
+  # Pages larger than 64 KB use a wide header, marked in the page's flags.
+  >>> buffer3 = io.BytesIO(bytes(1 << 17))
+  >>> ph4     = PageHeader(buffer=buffer3.getbuffer(), tupleSize=16)
+  >>> (ph.isWide(), ph4.isWide())
+  (False, True)
+
+  >>> ph4.headerSize() == PageHeader.sizeFor(1 << 17) and ph4.headerSize() > PageHeader.size
+  True
+
+  >>> ph5 = PageHeader.unpack(buffer3.getbuffer())
+  >>> ph4 == ph5 and ph5.pageCapacity == 1 << 17
+  True
+
+  >>> [ph4.nextFreeTuple() for i in range(0, (1 << 17) // 16)][-2:]
+  [131052, None]
   """
 
   # Binary representation of a page header:
@@ -111,8 +127,16 @@ class PageHeader:
   binrepr   = struct.Struct("cHHH")
   size      = binrepr.size
 
+  # Binary representation of a wide page header, for pages larger than 64 KB:
+  # the free space offset and page capacity are stored as unsigned ints.
+  widerepr  = struct.Struct("cHII")
+
+  # The largest page capacity supported by narrow page headers.
+  maxNarrowCapacity = 0xFFFF
+
   # Flag bitmasks
   dirtyMask = 0b1
+  wideMask  = 0b10000000
 
   # Page header constructor.
   #
@@ -128,6 +152,10 @@ class PageHeader:
     self.flags           = kwargs.get("flags", b'\x00')
     self.tupleSize       = kwargs.get("tupleSize", None)
     self.pageCapacity    = kwargs.get("pageCapacity", len(buffer))
+
+    self.setWide(PageHeader.wideCapacity(self.pageCapacity))
+    self.binrepr         = PageHeader.widerepr if self.isWide() else PageHeader.binrepr
+    self.size            = self.binrepr.size
     self.freeSpaceOffset = kwargs.get("freeSpaceOffset", self.size)
 
     buffer[0:self.size] = self.pack()
@@ -162,6 +190,29 @@ class PageHeader:
   def setDirty(self, dirty):
     self.setFlag(PageHeader.dirtyMask, dirty)
 
+  # Wide format accessors.
+  # Page header subclasses use the wide flag to select wider fields for page offsets.
+  def isWide(self):
+    return self.flag(PageHeader.wideMask)
+
+  def setWide(self, wide):
+    self.setFlag(PageHeader.wideMask, wide)
+
+  # Returns whether a page of the given capacity requires a wide page header.
+  @classmethod
+  def wideCapacity(cls, pageCapacity):
+    return pageCapacity > PageHeader.maxNarrowCapacity
+
+  # Returns whether the packed page header held in the buffer uses the wide format.
+  @classmethod
+  def wideBuffer(cls, buffer):
+    return (buffer[0] & PageHeader.wideMask) > 0
+
+  # Returns the size of a (contiguous) page header for the given page capacity.
+  @classmethod
+  def sizeFor(cls, pageCapacity):
+    return (PageHeader.widerepr if PageHeader.wideCapacity(pageCapacity) else PageHeader.binrepr).size
+
   # Tuple count for the header.
   def numTuples(self):
     return (self.usedSpace() // self.tupleSize)
@@ -199,34 +250,45 @@ class PageHeader:
 
   # Returns a binary representation of this page header.
   def pack(self):
-    return PageHeader.binrepr.pack(
+    return self.binrepr.pack(
               self.flags, self.tupleSize,
               self.freeSpaceOffset, self.pageCapacity)
 
   # Constructs a page header object from a binary representation held in a byte string.
   @classmethod
   def unpack(cls, buffer):
-    values = PageHeader.binrepr.unpack_from(buffer)
+    binrepr = PageHeader.widerepr if PageHeader.wideBuffer(buffer) else PageHeader.binrepr
+    values  = binrepr.unpack_from(buffer)
 
     if len(values) == 4:
       return cls(buffer=buffer, flags=values[0], tupleSize=values[1],
                  freeSpaceOffset=values[2], pageCapacity=values[3])
 
 
-class Page(BytesIO):
+class Page:
   """
   A page class, representing a unit of storage for database tuples.
 
   A page includes a page identifier, and a page header containing metadata
   about the state of the page (e.g., its free space offset).
 
-  Our page class inherits from an io.BytesIO, providing it an implementation
-  of a in-memory binary stream.
+  Our page class is a lightweight wrapper over a memoryview of the page's bytes,
+  as returned by getbuffer(). Pages do not own their buffer: writable buffers
+  (e.g., a bytearray, or a memoryview on a buffer pool frame) are used in place,
+  so constructing a page does not copy its contents. Read-only buffers such as
+  'bytes' objects are first copied into a bytearray.
 
   The page constructor requires a byte buffer in which we can store tuples.
   The user has the responsibility for constructing a suitable buffer, for
   example with Python's 'bytes()' builtin.
 
+  Pages created by unpack() parse their header from the buffer on first access.
+
+  Pages created by unpack() also track the byte ranges changed by their tuple
+  operations, so that writing the page may be limited to the changed ranges and
+  the page header. Changes to newly constructed pages are not tracked, and such
+  pages must be written whole.
+
   The page also provides several methods to retrieve and modify its contents
   based on a tuple identifier, and where relevant, tuple data represented as
   an immutable sequence of bytes.
@@ -300,6 +362,15 @@ class Page(BytesIO):
   >>> [schema.unpack(tup).age for tup in p]
   [28, 20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
 
+  # Iterators are independent, so scans over the same page may be nested.
+  >>> sum(1 for t1 in p for t2 in p)
+  121
+
+  # Tuple batches hold all packed tuples in a single byte string.
+  >>> (data, indexes) = p.tupleBatch()
+  >>> [v[1] for v in schema.binrepr.iter_unpack(data)][:3], list(indexes)[:3]
+  ([28, 20, 22], [0, 1, 2])
+
   # Test clearing of first tuple
   >>> tId = TupleId(p.pageId, 0)
   >>> sizeBeforeClear = p.header.usedSpace()
@@ -327,30 +398,64 @@ class Page(BytesIO):
   >>> p.header.usedSpace() == (sizeBeforeRemove - p.header.tupleSize)
   True
 
+  # Pages wrap writable buffers without copying them.
+  >>> frame = bytearray(p.pack())
+  >>> p4    = Page.unpack(pId, frame)
+  >>> p4.putTuple(TupleId(pId, 0), schema.pack(schema.instantiate(7, 70)))
+  >>> schema.unpack(Page.unpack(pId, frame).getTuple(TupleId(pId, 0)))
+  employee(id=7, age=70)
+
+  # Detached pages copy their buffer, and no longer share it.
+  >>> p4.detach()
+  >>> p4.putTuple(TupleId(pId, 0), schema.pack(schema.instantiate(8, 80)))
+  >>> schema.unpack(Page.unpack(pId, frame).getTuple(TupleId(pId, 0)))
+  employee(id=7, age=70)
+
+  # Unpacked pages track their changed byte ranges, together with their header.
+  >>> p5 = Page.unpack(pId, frame)
+  >>> p5.changedRanges() == [(0, p5.header.size)]
+  True
+  >>> p5.putTuple(TupleId(pId, 2), schema.pack(schema.instantiate(9, 90)))
+  >>> _ = p5.insertTuple(schema.pack(schema.instantiate(10, 100)))
+  >>> [(start - p5.header.size) // p5.header.tupleSize for (start, _) in p5.changedRanges()[1:]]
+  [2, 10]
+  >>> p.changedRanges() is None
+  True
   """
 
+  __slots__ = ('pageId', 'header', 'buffer', 'changes', '__weakref__')
+
   headerClass = PageHeader
 
+  # Whether the page class tracks the byte ranges changed by its operations.
+  # Subclasses that change their contents without recording ranges disable this.
+  tracksChanges = True
+
   # Page constructor.
   #
   # REIMPLEMENT this as desired.
   #
   # Constructors keyword arguments, with defaults if not present:
-  # buffer       : a byte string of initial page contents.
+  # buffer       : a byte string or writable buffer of initial page contents.
   # pageId       : a PageId instance identifying this page.
   # header       : a PageHeader instance.
   # schema       : the schema for tuples to be stored in the page.
+  # unpack       : whether to lazily parse the page header from the buffer.
   # Also, any keyword arguments needed to construct a PageHeader.
   def __init__(self, **kwargs):
     buffer = kwargs.get("buffer", None)
     if buffer:
-      BytesIO.__init__(self, buffer)
-      self.pageId = kwargs.get("pageId", None)
-      header      = kwargs.get("header", None)
-      schema      = kwargs.get("schema", None)
+      self.buffer  = Page.wrapBuffer(buffer)
+      self.pageId  = kwargs.get("pageId", None)
+      self.changes = None
+      header       = kwargs.get("header", None)
+      schema       = kwargs.get("schema", None)
 
       if self.pageId and header:
         self.header = header
+      elif self.pageId and kwargs.get("unpack", False):
+        if self.tracksChanges:
+          self.changes = []
       elif self.pageId:
         self.header = self.initializeHeader(**kwargs)
       else:
@@ -358,6 +463,58 @@ class Page(BytesIO):
     else:
       raise ValueError("No backing buffer provided to page constructor.")
 
+  # Returns a writable memoryview on the given buffer, copying read-only buffers.
+  @classmethod
+  def wrapBuffer(cls, buffer):
+    view = memoryview(buffer)
+    return memoryview(bytearray(view)) if view.readonly else view
+
+  # Parses the page header on first access, for pages constructed by unpack().
+  def __getattr__(self, name):
+    if name == 'header':
+      self.header = self.headerClass.unpack(self.buffer)
+      return self.header
+    raise AttributeError(name)
+
+  # Returns a memoryview on the page's contents.
+  def getbuffer(self):
+    return self.buffer
+
+  # Replaces the page's buffer with a private copy, for example before the
+  # buffer pool frame backing this page is reused for another page.
+  def detach(self):
+    self.buffer = memoryview(bytearray(self.buffer))
+
+  # Change tracking
+
+  # Records a changed byte range of the page, if its changes are tracked.
+  def markChanged(self, start, end):
+    if self.changes is not None:
+      self.changes.append((start, end))
+
+  # Returns the byte ranges of the header that are rewritten whenever the page is.
+  def headerRanges(self):
+    return [(0, self.header.size)]
+
+  # Returns the byte ranges changed since the page was unpacked, together with the page
+  # header, as sorted and merged (start, end) offsets. Returns None if changes are not
+  # tracked, in which case the whole page should be considered changed.
+  def changedRanges(self):
+    if self.changes is None:
+      return None
+    return Page.mergeRanges(self.headerRanges() + self.changes)
+
+  # Merges overlapping byte ranges, and ranges separated by at most 'gap' bytes.
+  @classmethod
+  def mergeRanges(cls, ranges, gap=0):
+    merged = []
+    for (start, end) in sorted(ranges):
+      if merged and start <= merged[-1][1] + gap:
+        merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+      else:
+        merged.append((start, end))
+    return merged
+
 
   # Header constructor. This can be overridden by subclasses.
   def initializeHeader(self, **kwargs):
@@ -367,19 +524,22 @@ class Page(BytesIO):
     else:
       raise ValueError("No schema provided when constructing a page.")
 
-  # Iterator
+  # Tuple iterator, over the tuples present when iteration starts.
+  # Iteration state is kept in the generator, so a page may be scanned
+  # by several iterators at once.
   def __iter__(self):
-    self.iterTupleIdx = 0
-    return self
-
-  def __next__(self):
-    t = self.getTuple(TupleId(self.pageId, self.iterTupleIdx))
-    
-    if t:
-      self.iterTupleIdx += 1
-      return t
-    else:
-      raise StopIteration
+    view      = self.getbuffer()
+    tupleSize = self.header.tupleSize
+    start     = self.header.size
+    for offset in range(start, start + self.header.numTuples() * tupleSize, tupleSize):
+      yield bytes(view[offset:offset + tupleSize])
+
+  # Returns the packed tuples of the page as a single byte string, together
+  # with the tuple index of each packed tuple, for batched scans.
+  def tupleBatch(self):
+    start     = self.header.size
+    numTuples = self.header.numTuples()
+    return (bytes(self.getbuffer()[start:start + numTuples * self.header.tupleSize]), range(numTuples))
 
   # Dirty bit accessors
   def isDirty(self):
@@ -401,9 +561,14 @@ class Page(BytesIO):
  
     view = self.getbuffer()
     offset = tupleIndex * self.header.tupleSize + self.header.size
-    tupleBytes = view[offset: offset + self.header.tupleSize]
+    tupleBytes = bytes(view[offset: offset + self.header.tupleSize])
     return tupleBytes
 
+  # Returns whether the (packed) tuple at the given tuple id can be updated in this page.
+  # Fixed-size tuples always can, but encoded pages may have to move a tuple elsewhere.
+  def canPutTuple(self, tupleId, tupleData):
+    return True
+
   # Updates the (packed) tuple at the given tuple id.
   def putTuple(self, tupleId, tupleData):
     offset = (tupleId.tupleIndex * self.header.tupleSize) + self.header.size
@@ -411,6 +576,7 @@ class Page(BytesIO):
     view = self.getbuffer()
     view[offset:offset + self.header.tupleSize] = tupleData
 
+    self.markChanged(offset, offset + self.header.tupleSize)
     self.setDirty(0b1)
 
   # Adds a packed tuple to the page. Returns the tuple id of the newly added tuple.
@@ -425,6 +591,7 @@ class Page(BytesIO):
     view = self.getbuffer()
     view[tupleOffset:tupleOffset + self.header.tupleSize] = tupleData
 
+    self.markChanged(tupleOffset, tupleOffset + self.header.tupleSize)
     self.setDirty(0b1)
     return tupleID
 
@@ -437,6 +604,7 @@ class Page(BytesIO):
     for i in range(self.header.tupleSize):
       view[i + tupleOffset : i + tupleOffset + 1] = b'\x00'
 
+    self.markChanged(tupleOffset, tupleOffset + self.header.tupleSize)
     self.setDirty(0b1)
 
   # Removes the tuple at the given tuple id, shifting subsequent tuples.
@@ -450,6 +618,8 @@ class Page(BytesIO):
     for i in range(tupleOff,tupleOff + (tuplesToShift * self.header.tupleSize)):
       view[i:i+1] = view[i+self.header.tupleSize:i+self.header.tupleSize + 1]
 
+    self.markChanged(tupleOff, tupleOff + tuplesToShift * self.header.tupleSize)
+
     toClearID = TupleId(self.pageId, self.header.numTuples()-1)
     self.clearTuple(toClearID)
 
@@ -474,12 +644,10 @@ class Page(BytesIO):
 
   # Creates a Page instance from the binary representation held in the buffer.
   # The pageId of the newly constructed Page instance is given as an argument.
+  # The page header is parsed from the buffer on first access.
   @classmethod
   def unpack(cls, pageId, buffer):
-    
-    pageHeader = PageHeader.unpack(buffer)
-
-    return Page(pageId=pageId, buffer=buffer, header=pageHeader)
+    return cls(pageId=pageId, buffer=buffer, unpack=True)
 
     # raise NotImplementedError
 
@@ -0,0 +1,359 @@
+import struct
+
+from Catalog.Identifiers import TupleId
+from Storage.Page        import PageHeader, Page
+
+class PaxPageHeader(PageHeader):
+  """
+  A page header for PAX (partition attributes across) pages.
+
+  A PAX page stores the same set of tuples as a contiguous page, but lays out
+  each attribute in its own minipage within the page. That is, the values of
+  the first field for all tuples in the page are stored contiguously, followed
+  by all values of the second field, and so on.
+
+  The header records the page's flags, the (packed) tuple size, the number of
+  tuples in the page, the page capacity and the column layout of the tuples.
+  The column layout is a list of (offset, size) pairs identifying where each
+  field lives within a packed tuple, as given by DBSchema.fieldLayout(). Any
+  alignment padding in the packed tuple representation is not stored in the page.
+
+  The binary representation of this header object is:
+  (flags, tupleSize, numTuples, pageCapacity, numColumns, [columnOffset, columnSize]*)
+
+  Wide headers, for pages larger than 64 KB, store the tuple count and page capacity
+  as unsigned ints.
+
+  >>> import io
+  >>> buffer = io.BytesIO(bytes(4096))
+  >>> ph     = PaxPageHeader(buffer=buffer.getbuffer(), tupleSize=16, columns=[(0, 4), (8, 8)])
+  >>> ph2    = PaxPageHeader.unpack(buffer.getbuffer())
+  >>> ph == ph2
+  True
+
+  # Padding bytes are not stored, so more tuples fit than in a contiguous page.
+  >>> ph.tupleCapacity() == (4096 - ph.headerSize()) // 12
+  True
+
+  ## Tuple count tests
+  >>> ph.hasFreeTuple()
+  True
+
+  # Tuples are allocated by index.
+  >>> [ph.nextFreeTuple() for i in range(0, 5)]
+  [0, 1, 2, 3, 4]
+
+  >>> ph.numTuples()
+  5
+
+  >>> ph.usedSpace() == 5 * 12
+  True
+
+  # Each column's minipage starts after all values of the previous column.
+  >>> ph.columnStart(1) - ph.columnStart(0) == 4 * ph.tupleCapacity()
+  True
+
+  # Fill the page.
+  >>> remainingTuples = ph.tupleCapacity() - ph.numTuples()
+  >>> [ph.nextFreeTuple() for i in range(0, remainingTuples)] # doctest:+ELLIPSIS
+  [5, 6, ...]
+
+  >>> ph.hasFreeTuple()
+  False
+
+  >>> ph.nextFreeTuple() == None
+  True
+
+  # Pages larger than 64 KB use a wide header.
+  >>> buffer2 = io.BytesIO(bytes(1 << 17))
+  >>> ph3     = PaxPageHeader(buffer=buffer2.getbuffer(), tupleSize=1, columns=[(0, 1)])
+  >>> ph3.tupleCount = ph3.tupleCapacity()
+  >>> buffer2.getbuffer()[0:ph3.size] = ph3.pack()
+  >>> ph4     = PaxPageHeader.unpack(buffer2.getbuffer())
+  >>> ph3.isWide() and ph3 == ph4 and ph4.numTuples() > 0xFFFF
+  True
+  """
+
+  prefixrepr = struct.Struct("cHHHH")
+  widerepr   = struct.Struct("cHIIH")
+  columnrepr = struct.Struct("HH")
+
+  def __init__(self, **kwargs):
+    buffer            = kwargs.get("buffer", None)
+    self.flags        = kwargs.get("flags", b'\x00')
+    self.tupleSize    = kwargs.get("tupleSize", None)
+    self.tupleCount   = kwargs.get("tupleCount", 0)
+    self.columns      = kwargs.get("columns", None)
+
+    if buffer is None:
+      raise ValueError("No backing buffer supplied for PaxPageHeader")
+
+    if not self.columns:
+      raise ValueError("No column layout supplied for PaxPageHeader")
+
+    self.pageCapacity = kwargs.get("pageCapacity", len(buffer))
+    self.setWide(PageHeader.wideCapacity(self.pageCapacity))
+
+    prefixrepr        = PaxPageHeader.widerepr if self.isWide() else PaxPageHeader.prefixrepr
+    self.binrepr      = struct.Struct(prefixrepr.format + "HH" * len(self.columns))
+    self.size         = self.binrepr.size
+    self.dataSize     = sum(map(lambda c: c[1], self.columns))
+
+    # Precompute minipage offsets, since these only depend on the page capacity.
+    self.columnStarts = []
+    start = self.size
+    for (_, columnSize) in self.columns:
+      self.columnStarts.append(start)
+      start += columnSize * self.tupleCapacity()
+
+    buffer[0:self.size] = self.pack()
+
+  def __eq__(self, other):
+    return (    self.flags == other.flags
+            and self.tupleSize == other.tupleSize
+            and self.pageCapacity == other.pageCapacity
+            and self.tupleCount == other.tupleCount
+            and self.columns == other.columns )
+
+  def __hash__(self):
+    return hash((self.flags, self.tupleSize, self.pageCapacity, self.tupleCount, tuple(self.columns)))
+
+  def headerSize(self):
+    return self.size
+
+  # Returns the maximum number of tuples held by the page.
+  def tupleCapacity(self):
+    return (self.pageCapacity - self.size) // self.dataSize
+
+  # Returns the page offset of the minipage for the given column.
+  def columnStart(self, columnIndex):
+    return self.columnStarts[columnIndex]
+
+  # Returns the page offset of the given column's value for a tuple index.
+  def valueOffset(self, columnIndex, tupleIndex):
+    return self.columnStarts[columnIndex] + tupleIndex * self.columns[columnIndex][1]
+
+  def numTuples(self):
+    return self.tupleCount
+
+  def freeSpace(self):
+    return self.pageCapacity - (self.size + self.usedSpace())
+
+  def usedSpace(self):
+    return self.tupleCount * self.dataSize
+
+  def hasFreeTuple(self):
+    return self.tupleCount < self.tupleCapacity()
+
+  # Returns the tuple index of the next free tuple, allocating it.
+  def nextFreeTuple(self):
+    if not self.hasFreeTuple():
+      return None
+
+    index = self.tupleCount
+    self.tupleCount += 1
+    return index
+
+  def pack(self):
+    columnValues = [v for column in self.columns for v in column]
+    return self.binrepr.pack(
+              self.flags, self.tupleSize, self.tupleCount,
+              self.pageCapacity, len(self.columns), *columnValues)
+
+  @classmethod
+  def unpack(cls, buffer):
+    prefixrepr = cls.widerepr if PageHeader.wideBuffer(buffer) else cls.prefixrepr
+    values     = prefixrepr.unpack_from(buffer)
+    numColumns = values[4]
+    columns    = [cls.columnrepr.unpack_from(buffer, prefixrepr.size + i * cls.columnrepr.size)
+                    for i in range(numColumns)]
+
+    if len(values) == 5:
+      return cls(buffer=buffer, flags=values[0], tupleSize=values[1],
+                 tupleCount=values[2], pageCapacity=values[3], columns=columns)
+
+
+class PaxPage(Page):
+  """
+  A PAX page implementation.
+
+  PAX pages provide the same tuple interface as contiguous pages: tuples are
+  identified by their index in the page, getTuple returns a packed tuple and
+  deletion compacts the page. However, each field is stored in its own minipage,
+  so that a scan over a subset of fields only touches the minipages of those
+  fields via the getColumn method.
+
+  >>> from Catalog.Identifiers import FileId, PageId, TupleId
+  >>> from Catalog.Schema      import DBSchema
+
+  # Test harness setup.
+  >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
+  >>> pId    = PageId(FileId(1), 100)
+  >>> p      = PaxPage(pageId=pId, buffer=bytes(4096), schema=schema)
+
+  # Test page packing and unpacking
+  >>> len(p.pack())
+  4096
+  >>> p2 = PaxPage.unpack(pId, p.pack())
+  >>> p.pageId == p2.pageId
+  True
+  >>> p.header == p2.header
+  True
+
+  # Create and insert a tuple
+  >>> e1 = schema.instantiate(1,25)
+  >>> tId = p.insertTuple(schema.pack(e1))
+  >>> tId.tupleIndex
+  0
+
+  >>> schema.unpack(p.getTuple(tId))
+  employee(id=1, age=25)
+
+  # Update the tuple.
+  >>> p.putTuple(tId, schema.pack(schema.instantiate(1,28)))
+  >>> schema.unpack(p.getTuple(tId))
+  employee(id=1, age=28)
+
+  # Add some more tuples
+  >>> for tup in [schema.pack(schema.instantiate(i, 2*i+20)) for i in range(10)]:
+  ...    _ = p.insertTuple(tup)
+  ...
+
+  >>> p.header.numTuples()
+  11
+
+  # Test iterator
+  >>> [schema.unpack(tup).age for tup in p]
+  [28, 20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
+
+  # Projections read a single minipage.
+  >>> [v[0] for v in struct.iter_unpack('i', p.getColumn(1))]
+  [28, 20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
+
+  # Test clearing of first tuple
+  >>> tId = TupleId(p.pageId, 0)
+  >>> p.clearTuple(tId)
+  >>> schema.unpack(p.getTuple(tId))
+  employee(id=0, age=0)
+
+  # Test removal of first tuple
+  >>> sizeBeforeRemove = p.header.usedSpace()
+  >>> p.deleteTuple(tId)
+
+  >>> [schema.unpack(tup).age for tup in p]
+  [20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
+
+  >>> [v[0] for v in struct.iter_unpack('i', p.getColumn(0))]
+  [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+  >>> p.header.usedSpace() == (sizeBeforeRemove - p.header.dataSize)
+  True
+
+  # Pages survive a round trip through their binary representation.
+  >>> p3 = PaxPage.unpack(pId, bytearray(p.pack()))
+  >>> [schema.unpack(tup).age for tup in p3]
+  [20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
+  """
+
+  __slots__ = ()
+
+  headerClass = PaxPageHeader
+
+  # Tuple operations change values across minipages, and are written as whole pages.
+  tracksChanges = False
+
+  # Header constructor override for PAX pages.
+  def initializeHeader(self, **kwargs):
+    schema = kwargs.get("schema", None)
+    if schema:
+      return PaxPageHeader(buffer=self.getbuffer(), tupleSize=schema.size, columns=schema.fieldLayout())
+    else:
+      raise ValueError("No schema provided when constructing a PAX page.")
+
+  # Tuple iterator, reassembling the tuples present when iteration starts
+  # from views over each column's minipage.
+  def __iter__(self):
+    columns = [self.getColumn(i) for i in range(len(self.header.columns))]
+    for tupleIndex in range(self.header.numTuples()):
+      tupleBytes = bytearray(self.header.tupleSize)
+      for ((rowOffset, columnSize), column) in zip(self.header.columns, columns):
+        start = tupleIndex * columnSize
+        tupleBytes[rowOffset:rowOffset + columnSize] = column[start:start + columnSize]
+      yield bytes(tupleBytes)
+
+  # Returns the reassembled tuples as a single byte string, with their tuple indexes.
+  def tupleBatch(self):
+    tuples = list(self)
+    return (b''.join(tuples), range(len(tuples)))
+
+  # Tuple accessor methods
+
+  # Returns the packed values of a single column for all tuples in the page.
+  def getColumn(self, columnIndex):
+    start = self.header.columnStart(columnIndex)
+    end   = start + self.header.numTuples() * self.header.columns[columnIndex][1]
+    return self.getbuffer()[start:end]
+
+  # Returns a byte string representing a packed tuple for the given tuple id.
+  # The tuple is reassembled from the minipages of each column.
+  def getTuple(self, tupleId):
+    tupleIndex = tupleId.tupleIndex
+    if tupleIndex < 0 or tupleIndex >= self.header.numTuples():
+      return None
+
+    view       = self.getbuffer()
+    tupleBytes = bytearray(self.header.tupleSize)
+    for (i, (rowOffset, columnSize)) in enumerate(self.header.columns):
+      offset = self.header.valueOffset(i, tupleIndex)
+      tupleBytes[rowOffset:rowOffset + columnSize] = view[offset:offset + columnSize]
+
+    return bytes(tupleBytes)
+
+  # Scatters the fields of a packed tuple to their minipages.
+  def writeTuple(self, tupleIndex, tupleData):
+    view = self.getbuffer()
+    for (i, (rowOffset, columnSize)) in enumerate(self.header.columns):
+      offset = self.header.valueOffset(i, tupleIndex)
+      view[offset:offset + columnSize] = tupleData[rowOffset:rowOffset + columnSize]
+
+  # Updates the (packed) tuple at the given tuple id.
+  def putTuple(self, tupleId, tupleData):
+    self.writeTuple(tupleId.tupleIndex, tupleData)
+    self.setDirty(0b1)
+
+  # Adds a packed tuple to the page. Returns the tuple id of the newly added tuple.
+  def insertTuple(self, tupleData):
+    tupleIndex = self.header.nextFreeTuple()
+    if tupleIndex is None:
+      return None
+
+    self.writeTuple(tupleIndex, tupleData)
+    self.setDirty(0b1)
+    return TupleId(self.pageId, tupleIndex)
+
+  # Zeroes out the contents of the tuple at the given tuple id.
+  def clearTuple(self, tupleId):
+    self.writeTuple(tupleId.tupleIndex, bytes(self.header.tupleSize))
+    self.setDirty(0b1)
+
+  # Removes the tuple at the given tuple id, shifting subsequent tuples in every minipage.
+  def deleteTuple(self, tupleId):
+    tupleIndex = tupleId.tupleIndex
+    numTuples  = self.header.numTuples()
+    if tupleIndex < 0 or tupleIndex >= numTuples:
+      return
+
+    view = self.getbuffer()
+    for (i, (_, columnSize)) in enumerate(self.header.columns):
+      start = self.header.valueOffset(i, tupleIndex)
+      end   = self.header.valueOffset(i, numTuples)
+      view[start:end - columnSize] = bytes(view[start + columnSize:end])
+      view[end - columnSize:end]   = bytes(columnSize)
+
+    self.header.tupleCount -= 1
+    self.setDirty(0b1)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,6 +1,5 @@
 import functools, math, struct
 from struct import Struct
-from io     import BytesIO
 
 from Catalog.Identifiers import PageId, FileId, TupleId
 from Catalog.Schema import DBSchema
@@ -83,6 +82,13 @@ class SlottedPageHeader(PageHeader):
   
   >>> ph.freeSpace() < ph.tupleSize
   True
+
+  # Pages larger than 64 KB use a wide header.
+  >>> buffer2 = io.BytesIO(bytes(1 << 17))
+  >>> ph3     = SlottedPageHeader(buffer=buffer2.getbuffer(), tupleSize=16)
+  >>> ph4     = SlottedPageHeader.unpack(buffer2.getbuffer())
+  >>> ph3.isWide() and ph3 == ph4 and ph4.pageCapacity == 1 << 17
+  True
   """
 
   def __init__(self, **kwargs):
@@ -95,13 +101,17 @@ class SlottedPageHeader(PageHeader):
     if buffer == None:
       raise ValueError("No backing buffer supplied for SlottedPageHeader")
 
+    # Pages larger than 64 KB store their offsets as unsigned ints.
+    self.setWide(PageHeader.wideCapacity(self.pageCapacity))
+    prefix = SlottedPageHeader.prefixFormat(self.isWide())
+
     if self.bitmap == None:
-      headerSizeWithoutBitmap = struct.Struct("cHHH").size
+      headerSizeWithoutBitmap = struct.Struct(prefix).size
       tupleCapacity = math.floor((8*(self.pageCapacity-headerSizeWithoutBitmap))/(1+(8*self.tupleSize)))
       bString = '0b' + ('0' * tupleCapacity)
       self.bitmap = BitArray(bString)
    
-    self.binrepr   = struct.Struct("cHHH" + str(math.ceil(len(self.bitmap))) + 's')
+    self.binrepr   = struct.Struct(prefix + str(math.ceil(len(self.bitmap))) + 's')
     self.size      = self.binrepr.size
     self.freeSpaceOffset = self.size
    
@@ -121,6 +131,11 @@ class SlottedPageHeader(PageHeader):
   def headerSize(self):
     return self.size
 
+  # Returns the format of the header fields preceding the slot bitmap.
+  @classmethod
+  def prefixFormat(cls, wide):
+    return "cHII" if wide else "cHHH"
+
   # Flag operations.
   def flag(self, mask):
     return (ord(self.flags) & mask) > 0
@@ -172,19 +187,12 @@ class SlottedPageHeader(PageHeader):
   def resetSlot(self, slotIndex):
     self.setSlot(slotIndex, False)
 
+  # Slot lists scan the bitmap's binary string, rather than indexing individual bits.
   def freeSlots(self):
-    freeList = []
-    for i in range(len(self.bitmap)):
-      if self.bitmap[i] == '0b0':
-        freeList.append(i)
-    return freeList
+    return [i for (i, bit) in enumerate(self.bitmap.bin) if bit == '0']
 
   def usedSlots(self):
-    usedList = []
-    for i in range(len(self.bitmap)):
-      if self.bitmap[i] == '0b1':
-        usedList.append(i)
-    return usedList
+    return [i for (i, bit) in enumerate(self.bitmap.bin) if bit == '1']
 
   # Tuple allocation operations.
   
@@ -243,13 +251,14 @@ class SlottedPageHeader(PageHeader):
   # Create a slotted page header instance from a binary representation held in the given buffer.
   @classmethod
   def unpack(cls, buffer):
-    binrepr1 = struct.Struct("cHHH")
+    prefix = cls.prefixFormat(PageHeader.wideBuffer(buffer))
+    binrepr1 = struct.Struct(prefix)
     values1 = binrepr1.unpack_from(buffer)
 
     headerSizeWithoutBitmap = binrepr1.size
     tupleCapacity = math.floor((8*(values1[3]-headerSizeWithoutBitmap))/(1+(8*values1[1])))
 
-    binrepr2   = struct.Struct("cHHH" + str(math.ceil(tupleCapacity)) + 's')
+    binrepr2   = struct.Struct(prefix + str(math.ceil(tupleCapacity)) + 's')
     values2 = binrepr2.unpack_from(buffer)
 
     bString = '0b' + ('0' * tupleCapacity)
@@ -369,37 +378,35 @@ class SlottedPage(Page):
   >>> p.header.usedSpace() == (sizeBeforeRemove - p.header.tupleSize)
   True
 
+  # Tuple batches skip free slots.
+  >>> (data, slots) = p.tupleBatch()
+  >>> (len(data) == 10 * p.header.tupleSize, slots[:3])
+  (True, [1, 2, 3])
+
+  # Unpacked pages track the changed entries of their slot bitmap, rather than the whole header.
+  >>> p2 = SlottedPage.unpack(pId, p.pack())
+  >>> p2.deleteTuple(TupleId(pId, 3))
+  >>> prefix = p2.header.size - len(p2.header.bitmap)
+  >>> p2.changedRanges() == [(0, prefix), (prefix + 3, prefix + 4)]
+  True
+
   """
 
+  __slots__ = ()
+
   headerClass = SlottedPageHeader
 
   # Slotted page constructor.
   #
-  # REIMPLEMENT this as desired.
-  #
   # Constructors keyword arguments:
-  # buffer       : a byte string of initial page contents.
+  # buffer       : a byte string or writable buffer of initial page contents.
   # pageId       : a PageId instance identifying this page.
   # header       : a SlottedPageHeader instance.
   # schema       : the schema for tuples to be stored in the page.
+  # unpack       : whether to lazily parse the page header from the buffer.
   # Also, any keyword arguments needed to construct a SlottedPageHeader.
   def __init__(self, **kwargs):
-    buffer = kwargs.get("buffer", None)
-    if buffer:
-      BytesIO.__init__(self, buffer)
-      self.pageId = kwargs.get("pageId", None)
-      header      = kwargs.get("header", None)
-      schema      = kwargs.get("schema", None)
-
-      if self.pageId and header:
-        self.header = header
-      elif self.pageId:
-        self.header = self.initializeHeader(**kwargs)
-      else:
-        raise ValueError("No page identifier provided to page constructor.")
-      
-    else:
-      raise ValueError("No backing buffer provided to page constructor.")
+    super().__init__(**kwargs)
 
 
   # Header constructor override for directory pages.
@@ -410,28 +417,26 @@ class SlottedPage(Page):
     else:
       raise ValueError("No schema provided when constructing a slotted page.")
 
-  # Tuple iterator.
+  # Tuple iterator, over the slots in use when iteration starts.
   def __iter__(self):
-    iterTuple = self.header.bitmap.find('0b1')
-    if iterTuple == ():
-      self.iterTupleIdx = -1
-    else:
-      self.iterTupleIdx = iterTuple[0]
-    return self
-
-  def __next__(self):
-
-    t = self.getTuple(TupleId(self.pageId, self.iterTupleIdx))
-    
-    if t:
-      nextTuple = self.header.bitmap.find('0b1', self.iterTupleIdx + 1)
-      if nextTuple == ():
-        self.iterTupleIdx = -1        
-      else:
-        self.iterTupleIdx = nextTuple[0]
-      return t
-    else:
-      raise StopIteration
+    view      = self.getbuffer()
+    tupleSize = self.header.tupleSize
+    for slot in self.header.usedSlots():
+      offset = self.header.offsetOfSlot(slot)
+      yield bytes(view[offset:offset + tupleSize])
+
+  # Returns the packed tuples in use as a single byte string, with their slot indexes.
+  # Pages without free slots before their last tuple are copied in one slice.
+  def tupleBatch(self):
+    view      = self.getbuffer()
+    tupleSize = self.header.tupleSize
+    slots     = self.header.usedSlots()
+    if slots and slots[-1] == len(slots) - 1:
+      start = self.header.offsetOfSlot(0)
+      return (bytes(view[start:start + len(slots) * tupleSize]), slots)
+
+    offsets = map(self.header.offsetOfSlot, slots)
+    return (b''.join([view[offset:offset + tupleSize] for offset in offsets]), slots)
 
   # Tuple accessor methods
 
@@ -448,7 +453,7 @@ class SlottedPage(Page):
 
     view = self.getbuffer()
     offset = tupleIndex * self.header.tupleSize + self.header.size
-    tupleBytes = view[offset: offset + self.header.tupleSize]
+    tupleBytes = bytes(view[offset: offset + self.header.tupleSize])
 
     return tupleBytes
 
@@ -474,6 +479,8 @@ class SlottedPage(Page):
 
     view[offset : offset + self.header.tupleSize] = tupleData
     self.header.bitmap[bitTuple[0]] = '0b1'
+    self.markChanged(offset, offset + self.header.tupleSize)
+    self.markSlotChanged(bitTuple[0])
 
     self.header.setDirty(0b1)
 
@@ -486,8 +493,19 @@ class SlottedPage(Page):
   # Removes the tuple at the given tuple id, shifting subsequent tuples.
   def deleteTuple(self, tupleId):
     self.header.bitmap[tupleId.tupleIndex] = '0b0'
+    self.markSlotChanged(tupleId.tupleIndex)
     self.setDirty(0b1)
 
+  # The header's fixed fields are rewritten with the page, but its slot bitmap
+  # only where slots changed.
+  def headerRanges(self):
+    return [(0, self.header.size - len(self.header.bitmap))]
+
+  # Records the change of a slot's entry in the header's bitmap, packed as a byte per slot.
+  def markSlotChanged(self, slot):
+    offset = self.header.size - len(self.header.bitmap) + slot
+    self.markChanged(offset, offset + 1)
+
   # Returns a binary representation of this page.
   # This should refresh the binary representation of the page header contained
   # within the page by packing the header in place.
@@ -502,14 +520,6 @@ class SlottedPage(Page):
 
     # return super().pack()
 
-  # Creates a Page instance from the binary representation held in the buffer.
-  # The pageId of the newly constructed Page instance is given as an argument.
-  @classmethod
-  def unpack(cls, pageId, buffer):
-    # return super().unpack(pageId, buffer)
-
-    pageHeader = SlottedPageHeader.unpack(buffer)
-    return SlottedPage(pageId=pageId, buffer=buffer, header=pageHeader)
 
 if __name__ == "__main__":
     import doctest
@@ -1,8 +1,10 @@
-import io
+import io, os, time
 
 from Catalog.Schema      import DBSchema
 from Storage.FileManager import FileManager
 from Storage.BufferPool  import BufferPool
+from Storage.WAL         import WriteAheadLog
+from Storage.Checkpointer import Checkpointer
 
 class StorageEngine:
   """
@@ -30,8 +32,125 @@ class StorageEngine:
   >>> [schema.unpack(tup).id for tup in storage.tuples(schema.name)] == list(range(20))
   True
 
+  # Batched table scans yield each page's packed tuples together.
+  >>> batches = list(storage.tuples(schema.name, batch=True))
+  >>> [v[0] for (_, data, _) in batches for v in schema.binrepr.iter_unpack(data)] == list(range(20))
+  True
+
+  # Relations may choose their own page class.
+  >>> from Storage.PaxPage import PaxPage
+  >>> paxSchema = DBSchema('paxemployee', [('id', 'int'), ('age', 'int')])
+  >>> storage.createRelation(paxSchema.name, paxSchema, pageClass=PaxPage)
+  >>> for tup in [paxSchema.pack(paxSchema.instantiate(i, 2*i+20)) for i in range(20)]:
+  ...    _ = storage.insertTuple(paxSchema.name, tup)
+  ...
+  >>> [paxSchema.unpack(tup).age for tup in storage.tuples(paxSchema.name)] == [2*i+20 for i in range(20)]
+  True
+  >>> storage.fileMgr.relationFile(paxSchema.name)[1].pageClass() is PaxPage
+  True
+
+  # Relations may also choose their file class, e.g., for column-oriented storage.
+  >>> from Storage.ColumnarFile import ColumnarFile
+  >>> colSchema = DBSchema('colemployee', [('id', 'int'), ('age', 'int')])
+  >>> storage.createRelation(colSchema.name, colSchema, fileClass=ColumnarFile)
+  >>> for tup in [colSchema.pack(colSchema.instantiate(i, 2*i+20)) for i in range(20)]:
+  ...    _ = storage.insertTuple(colSchema.name, tup)
+  ...
+  >>> [colSchema.unpack(tup).id for tup in storage.tuples(colSchema.name)] == list(range(20))
+  True
+  >>> [v[0] for v in storage.columns(colSchema.name, ['age'])] == [2*i+20 for i in range(20)]
+  True
+  >>> storage.close()
+
+  # With a write-ahead log, tuple operations log redo records for their page changes,
+  # and commit() makes the operations since the last commit durable with one fsync.
+  # Pages are written lazily, on eviction or when the engine is closed.
+  >>> import shutil
+  >>> shutil.rmtree(FileManager.defaultDataDir)
+  >>> storage = StorageEngine(wal=True)
+  >>> storage.createRelation(schema.name, schema)
+  >>> tIds = [storage.insertTuple(schema.name, schema.pack(schema.instantiate(i, 2*i+20))) for i in range(100)]
+  >>> storage.updateTuple(tIds[5], schema.pack(schema.instantiate(5, 99))) == tIds[5]
+  True
+  >>> storage.deleteTuple(tIds[6])
+  >>> storage.commit()
+  >>> storage.wal.stats()['syncs']
+  1
+
+  # The committed changes are only in the log, not in the relation's pages on disk.
+  >>> f = storage.fileMgr.relationFile(schema.name)[1]
+  >>> f.readPageHeader(f.pageId(0)).numTuples()
+  0
+
+  # Simulate a crash, losing an uncommitted insert. Opening the storage engine
+  # recovers the committed changes by replaying the log.
+  >>> _ = storage.insertTuple(schema.name, schema.pack(schema.instantiate(100, 0)))
+  >>> os.close(storage.wal.fd)
+  >>> storage = StorageEngine(wal=True)
+  >>> ages = [schema.unpack(tup).age for tup in storage.tuples(schema.name)]
+  >>> (len(ages), ages[5], 32 in ages)
+  (99, 99, False)
+  >>> storage.fileMgr.relationFile(schema.name)[1].numTuples()
+  99
+
+  # Closing the storage engine writes all pages, and empties the log.
+  >>> storage.close()
+  >>> storage.wal.isEmpty()
+  True
+  >>> storage = StorageEngine(wal=True)
+  >>> len(list(storage.tuples(schema.name)))
+  99
+  >>> storage.close()
+  >>> shutil.rmtree(FileManager.defaultDataDir)
+
+  # The durability mode controls when files are synced to disk. By default, each commit
+  # is durable. Other modes sync files on checkpoints, on close, or never.
+  >>> storage = StorageEngine(durability="fsyncOnCheckpoint")
+  >>> storage.createRelation(schema.name, schema)
+  >>> for i in range(10):
+  ...   _ = storage.insertTuple(schema.name, schema.pack(schema.instantiate(i, 2*i+20)))
+  ...   storage.commit()
+  >>> storage.durabilityStats()['fileSyncs']
+  0
+
+  # The checkpoint syncs the file's header, marked as unclean, before writing its pages,
+  # and then syncs the pages, followed by the header with the file's counts.
+  >>> storage.checkpoint()
+  >>> stats = storage.durabilityStats()
+  >>> (stats['commits'], stats['fileSyncs'], stats['catalogSyncs'])
+  (10, 3, 1)
+  >>> storage.close()
+  >>> shutil.rmtree(FileManager.defaultDataDir)
+
+  >>> StorageEngine(durability="always")
+  Traceback (most recent call last):
+  ...
+  ValueError: Unknown durability mode: always
   """
 
+  # The write-ahead log is kept in the primary data directory.
+  walFile = "db.wal"
+
+  # Durability modes, from weakest to strongest:
+  # none              : files are never synced, leaving writes to the operating system.
+  # flushOnClose      : files are synced when the storage engine is closed.
+  # fsyncOnCheckpoint : files are also synced by checkpoints, which write all dirty pages.
+  # fsyncPerCommit    : each commit is durable, syncing the write-ahead log if there is
+  #                     one, and otherwise writing all dirty pages and syncing the files.
+  durabilityModes   = ("none", "flushOnClose", "fsyncOnCheckpoint", "fsyncPerCommit")
+  defaultDurability = "fsyncPerCommit"
+
+  # Storage engine constructor.
+  #
+  # Constructor keyword arguments, with defaults if not present:
+  # pageSize, poolSize, compressedCacheSize : buffer pool options
+  # datadirs, placement : file manager options
+  # wal             : whether to log page changes to a write-ahead log, making committed
+  #                   tuple operations durable without writing their pages.
+  # groupCommitSize : the number of buffered log bytes after which the log is committed.
+  # walSegmentSize  : the size of the log's segment files.
+  # checkpointLogSize, checkpointPages : checkpointer options, see Checkpointer.
+  # durability      : the durability mode, see durabilityModes.
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
@@ -39,15 +158,166 @@ class StorageEngine:
 
     else:
       pageSize = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
-      self.bufferPool = BufferPool(pageSize=pageSize)
-      self.fileMgr    = FileManager(pageSize=pageSize, bufferPool=self.bufferPool)
+      poolSize = kwargs.get("poolSize", BufferPool.defaultPoolSize)
+      compressedCacheSize = kwargs.get("compressedCacheSize", BufferPool.defaultCompressedCacheSize)
+      datadirs  = kwargs.get("datadirs", None)
+      placement = kwargs.get("placement", FileManager.defaultPlacement)
+
+      self.durability = kwargs.get("durability", StorageEngine.defaultDurability)
+      self.commits    = 0
+      if self.durability not in StorageEngine.durabilityModes:
+        raise ValueError("Unknown durability mode: " + str(self.durability))
+
+      self.bufferPool = BufferPool(pageSize=pageSize, poolSize=poolSize, compressedCacheSize=compressedCacheSize)
+      self.fileMgr    = FileManager(pageSize=pageSize, bufferPool=self.bufferPool, datadirs=datadirs, placement=placement,
+                                    durable=self.syncsOn("checkpoint"))
 
       if self.fileMgr:
         self.bufferPool.setFileManager(self.fileMgr)
 
+      self.wal           = None
+      self.checkpointer  = None
+      self.recoveryStats = None
+      if kwargs.get("wal", False):
+        groupCommitSize = kwargs.get("groupCommitSize", WriteAheadLog.defaultGroupCommitSize)
+        segmentSize     = kwargs.get("walSegmentSize", WriteAheadLog.defaultSegmentSize)
+        self.wal = WriteAheadLog(filePath=os.path.join(self.fileMgr.datadir, StorageEngine.walFile),
+                                 groupCommitSize=groupCommitSize, segmentSize=segmentSize,
+                                 syncOnCommit=self.syncsOn("commit"))
+        self.recover()
+        self.bufferPool.setWriteAheadLog(self.wal)
+
+        checkpointLogSize = kwargs.get("checkpointLogSize", Checkpointer.defaultCheckpointLogSize)
+        checkpointPages   = kwargs.get("checkpointPages", Checkpointer.defaultCheckpointPages)
+        self.checkpointer = Checkpointer(bufferPool=self.bufferPool, fileMgr=self.fileMgr, wal=self.wal,
+                                         checkpointLogSize=checkpointLogSize, checkpointPages=checkpointPages,
+                                         durable=self.syncsOn("checkpoint"))
+
   def fromOther(self, other):
-    self.bufferPool = other.bufferPool
-    self.fileMgr    = other.fileMgr
+    self.bufferPool    = other.bufferPool
+    self.fileMgr       = other.fileMgr
+    self.wal           = other.wal
+    self.checkpointer  = other.checkpointer
+    self.recoveryStats = other.recoveryStats
+    self.durability    = other.durability
+    self.commits       = other.commits
+
+  # Returns whether the durability mode syncs files on the given event, one of
+  # 'commit', 'checkpoint' or 'close'.
+  def syncsOn(self, event):
+    events = {"commit": 3, "checkpoint": 2, "close": 1}
+    return StorageEngine.durabilityModes.index(self.durability) >= events[event]
+
+  # Ends a batch of tuple operations, and then takes a checkpoint step if there is a
+  # write-ahead log. In the fsyncPerCommit mode, this makes the batch durable, by syncing
+  # the write-ahead log (and any catalog changes the batch depends on), or without a log,
+  # by writing all dirty pages and syncing the files, along with their saved counts (and
+  # the indexes of compressed files). In other modes, the batch's log records are written
+  # to the log without syncing it.
+  def commit(self):
+    self.commits += 1
+    durable = self.syncsOn("commit")
+    if self.wal:
+      if durable:
+        self.fileMgr.syncLog()
+      self.wal.commit(sync=durable)
+      self.checkpointer.step()
+    elif durable:
+      self.bufferPool.clear()
+      self.fileMgr.sync()
+
+  # Writes all dirty pages, so that recovery has no log to replay, syncing them unless
+  # the durability mode syncs files only on close. With a write-ahead log, this runs a
+  # fuzzy checkpoint to completion.
+  def checkpoint(self):
+    if self.wal:
+      self.checkpointer.run()
+    else:
+      self.bufferPool.clear()
+      if self.syncsOn("checkpoint"):
+        self.fileMgr.sync()
+
+  # Writes all pages and closes all files, syncing them unless the durability mode
+  # never syncs. Since every logged change is then written, the write-ahead log is emptied.
+  def close(self):
+    self.bufferPool.clear()
+    if self.syncsOn("close"):
+      self.fileMgr.sync()
+    if self.wal:
+      self.wal.truncate()
+    self.fileMgr.close(sync=self.syncsOn("close"))
+    if self.wal:
+      self.wal.close()
+
+  # Returns the durability mode, and counts of commits and of syncs issued for the
+  # storage files, the catalog log and the write-ahead log.
+  def durabilityStats(self):
+    fileStats = self.fileMgr.fileStats()
+    return {
+        'durability'   : self.durability,
+        'commits'      : self.commits,
+        'fileSyncs'    : fileStats['fileSyncs'],
+        'catalogSyncs' : fileStats['logSyncs'],
+        'logSyncs'     : self.wal.syncs if self.wal else 0
+      }
+
+  # Redoes the page changes held in the write-ahead log (e.g., after a crash), by
+  # replaying its records in order through the buffer pool. Records for removed
+  # relations are skipped, and truncation records truncate their file again, discarding
+  # the pages recovered from earlier records. The recovered pages are written (and synced,
+  # if the durability mode syncs checkpoints), the state of each recovered file is rebuilt
+  # from its pages, and the log is emptied.
+  #
+  # The log holds the records following the last checkpoint's recovery start point,
+  # and possibly some earlier records in the same segment. Replaying those is harmless,
+  # since each record sets bytes to their contents at the time of the record, and any
+  # later changes to the page are also replayed.
+  #
+  # The number of records and pages replayed, and the time taken, are kept in 'recoveryStats'.
+  def recover(self):
+    start = time.perf_counter()
+    self.recoveryStats = {'records': 0, 'pages': 0, 'time': 0.0}
+    if self.wal.isEmpty():
+      return
+
+    recovered = {}
+    pages     = set()
+    for (_, pageId, offset, data) in self.wal.records():
+      rFile = self.fileMgr.storageFile(pageId.fileId)
+      if rFile is None:
+        continue
+
+      # Recovered pages need not be on disk yet, and are discarded separately.
+      if offset == WriteAheadLog.truncateOffset:
+        for pId in [p for p in pages if p.fileId == pageId.fileId and p.pageIndex >= pageId.pageIndex]:
+          self.bufferPool.discardPage(pId)
+        if pageId.pageIndex < rFile.numPages():
+          rFile.truncate(pageId.pageIndex)
+        recovered[pageId.fileId] = rFile
+        self.recoveryStats['records'] += 1
+        continue
+
+      page = self.bufferPool.getPage(pageId)
+      page.getbuffer()[offset : offset + len(data)] = data
+
+      # The page must be flushed, even if it was already written before the record was.
+      page = rFile.pageClass().unpack(pageId, page.getbuffer())
+      if not page.header.isDirty():
+        page.setDirty(True)
+        page.pack()
+      recovered[pageId.fileId] = rFile
+      pages.add(pageId)
+      self.recoveryStats['records'] += 1
+
+    self.bufferPool.clear()
+    for rFile in recovered.values():
+      rFile.recount()
+    if self.syncsOn("checkpoint"):
+      self.fileMgr.sync()
+    self.wal.truncate()
+
+    self.recoveryStats['pages'] = len(pages)
+    self.recoveryStats['time']  = time.perf_counter() - start
 
   # Data definition operations
 
@@ -59,9 +329,11 @@ class StorageEngine:
     if self.fileMgr:
       return self.fileMgr.hasRelation(relId)
 
-  def createRelation(self, relId, schema):
+  # Creates a relation, with any storage options (e.g., fileClass or pageClass)
+  # passed through to the file manager.
+  def createRelation(self, relId, schema, **kwargs):
     if self.fileMgr:
-      self.fileMgr.createRelation(relId, schema)
+      self.fileMgr.createRelation(relId, schema, **kwargs)
     else:
       raise ValueError("Could not create relation, no file manager found")
 
@@ -88,20 +360,27 @@ class StorageEngine:
 
   def updateTuple(self, tupleId, tupleData):
     if self.fileMgr:
-      self.fileMgr.updateTuple(tupleId, tupleData)
+      return self.fileMgr.updateTuple(tupleId, tupleData)
     else:
       raise ValueError("Could not update tuple, no file manager found")
 
-  # Tuple-based table scan
-  def tuples(self, relId):
+  # Tuple-based table scan.
+  # With 'batch' set, yields (page id, packed tuples, tuple indexes) for each page instead,
+  # where the packed tuples may be decoded with the schema's binrepr.iter_unpack.
+  def tuples(self, relId, batch=False):
     if self.fileMgr:
-      return self.fileMgr.tuples(relId)
+      return self.fileMgr.tuples(relId, batch)
 
   # Page-based table scan
   def pages(self, relId):
     if self.fileMgr:
       return self.fileMgr.pages(relId)
 
+  # Column-based table scan, yielding a tuple of the given fields' values per tuple.
+  def columns(self, relId, fields):
+    if self.fileMgr:
+      return self.fileMgr.columns(relId, fields)
+
 
 if __name__ == "__main__":
     import doctest
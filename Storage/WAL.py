@@ -0,0 +1,410 @@
+import os, struct, threading, zlib
+
+from Catalog.Identifiers import FileId, PageId
+
+class WriteAheadLog:
+  """
+  A write-ahead log of physical redo records for page changes.
+
+  Each redo record holds the new contents of a byte range of a page, and is identified
+  by a log sequence number (LSN). The first change to a page since it was last written
+  to disk logs the whole page, and later changes log only the range of bytes they modify.
+  Redo records are therefore independent of the page contents on disk, and replaying
+  them in order reproduces the latest logged contents of each page.
+
+  The log is split into segment files, named after the log's file path and the LSN of
+  each segment's first record. A new segment is started once the current one exceeds
+  'segmentSize' bytes, and segments whose records are no longer needed for recovery
+  (e.g., after a checkpoint) are discarded whole.
+
+  Records are appended to an in-memory buffer, and written to the log on commit.
+  Commits are grouped: a commit writes all buffered records with a single fsync, so
+  that one fsync covers the operations of many commits (including those of concurrent
+  committers waiting for the same fsync). The log's lock is not held during the fsync,
+  so that records are appended and written while it proceeds. Records are also committed
+  automatically once 'groupCommitSize' bytes are buffered. With 'syncOnCommit' unset,
+  commits only write records to the log, and records are made durable by an explicit sync.
+
+  Besides page changes, the log records the truncation of files, so that recovery does not
+  restore the truncated pages from earlier records.
+
+  A page must not be written to disk before the redo records of its changes are durable.
+  The buffer pool ensures this by committing the log up to a page's latest LSN before
+  flushing the page.
+
+  Each record is a struct with the following components, followed by the range's bytes:
+  i.   a CRC32 checksum of the remainder of the record, to detect incomplete records
+  ii.  the record's LSN, as an unsigned long long
+  iii. the file and page index of the page
+  iv.  the offset and length of the byte range within the page
+
+  Truncation records have no bytes, hold the number of remaining pages as their page
+  index, and have an offset of 'truncateOffset'.
+
+  >>> import shutil
+  >>> os.makedirs('wal.test', exist_ok=True)
+  >>> wal = WriteAheadLog(filePath=os.path.join('wal.test', 'wal.log'))
+  >>> pId = PageId(FileId(3), 7)
+
+  # Only the changed ranges of a page are logged. Ranges separated by only a few
+  # unchanged bytes are merged.
+  >>> old = bytes(4096); new = bytearray(old); new[10:12] = b'ab'; new[3000:3008] = b'abcdefgh'
+  >>> WriteAheadLog.changedRanges(old, new)
+  [(10, 12), (3000, 3008)]
+  >>> new[14] = 1
+  >>> WriteAheadLog.changedRanges(old, new)
+  [(10, 15), (3000, 3008)]
+  >>> WriteAheadLog.changedRanges(old, old)
+  []
+  >>> WriteAheadLog.changedRanges(old, new, [(2048, 4096)])
+  [(3000, 3008)]
+
+  >>> lsns = [wal.append(pId, 0, new), wal.append(pId, 10, b'cd')]
+  >>> (lsns, wal.flushedLSN)
+  ([1, 2], 0)
+  >>> wal.commit()
+  >>> (wal.flushedLSN, wal.stats()['syncs'])
+  (2, 1)
+
+  # Committing again without new records does not sync.
+  >>> wal.commit(); wal.stats()['syncs']
+  1
+
+  # Commits may also write records without syncing them, until a later sync.
+  >>> _ = wal.append(pId, 30, b'ab'); wal.commit(sync=False)
+  >>> (wal.flushedLSN, wal.stats()['syncs'])
+  (3, 1)
+  >>> wal.commit(sync=True); wal.stats()['syncs']
+  2
+
+  # Records are read back in order, ignoring an incomplete final record.
+  >>> _ = wal.append(pId, 20, b'ef'); wal.commit()
+  >>> with open(wal.segmentPath(wal.segments[-1]), 'ab') as f:
+  ...   _ = f.write(b'partial record')
+  >>> wal.close()
+  >>> wal = WriteAheadLog(filePath=os.path.join('wal.test', 'wal.log'))
+  >>> [(lsn, p == pId, offset, bytes(data)) for (lsn, p, offset, data) in wal.records()][1:]
+  [(2, True, 10, b'cd'), (3, True, 30, b'ab'), (4, True, 20, b'ef')]
+  >>> wal.append(pId, 0, b'gh')
+  5
+
+  # Applying the records reproduces the page.
+  >>> page = bytearray(64)
+  >>> for (_, _, offset, data) in wal.records():
+  ...   page[offset:offset + len(data)] = data
+  >>> bytes(page[10:12]), bytes(page[20:22])
+  (b'cd', b'ef')
+  >>> wal.close()
+
+  # Segments are started as the log grows, and discarded once their records precede
+  # a given LSN. Truncating the whole log starts a new segment.
+  >>> wal = WriteAheadLog(filePath=os.path.join('wal.test', 'wal.log'), segmentSize=256)
+  >>> for i in range(20):
+  ...   _ = wal.append(pId, 0, bytes(40)); wal.commit()
+  >>> (wal.segments, sorted(os.listdir('wal.test'))[:2])
+  ([1, 7, 11, 15, 19, 23], ['wal.log.1', 'wal.log.11'])
+  >>> wal.truncate(13)
+  >>> (wal.segments, next(wal.records())[0])
+  ([11, 15, 19, 23], 11)
+  >>> wal.truncate()
+  >>> (wal.segments, wal.isEmpty(), wal.append(pId, 0, b'ij'))
+  ([26], True, 26)
+
+  # File truncations are logged with the number of remaining pages.
+  >>> wal.appendTruncation(pId.fileId, 2); wal.commit()
+  27
+  >>> [(p.pageIndex, offset == WriteAheadLog.truncateOffset, bytes(data)) for (_, p, offset, data) in wal.records()]
+  [(7, False, b'ij'), (2, True, b'')]
+  >>> wal.close()
+  >>> shutil.rmtree('wal.test')
+  """
+
+  recordrepr = struct.Struct("=IQHIII")
+
+  # The offset of truncation records.
+  truncateOffset = 0xFFFFFFFF
+
+  # Commit buffered records automatically beyond 1 MB.
+  defaultGroupCommitSize = 1 << 20
+
+  # Start a new log segment beyond 16 MB.
+  defaultSegmentSize = 16 << 20
+
+  # Write-ahead log constructor.
+  #
+  # Constructor keyword arguments:
+  # filePath        : the path prefix of the log's segment files, which are created if
+  #                   they do not exist.
+  # groupCommitSize : the number of buffered bytes after which records are committed.
+  # segmentSize     : the number of bytes after which a new log segment is started.
+  # syncOnCommit    : whether commits sync the log by default, making records durable.
+  def __init__(self, **kwargs):
+    self.filePath        = kwargs.get("filePath", None)
+    self.groupCommitSize = kwargs.get("groupCommitSize", WriteAheadLog.defaultGroupCommitSize)
+    self.segmentSize     = kwargs.get("segmentSize", WriteAheadLog.defaultSegmentSize)
+    self.syncOnCommit    = kwargs.get("syncOnCommit", True)
+
+    if self.filePath is None:
+      raise ValueError("No file path found when initializing a write-ahead log")
+
+    self.fd     = None
+    self.buffer = bytearray()
+    self.lock   = threading.Lock()
+
+    # Syncs are serialized by their own lock, which appenders do not take.
+    self.syncLock = threading.Lock()
+
+    # Whether the current segment has writes that are not yet synced, and the earlier
+    # segments and directory changes (i.e., new segment files) not yet synced.
+    self.unsynced          = False
+    self.unsyncedSegments  = set()
+    self.unsyncedDirectory = False
+
+    # The first LSN of each log segment, in order. A new log starts with an empty segment.
+    self.segments = self.existingSegments()
+    if not self.segments:
+      self.segments = [1]
+      os.close(os.open(self.segmentPath(1), os.O_RDWR | os.O_CREAT, 0o644))
+
+    # The log ends after its last complete record, and LSNs continue from that record.
+    # Any incomplete record, and any segments following it, are removed.
+    (lastLSN, lastSegment, logEnd) = (None, self.segments[0], 0)
+    for (lsn, _, _, _, segment, end) in self.scan():
+      (lastLSN, lastSegment, logEnd) = (lsn, segment, end)
+
+    for segment in self.segments[self.segments.index(lastSegment) + 1:]:
+      os.remove(self.segmentPath(segment))
+    self.segments = self.segments[:self.segments.index(lastSegment) + 1]
+
+    self.fd = os.open(self.segmentPath(lastSegment), os.O_RDWR | os.O_CREAT, 0o644)
+    if logEnd < os.fstat(self.fd).st_size:
+      os.ftruncate(self.fd, logEnd)
+
+    self.logEnd     = logEnd
+    self.nextLSN    = lastSegment if lastLSN is None else lastLSN + 1
+    self.flushedLSN = self.nextLSN - 1
+    self.syncedLSN  = self.flushedLSN
+
+    # Log statistics.
+    self.recordsLogged = 0
+    self.bytesLogged   = 0
+    self.syncs         = 0
+
+  # Segment helpers
+
+  def segmentPath(self, segment):
+    return self.filePath + "." + str(segment)
+
+  # Returns the first LSNs of the log's existing segment files, in order.
+  def existingSegments(self):
+    (logDir, prefix) = os.path.split(self.filePath)
+    prefix += "."
+    return sorted(int(name[len(prefix):]) for name in os.listdir(logDir or ".")
+                  if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+  # Starts a new segment at the next LSN. The previous segment's unsynced writes, and
+  # the new segment file's directory entry, are synced by the next sync.
+  def rotate(self):
+    if self.unsynced:
+      self.unsyncedSegments.add(self.segments[-1])
+
+    os.close(self.fd)
+    self.fd     = os.open(self.segmentPath(self.nextLSN), os.O_RDWR | os.O_CREAT, 0o644)
+    self.logEnd = 0
+    self.segments.append(self.nextLSN)
+
+    self.unsynced          = False
+    self.unsyncedDirectory = True
+
+  def close(self):
+    if self.fd is not None:
+      self.commit()
+      os.close(self.fd)
+      self.fd = None
+
+  # Changed ranges separated by fewer unchanged bytes than this are merged.
+  rangeGap = 32
+
+  # Returns the ranges of bytes, as (start, end) offsets, that differ between two buffers
+  # of the same length. Differences are located by recursive bisection over slice
+  # comparisons, rather than byte by byte, so that few changes are found quickly.
+  # Only the given sorted ranges are compared, if any (e.g., a page's changed ranges).
+  @classmethod
+  def changedRanges(cls, old, new, within=None):
+    (old, new) = (bytes(old), bytes(new))
+    ranges = []
+    for (start, end) in (within if within is not None else [(0, len(new))]):
+      cls.bisectRanges(old, new, start, end, ranges)
+    return ranges
+
+  @classmethod
+  def bisectRanges(cls, old, new, start, end, ranges):
+    if old[start:end] == new[start:end]:
+      return
+
+    if end - start <= cls.rangeGap:
+      while old[start] == new[start]:
+        start += 1
+      while old[end - 1] == new[end - 1]:
+        end -= 1
+      if ranges and start - ranges[-1][1] < cls.rangeGap:
+        ranges[-1] = (ranges[-1][0], end)
+      else:
+        ranges.append((start, end))
+      return
+
+    mid = (start + end) // 2
+    cls.bisectRanges(old, new, start, mid, ranges)
+    cls.bisectRanges(old, new, mid, end, ranges)
+
+  # Appends a redo record for the given bytes at an offset in a page, returning its LSN.
+  def append(self, pageId, offset, data):
+    with self.lock:
+      lsn  = self.nextLSN
+      body = self.recordrepr.pack(0, lsn, pageId.fileId.fileIndex, pageId.pageIndex, offset, len(data))[4:]
+      crc  = zlib.crc32(data, zlib.crc32(body))
+      self.buffer += struct.pack("=I", crc) + body
+      self.buffer += data
+
+      self.nextLSN       += 1
+      self.recordsLogged += 1
+      self.bytesLogged   += self.recordrepr.size + len(data)
+      groupFull = len(self.buffer) >= self.groupCommitSize
+
+    if groupFull:
+      self.commit()
+    return lsn
+
+  # Appends a record of the truncation of a file to the given number of pages, returning its LSN.
+  def appendTruncation(self, fileId, pageCount):
+    return self.append(PageId(fileId, pageCount), WriteAheadLog.truncateOffset, b'')
+
+  # Writes all records up to the given LSN (by default, all appended records) to the log,
+  # and makes them durable if 'sync' is set (by default, if 'syncOnCommit' is set).
+  # Committers arriving while another commit syncs wait for it, and return without
+  # syncing if it covered their records.
+  def commit(self, lsn=None, sync=None):
+    sync = self.syncOnCommit if sync is None else sync
+    with self.lock:
+      lsn = self.nextLSN - 1 if lsn is None else lsn
+      if lsn > self.flushedLSN:
+        os.pwrite(self.fd, self.buffer, self.logEnd)
+        self.logEnd    += len(self.buffer)
+        self.flushedLSN = self.nextLSN - 1
+        self.buffer     = bytearray()
+        self.unsynced   = True
+
+      if self.logEnd >= self.segmentSize:
+        self.rotate()
+
+    if sync:
+      self.sync(lsn)
+
+  # Syncs the written records up to the given LSN (by default, all written records) to
+  # disk, with fdatasync where available. Only the log's contents need to be durable,
+  # rather than other file metadata such as timestamps.
+  #
+  # The log's lock is only held to find the descriptors to sync, and to record the last
+  # synced LSN once they are synced. A sync covers all records written when it starts,
+  # and syncs wait for each other, so that a sync returns without syncing if an earlier
+  # one covered its records.
+  def sync(self, lsn=None):
+    with self.syncLock:
+      with self.lock:
+        lsn = self.flushedLSN if lsn is None else lsn
+        if lsn <= self.syncedLSN:
+          return
+
+        syncedLSN = self.flushedLSN
+        fds = [os.open(self.segmentPath(segment), os.O_RDONLY) for segment in sorted(self.unsyncedSegments)]
+        if self.unsynced:
+          fds.append(os.dup(self.fd))
+        dirFd = os.open(os.path.dirname(self.filePath) or ".", os.O_RDONLY) if self.unsyncedDirectory else None
+
+        self.unsyncedSegments.clear()
+        self.unsynced          = False
+        self.unsyncedDirectory = False
+
+      try:
+        if dirFd is not None:
+          os.fsync(dirFd)
+        for fd in fds:
+          getattr(os, "fdatasync", os.fsync)(fd)
+      finally:
+        for fd in fds + ([dirFd] if dirFd is not None else []):
+          os.close(fd)
+
+      with self.lock:
+        self.syncedLSN = max(self.syncedLSN, syncedLSN)
+        self.syncs    += len(fds)
+
+  # Discards the segments holding only records before the given LSN, once their changes
+  # have been written to disk (e.g., after a checkpoint). Without an LSN, all records are
+  # discarded (e.g., on a clean shutdown), and a new segment is started. LSNs continue
+  # to increase.
+  def truncate(self, lsn=None):
+    with self.lock:
+      if lsn is None:
+        self.buffer     = bytearray()
+        self.flushedLSN = self.nextLSN - 1
+        self.syncedLSN  = self.flushedLSN
+        if self.logEnd > 0:
+          self.rotate()
+        lsn = self.nextLSN
+
+      while len(self.segments) > 1 and self.segments[1] <= lsn:
+        segment = self.segments.pop(0)
+        self.unsyncedSegments.discard(segment)
+        os.remove(self.segmentPath(segment))
+
+  # Returns whether the log holds no records.
+  def isEmpty(self):
+    return len(self.segments) == 1 and self.logEnd == 0 and not self.buffer
+
+  # Returns the number of bytes in the log's segments.
+  def size(self):
+    return sum(os.path.getsize(self.segmentPath(s)) for s in self.segments[:-1]) + self.logEnd
+
+  # Scans the complete records in the log's segments, yielding each record's LSN, page id,
+  # offset within the page, data, segment, and end offset in the segment.
+  def scan(self):
+    header = self.recordrepr.size
+    for segment in list(self.segments):
+      fd = os.open(self.segmentPath(segment), os.O_RDONLY)
+      try:
+        offset = 0
+        while True:
+          prefix = os.pread(fd, header, offset)
+          if len(prefix) < header:
+            break
+
+          (crc, lsn, fileIndex, pageIndex, pageOffset, length) = self.recordrepr.unpack(prefix)
+          data = os.pread(fd, length, offset + header)
+          if len(data) < length or zlib.crc32(data, zlib.crc32(prefix[4:])) != crc:
+            return
+
+          offset += header + length
+          yield (lsn, PageId(FileId(fileIndex), pageIndex), pageOffset, data, segment, offset)
+      finally:
+        os.close(fd)
+
+  # Redo record iterator, yielding each record's LSN, page id, offset and data,
+  # starting from the given LSN.
+  def records(self, start=0):
+    for (lsn, pageId, offset, data, _, _) in self.scan():
+      if lsn >= start:
+        yield (lsn, pageId, offset, data)
+
+  def stats(self):
+    return {
+        'records'    : self.recordsLogged,
+        'bytes'      : self.bytesLogged,
+        'syncs'      : self.syncs,
+        'segments'   : len(self.segments),
+        'flushedLSN' : self.flushedLSN
+      }
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,274 @@
+from Storage.StorageEngine import StorageEngine
+from Storage.Page import Page
+from Storage.File import StorageFile
+from Storage.CompressedFile import CompressedStorageFile
+from Storage.ColumnarFile import ColumnarFile
+from Storage.DirectFile import DirectStorageFile
+from Catalog.Schema import DBSchema
+
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# A schema to work with
+schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
+
+# The file classes and durability modes under test.
+fileClasses     = [StorageFile, CompressedStorageFile, ColumnarFile, DirectStorageFile]
+durabilityModes = list(StorageEngine.durabilityModes)
+
+# The repository root, from which child processes import the storage engine.
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Make packed employees, with consecutive ids
+def makeEmployees(start, n):
+  return [schema.pack(schema.instantiate(i, 25 + i)) for i in range(start, start + n)]
+
+# Crashes kill the child process, without closing the storage engine, but leave the
+# operating system's writes intact. The functions below run in child processes.
+
+# Opens the storage engine (with any further engine options), inserts and commits tuples,
+# then inserts further tuples without committing them, and exits as if killed.
+def crash(durability, wal, committed, uncommitted, options=None):
+  storage = StorageEngine(durability=durability, wal=wal, **(options or {}))
+  start   = storage.fileMgr.relationFile(schema.name)[1].numTuples()
+  for tup in makeEmployees(start, committed):
+    storage.insertTuple(schema.name, tup)
+  storage.commit()
+
+  for tup in makeEmployees(start + committed, uncommitted):
+    storage.insertTuple(schema.name, tup)
+  os._exit(0)
+
+# Inserts and commits tuples, then updates and deletes some of them in place (so that
+# pages are written partially), commits, and exits as if killed. Tuples are deleted
+# last to first, since deletes may move the following tuples of a page.
+def crashUpdate(durability, wal):
+  storage = StorageEngine(durability=durability, wal=wal)
+  tIds    = [storage.insertTuple(schema.name, tup) for tup in makeEmployees(0, 2000)]
+  storage.commit()
+
+  for i in range(0, len(tIds), 10):
+    storage.updateTuple(tIds[i], schema.pack(schema.instantiate(i, 0)))
+  for i in reversed(range(1, len(tIds), 10)):
+    storage.deleteTuple(tIds[i])
+  storage.commit()
+  os._exit(0)
+
+# Creates another relation, inserts and commits tuples into it, and exits as if killed.
+def crashCreate(durability, wal):
+  storage = StorageEngine(durability=durability, wal=wal)
+  storage.createRelation('department', schema, pageClass=Page)
+  for tup in makeEmployees(0, 10):
+    storage.insertTuple('department', tup)
+  storage.commit()
+  os._exit(0)
+
+# Inserts tuples filling several pages, and writes all but the first two pages, whose
+# changes keep the log's records. Then truncates the relation to its first two pages,
+# and inserts and commits a few more tuples before exiting as if killed.
+def crashTruncate(durability, wal):
+  storage = StorageEngine(durability=durability, wal=wal)
+  for tup in makeEmployees(0, 5000):
+    storage.insertTuple(schema.name, tup)
+  storage.commit()
+
+  f = storage.fileMgr.relationFile(schema.name)[1]
+  for pageIndex in range(2, f.numPages()):
+    storage.bufferPool.flushPage(f.pageId(pageIndex))
+  f.truncate(2)
+  for tup in makeEmployees(5000, 5):
+    storage.insertTuple(schema.name, tup)
+  storage.commit()
+  os._exit(0)
+
+class CrashTests(unittest.TestCase):
+  # Each test runs in its own directory, holding the default data directory.
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.mkdtemp()
+    os.chdir(self.dir)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir)
+
+  # Utils:
+  def createRelation(self, fileClass, durability, wal, n, **kwargs):
+    storage = StorageEngine(durability=durability, wal=wal)
+    storage.createRelation(schema.name, schema, fileClass=fileClass, pageClass=Page, **kwargs)
+    for tup in makeEmployees(0, n):
+      storage.insertTuple(schema.name, tup)
+    storage.close()
+    self.checkSyncs(storage)
+
+  # Storage files are never synced in the 'none' durability mode.
+  def checkSyncs(self, storage):
+    if storage.durability == 'none':
+      self.assertEqual(storage.durabilityStats()['fileSyncs'], 0)
+
+  # Runs one of the functions above in a child process.
+  def crash(self, function, *args):
+    code = "from Tests.CrashTest import %s; %s%r" % (function.__name__, function.__name__, args)
+    env  = dict(os.environ, PYTHONPATH=repoDir)
+    subprocess.run([sys.executable, '-c', code], cwd=self.dir, env=env, check=True)
+
+  # Reopens the storage engine, returning a relation's tuple count and its scanned tuples.
+  def reopenTuples(self, durability, wal, relId=schema.name):
+    storage = StorageEngine(durability=durability, wal=wal)
+    count   = storage.fileMgr.relationFile(relId)[1].numTuples()
+    tuples  = sorted(schema.unpack(tup) for tup in storage.tuples(relId))
+    storage.close()
+    self.checkSyncs(storage)
+    return (count, tuples)
+
+  # Reopens the storage engine, returning the relation's tuple count and the ids scanned.
+  def reopen(self, durability, wal):
+    (count, tuples) = self.reopenTuples(durability, wal)
+    return (count, [tup.id for tup in tuples])
+
+  # Runs a check for each combination of arguments, in a fresh data directory.
+  def checkEach(self, check, *argLists):
+    for args in itertools.product(*argLists):
+      with self.subTest(args=args):
+        shutil.rmtree('data', ignore_errors=True)
+        check(*args)
+
+  # Returns whether commits survive a crash of the process. Log records are written on
+  # every commit, and survive even if not synced.
+  def commitsSurvive(self, durability, wal):
+    return wal or durability == 'fsyncPerCommit'
+
+  # Commits are durable in the fsyncPerCommit mode, across repeated crashes.
+  def checkCommitDurable(self, fileClass, wal):
+    self.createRelation(fileClass, 'fsyncPerCommit', wal, 100)
+    self.crash(crash, 'fsyncPerCommit', wal, 50, 20)
+    self.assertEqual(self.reopen('fsyncPerCommit', wal), (150, list(range(150))))
+
+    self.crash(crash, 'fsyncPerCommit', wal, 50, 20)
+    self.crash(crash, 'fsyncPerCommit', wal, 50, 20)
+    self.assertEqual(self.reopen('fsyncPerCommit', wal), (250, list(range(250))))
+
+  # After a crash in any mode, the relation's count matches its tuples, which include
+  # those written before the last clean close, and any committed tuples if commits
+  # survive crashes.
+  def checkCrash(self, durability, wal, fileClass, options=None):
+    self.createRelation(fileClass, durability, wal, 100)
+    self.crash(crash, durability, wal, 2000, 20, options)
+    (count, ids) = self.reopen(durability, wal)
+    self.assertEqual(ids, list(range(count)))
+    self.assertGreaterEqual(count, 100)
+    if self.commitsSurvive(durability, wal):
+      self.assertEqual(count, 2100)
+
+    self.crash(crash, durability, wal, 50, 20, options)
+    (count2, ids) = self.reopen(durability, wal)
+    self.assertEqual(ids, list(range(count2)))
+    self.assertGreaterEqual(count2, count)
+    if self.commitsSurvive(durability, wal):
+      self.assertEqual(count2, count + 50)
+
+  # Tests
+  def testCommitDurableStorageFile(self):
+    self.checkCommitDurable(StorageFile, False)
+
+  def testCommitDurableCompressedFile(self):
+    self.checkCommitDurable(CompressedStorageFile, False)
+
+  def testCommitDurableColumnarFile(self):
+    self.checkCommitDurable(ColumnarFile, False)
+
+  def testCommitDurableDirectFile(self):
+    self.checkCommitDurable(DirectStorageFile, False)
+
+  def testCommitDurableStorageFileWithLog(self):
+    self.checkCommitDurable(StorageFile, True)
+
+  def testCommitDurableCompressedFileWithLog(self):
+    self.checkCommitDurable(CompressedStorageFile, True)
+
+  def testCommitDurableColumnarFileWithLog(self):
+    self.checkCommitDurable(ColumnarFile, True)
+
+  def testCommitDurableDirectFileWithLog(self):
+    self.checkCommitDurable(DirectStorageFile, True)
+
+  # Closing the storage engine cleanly keeps all tuples, in every mode.
+  def testCleanReopen(self):
+    def check(durability, wal, fileClass):
+      self.createRelation(fileClass, durability, wal, 100)
+      storage = StorageEngine(durability=durability, wal=wal)
+      for tup in makeEmployees(100, 50):
+        storage.insertTuple(schema.name, tup)
+      storage.commit()
+      storage.close()
+      self.checkSyncs(storage)
+      self.assertEqual(self.reopen(durability, wal), (150, list(range(150))))
+    self.checkEach(check, durabilityModes, [False, True], fileClasses)
+
+  def testCrashEachMode(self):
+    self.checkEach(self.checkCrash, durabilityModes, [False], fileClasses)
+
+  def testCrashEachModeWithLog(self):
+    self.checkEach(self.checkCrash, durabilityModes, [True], fileClasses)
+
+  # Pages are evicted (into the compressed cache tier) while tuples are inserted,
+  # so that pages are written between commits.
+  def testCrashWithEvictions(self):
+    options = {'poolSize': 4 * 8192, 'compressedCacheSize': 4 * 8192}
+    self.checkEach(lambda durability, wal, fileClass: self.checkCrash(durability, wal, fileClass, options),
+                   ['none', 'fsyncPerCommit'], [False, True], fileClasses)
+
+  # Checkpoints run while tuples are inserted, discarding log records.
+  def testCrashWithCheckpoints(self):
+    options = {'poolSize': 4 * 8192, 'checkpointLogSize': 16 * 1024, 'checkpointPages': 2}
+    self.checkEach(lambda durability, fileClass: self.checkCrash(durability, True, fileClass, options),
+                   ['fsyncOnCheckpoint', 'fsyncPerCommit'], fileClasses)
+
+  # Segmented files keep all their segments across crashes.
+  def testCrashSegmentedFile(self):
+    def check(wal, fileClass):
+      self.createRelation(fileClass, 'fsyncPerCommit', wal, 100, segmentSize=2 * 8192)
+      self.crash(crash, 'fsyncPerCommit', wal, 5000, 20)
+      self.assertEqual(self.reopen('fsyncPerCommit', wal), (5100, list(range(5100))))
+    self.checkEach(check, [False, True], [StorageFile, DirectStorageFile])
+
+  # Updates and deletes, whose pages are written partially, survive a crash.
+  def testCrashAfterUpdates(self):
+    def check(wal, fileClass):
+      self.createRelation(fileClass, 'fsyncPerCommit', wal, 0)
+      self.crash(crashUpdate, 'fsyncPerCommit', wal)
+      expected = [schema.instantiate(i, 0 if i % 10 == 0 else 25 + i) for i in range(2000) if i % 10 != 1]
+      self.assertEqual(self.reopenTuples('fsyncPerCommit', wal), (len(expected), expected))
+    self.checkEach(check, [False, True], fileClasses)
+
+  # Relations created before a commit survive a crash, through the file manager's log.
+  def testCrashAfterCreateRelation(self):
+    def check(wal):
+      self.createRelation(StorageFile, 'fsyncPerCommit', wal, 100)
+      self.crash(crashCreate, 'fsyncPerCommit', wal)
+      expected = sorted(schema.unpack(tup) for tup in makeEmployees(0, 10))
+      self.assertEqual(self.reopenTuples('fsyncPerCommit', wal, 'department'), (10, expected))
+      self.assertEqual(self.reopen('fsyncPerCommit', wal), (100, list(range(100))))
+    self.checkEach(check, [False, True])
+
+  # Recovery does not restore truncated pages from earlier log records.
+  def testTruncateWithLog(self):
+    def check(fileClass):
+      self.createRelation(fileClass, 'fsyncPerCommit', True, 0)
+      self.crash(crashTruncate, 'fsyncPerCommit', True)
+
+      storage = StorageEngine(wal=True)
+      f       = storage.fileMgr.relationFile(schema.name)[1]
+      kept    = 2 * f.readPageHeader(f.pageId(0)).numTuples()
+      self.assertEqual(f.numPages(), 3)
+      storage.close()
+      self.assertEqual(self.reopen('fsyncPerCommit', True), (kept + 5, list(range(kept)) + list(range(5000, 5005))))
+    self.checkEach(check, [StorageFile, CompressedStorageFile])
+
+if __name__ == '__main__':
+  unittest.main(argv=[sys.argv[0], '-v'])
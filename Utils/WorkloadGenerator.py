@@ -1,6 +1,7 @@
 import io, math, os, os.path, random, time, timeit
 import sys
 
+from Catalog.Identifiers   import TupleIdArray
 from Catalog.Schema        import DBSchema
 from Storage.StorageEngine import StorageEngine
 
@@ -63,6 +64,9 @@ class WorkloadGenerator:
   Total time: ...
   """
 
+  # TPC-H tuples are stored without alignment padding.
+  schemaLayout = 'packed'
+
   def __init__(self):
     random.seed(a=12345)
     self.initializeSchemas()
@@ -156,7 +160,7 @@ class WorkloadGenerator:
                  ,   "iss")
       ]
 
-    self.schemas = dict(map(lambda x: (x[0], DBSchema(x[0], x[1])), tpchNamesAndFields))
+    self.schemas = dict(map(lambda x: (x[0], DBSchema(x[0], x[1], layout=WorkloadGenerator.schemaLayout)), tpchNamesAndFields))
     self.parsers = dict(map(lambda x: (x[0], self.buildParser(x[2])), tpchNamesAndFields))
 
   # Dates are represented as integers, e.g., 1996-01-01 becomes 19960101
@@ -191,6 +195,7 @@ class WorkloadGenerator:
 
   # Load the CSV files corresponding to the TPC-H relations into the given storage engine.
   # This method (naively) samples the dataset based on the scale factor.
+  # The tuple ids of loaded tuples are kept compactly in a TupleIdArray per relation.
   def loadDataset(self, storageEngine, datadir, scaleFactor):
     self.tupleIds = {}
     for i in self.schemas:
@@ -198,7 +203,7 @@ class WorkloadGenerator:
         filePath = os.path.join(datadir, i+".csv")
         if os.path.exists(filePath):
           with open(filePath) as f:
-            self.tupleIds[i] = []
+            self.tupleIds[i] = TupleIdArray()
             for line in f:
               if random.random() <= scaleFactor:
                 tup = self.schemas[i].instantiate(*(self.parsers[i].parse(line)))
@@ -213,10 +218,10 @@ class WorkloadGenerator:
     start = time.time()
     tuplesRead = 0
     
-    # Sequentially read through relations
+    # Sequentially read through relations, a page of tuples at a time
     for rel in relations:
-      for t in storageEngine.tuples(rel):
-        tuplesRead += 1
+      for (_, _, tupleIndexes) in storageEngine.tuples(rel, batch=True):
+        tuplesRead += len(tupleIndexes)
     
     end = time.time()
     #print("Tuples: " + str(tuplesRead))
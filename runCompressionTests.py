@@ -0,0 +1,41 @@
+from Utils.WorkloadGenerator import WorkloadGenerator
+from Storage.StorageEngine   import StorageEngine
+from Storage.File            import StorageFile
+from Storage.CompressedFile  import CompressedStorageFile
+import sys, time
+
+# Compares plain and compressed storage files for relations that are loaded
+# once and then scanned, reporting disk footprint, bytes read and scan time.
+#
+# Usage: python runCompressionTests.py [dataDir] [scaleFactor]
+dataDir     = sys.argv[1] if len(sys.argv) > 1 else 'test/datasets/tpch-tiny'
+scaleFactor = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+
+coldRelations = ['partsupp', 'customer']
+
+sys.stdout.write("File, Codec, Page size, Relation, Pages, Disk bytes, Bytes read, Scan time, Throughput\n")
+for (fileClass, codec) in [(StorageFile, None), (CompressedStorageFile, 'zlib'), (CompressedStorageFile, 'lzma')]:
+  for pageSize in [4096, 32768]:
+    wg = WorkloadGenerator()
+    storage = StorageEngine(pageSize=pageSize)
+    for rel in wg.schemas:
+      if storage.hasRelation(rel):
+        storage.removeRelation(rel)
+      options = {"fileClass": fileClass, "codec": codec} if codec and rel in coldRelations else {}
+      storage.createRelation(rel, wg.schemas[rel], **options)
+
+    wg.loadDataset(storage, dataDir, scaleFactor)
+    storage.fileMgr.close()
+
+    # Scan each relation from a fresh storage engine, so that pages are read from disk.
+    storage = StorageEngine(pageSize=pageSize)
+    for rel in coldRelations:
+      (_, rFile) = storage.fileMgr.relationFile(rel)
+      start = time.time()
+      tuplesRead = sum(1 for _ in storage.tuples(rel))
+      end = time.time()
+
+      sys.stdout.write(", ".join(map(str, [fileClass.__name__, codec, pageSize, rel, rFile.numPages(),
+                                           rFile.size(), rFile.bytesRead, end - start,
+                                           tuplesRead / (end - start)])) + "\n")
+    storage.fileMgr.close()
@@ -3,6 +3,8 @@ from Utils.WorkloadGenerator import WorkloadGenerator
 from Storage.File            import StorageFile
 from Storage.Page            import Page
 from Storage.SlottedPage     import SlottedPage
+from Storage.PaxPage         import PaxPage
+from Storage.CompressedPage  import CompressedPage
 import sys
 
 # Path to the folder containing csvs (on ugrad cluster)
@@ -22,29 +24,16 @@ dataDir = '/home/cs416/datasets/tpch-sf0.01/'
 #
 #sys.stdout.write(sys.argv[2] + ", " + sys.argv[3] + ", " + sys.argv[4] + ", ")
 
-StorageFile.defaultPageClass = Page
-for pageSize in [4096, 32768]:
-  for scaleFactor in [0.2, 0.4, 0.6, 0.8, 1.0]:
-    for workloadMode in [1, 2, 3, 4]:
-      try:
-        sys.stdout.write("Page, " + str(pageSize) + ", " + str(scaleFactor) + ", " + str(workloadMode) + ", ")
-        wg = WorkloadGenerator()
-        wg.runWorkload(dataDir, scaleFactor, pageSize, workloadMode)
-      except:
-        sys.stdout.write("Error, Error\n")
-
-StorageFile.defaultPageClass = SlottedPage
-for pageSize in [4096, 32768]:
-  for scaleFactor in [0.2, 0.4, 0.6, 0.8, 1.0]:
-    for workloadMode in [1, 2, 3, 4]:
-      try:
-        sys.stdout.write("SlottedPage, " + str(pageSize) + ", " + str(scaleFactor) + ", " + str(workloadMode) + ", ")
-        wg = WorkloadGenerator()
-        wg.runWorkload(dataDir, scaleFactor, pageSize, workloadMode)
-      except:
-        sys.stdout.write("Error, Error\n")
-
-
-
-
-
+# Compare each page class on the same workload matrix.
+for (pageClassName, pageClass) in [("Page", Page), ("SlottedPage", SlottedPage), ("PaxPage", PaxPage),
+                                  ("CompressedPage", CompressedPage)]:
+  StorageFile.defaultPageClass = pageClass
+  for pageSize in [4096, 32768]:
+    for scaleFactor in [0.2, 0.4, 0.6, 0.8, 1.0]:
+      for workloadMode in [1, 2, 3, 4]:
+        try:
+          sys.stdout.write(pageClassName + ", " + str(pageSize) + ", " + str(scaleFactor) + ", " + str(workloadMode) + ", ")
+          wg = WorkloadGenerator()
+          wg.runWorkload(dataDir, scaleFactor, pageSize, workloadMode)
+        except:
+          sys.stdout.write("Error, Error\n")